@@ -0,0 +1,180 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, IO, List, Optional, Sequence, Tuple
+
+import requests
+
+from ch_types import parse_type
+from csv_chunks import CsvChunk
+from query_builder import identifier, quote_identifier
+
+CLICKHOUSE_HTTP_PORT = int(os.getenv("CLICKHOUSE_HTTP_PORT", "8123"))
+HTTP_TIMEOUT = int(os.getenv("CLICKHOUSE_HTTP_TIMEOUT", "300"))
+
+# 'python' moves rows through pandas and the native driver, 'arrow' moves
+# Arrow record batches through the HTTP interface
+DATA_PLANES = ('python', 'arrow')
+DATA_PLANE = os.getenv("DATA_PLANE", "python")
+
+# Types ClickHouse writes to Arrow as plain numbers or binary, read back as text
+TEXT_EXPORT_TYPES = {'UUID', 'IPv4', 'IPv6', 'Int128', 'Int256', 'UInt128', 'UInt256'}
+DATETIME64_UNITS = {0: 's', 3: 'ms', 6: 'us', 9: 'ns'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError("The Arrow data plane requires the pyarrow package")
+    return pyarrow
+
+
+def arrow_type(ch_type: str):
+    """Arrow type a CSV column is parsed into before it is inserted as ch_type; None if there is none"""
+    pa = _pyarrow()
+    parsed = parse_type(ch_type)
+    name = parsed.inner.name
+    kind = parsed.kind
+    if kind == 'int':
+        return getattr(pa, name.lower())() if name in ('Int8', 'Int16', 'Int32', 'Int64', 'UInt8', 'UInt16',
+                                                      'UInt32', 'UInt64') else None
+    if kind == 'float':
+        return pa.float32() if name == 'Float32' else pa.float64()
+    if kind == 'decimal':
+        precision, scale = parsed.decimal_digits
+        return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+    if kind == 'date':
+        return pa.date32()
+    if kind == 'datetime':
+        precision = parsed.inner.args[0] if name == 'DateTime64' and parsed.inner.args else 0
+        unit = DATETIME64_UNITS.get(precision)
+        return pa.timestamp(unit, parsed.timezone) if unit else None
+    if kind == 'bool':
+        return pa.bool_()
+    if kind == 'enum' or (kind == 'str' and parsed.low_cardinality):
+        # Dictionary encoded from the parser to the server
+        return pa.dictionary(pa.int32(), pa.string())
+    if kind == 'str':
+        return pa.string()
+    return None
+
+
+def column_types(type_map: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Arrow parse types for every column, or None if a column has to take the Python plane"""
+    types = {}
+    for column, ch_type in type_map.items():
+        types[column] = arrow_type(ch_type)
+        if types[column] is None:
+            return None
+    return types
+
+
+def read_csv_chunk(chunk: CsvChunk, delimiter: str, types: Dict[str, Any]):
+    """Parse a chunk into an Arrow table; None when a value does not parse as its column type"""
+    pa = _pyarrow()
+    try:
+        return pa.csv.read_csv(
+            pa.py_buffer(chunk.header + chunk.data),
+            parse_options=pa.csv.ParseOptions(delimiter=delimiter),
+            convert_options=pa.csv.ConvertOptions(column_types=types)
+        )
+    except pa.ArrowInvalid:
+        return None
+
+
+def export_select(columns: Sequence[Tuple[str, str]]) -> List[str]:
+    """SELECT expressions whose Arrow output renders as the same text as the CSV export"""
+    expressions = []
+    for name, ch_type in columns:
+        column = quote_identifier(name)
+        parsed = parse_type(ch_type)
+        inner = parsed.inner.name
+        # ClickHouse writes Date and DateTime to Arrow as day and second counts
+        if inner == 'Date':
+            expressions.append(f"toDate32({column}) AS {column}")
+        elif inner == 'DateTime':
+            expressions.append(f"toDateTime64({column}, 0) AS {column}")
+        elif parsed.kind in ('enum', 'list', 'dict', 'tuple') or inner in TEXT_EXPORT_TYPES:
+            expressions.append(f"toString({column}) AS {column}")
+        else:
+            expressions.append(column)
+    return expressions
+
+
+@dataclass
+class ClickHouseHTTP:
+    """Arrow record batches in and out of ClickHouse's HTTP interface"""
+    host: str
+    port: int = CLICKHOUSE_HTTP_PORT
+    user: str = 'default'
+    password: str = ''
+    database: str = 'default'
+    jwt_token: Optional[str] = None
+
+    def _post(self, query: str, body=None, settings: Optional[Dict[str, Any]] = None, stream: bool = False):
+        params = {'database': self.database, **(settings or {})}
+        if body is None:
+            data = query.encode()
+        else:
+            params['query'] = query
+            data = body
+        if self.jwt_token:
+            headers = {'Authorization': f"Bearer {self.jwt_token}"}
+        else:
+            headers = {'X-ClickHouse-User': self.user, 'X-ClickHouse-Key': self.password}
+        response = requests.post(
+            f"http://{self.host}:{self.port}/",
+            params=params,
+            data=data,
+            headers=headers,
+            stream=stream,
+            timeout=HTTP_TIMEOUT
+        )
+        if response.status_code != 200:
+            message = response.text.strip()
+            response.close()
+            raise RuntimeError(message)
+        return response
+
+    def insert(self, table: str, batches, settings: Optional[Dict[str, Any]] = None) -> int:
+        """INSERT an Arrow table (or record batch); returns the number of rows sent"""
+        pa = _pyarrow()
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batches.schema) as writer:
+            writer.write(batches)
+        self.insert_encoded(table, batches.schema.names, pa.BufferReader(sink.getvalue()), 'ArrowStream', settings)
+        return batches.num_rows
+
+    def insert_encoded(self, table: str, columns: Sequence[str], body, input_format: str,
+                       settings: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+        """INSERT a body already in input_format, e.g. an iterator of Native blocks.
+
+        Returns the rows and bytes the server reports written.
+        """
+        names = ', '.join(quote_identifier(name) for name in columns)
+        response = self._post(f"INSERT INTO {identifier(table)} ({names}) FORMAT {input_format}", body, settings)
+        summary = json.loads(response.headers.get('X-ClickHouse-Summary', '{}'))
+        response.close()
+        return int(summary.get('written_rows', 0)), int(summary.get('written_bytes', 0))
+
+    def select_encoded(self, query: str, output_format: str, settings: Optional[Dict[str, Any]] = None):
+        """Streamed response to query in output_format; use it as a context manager to release the connection"""
+        return self._post(f"{query} FORMAT {output_format}", settings=settings, stream=True)
+
+    def export_csv(self, query: str, output: IO[bytes], header: Sequence[str],
+                   settings: Optional[Dict[str, Any]] = None) -> int:
+        """Write a query's result to output as CSV without building Python rows; returns the row count"""
+        pa = _pyarrow()
+        rows = 0
+        with self.select_encoded(query, 'ArrowStream', settings) as response:
+            reader = pa.ipc.open_stream(response.raw)
+            schema = pa.schema([field.with_name(name) for field, name in zip(reader.schema, header)])
+            options = pa.csv.WriteOptions(quoting_style='needed')
+            with pa.csv.CSVWriter(output, schema, write_options=options) as writer:
+                for batch in reader:
+                    writer.write_batch(pa.RecordBatch.from_arrays(batch.columns, schema=schema))
+                    rows += batch.num_rows
+        return rows
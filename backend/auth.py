@@ -0,0 +1,93 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+from fastapi import HTTPException, Security
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from metrics import Counter
+
+# JWT Settings
+SECRET_KEY = os.getenv("JWT_SECRET", "your-secret-key")  # In production, use a secure secret key
+ALGORITHM = "HS256"
+security = HTTPBearer()
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+# Upper bound on how long verified claims are reused, also for tokens without exp
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+TOKEN_CACHE_LOOKUPS = Counter(
+    'auth_token_cache_lookups_total', 'Token verifications answered from the cache or by decoding', ['result']
+)
+
+
+class TokenCache:
+    """Bounded LRU of verified claims keyed by token hash, expiring at the token's exp"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> str:
+        # Raw tokens are credentials; keep only their digest in memory
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        if 'exp' in claims:
+            expires_at = min(expires_at, float(claims['exp']))
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Verify a bearer token, reusing the claims of tokens verified before"""
+    claims = token_cache.get(token)
+    if claims is not None:
+        TOKEN_CACHE_LOOKUPS.inc(result='hit')
+        return claims
+    TOKEN_CACHE_LOOKUPS.inc(result='miss')
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token has expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # Only successful verifications are cached, so a bad token is rejected every time
+    token_cache.put(token, claims)
+    return claims
+
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)) -> Dict[str, Any]:
+    return decode_token(credentials.credentials)
@@ -0,0 +1,75 @@
+import glob
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from state import StateBackend
+
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "8"))
+BATCH_JOB_TTL = int(os.getenv("BATCH_JOB_TTL", str(24 * 3600)))
+# Directory server-local globs are resolved in; empty disables them
+BATCH_INGEST_ROOT = os.getenv("BATCH_INGEST_ROOT", "")
+
+
+def expand_glob(root: str, pattern: str) -> List[str]:
+    """Files under root matching pattern, in name order.
+
+    Raises ValueError for patterns that would reach outside root.
+    """
+    if not root:
+        raise ValueError("Server-local globs are disabled; set BATCH_INGEST_ROOT")
+    root = os.path.realpath(root)
+    if os.path.isabs(pattern) or '..' in pattern.replace('\\', '/').split('/'):
+        raise ValueError("Glob patterns must be relative to BATCH_INGEST_ROOT")
+    paths = []
+    for path in glob.glob(os.path.join(root, pattern), recursive=True):
+        real = os.path.realpath(path)
+        # Symlinks may still point elsewhere
+        if os.path.isfile(real) and os.path.commonpath([root, real]) == root:
+            paths.append(path)
+    return sorted(paths)
+
+
+class BatchJobStore:
+    """Per-file progress of batch ingest jobs, kept in the shared state backend"""
+
+    def __init__(self, state: StateBackend, ttl: float = BATCH_JOB_TTL):
+        self.state = state
+        self.ttl = ttl
+        # Files of one job finish on several threads of the process running it
+        self._lock = threading.Lock()
+
+    def start(self, job_id: str, table: str, files: List[str]) -> Dict[str, Any]:
+        job = {
+            'id': job_id,
+            'table': table,
+            'status': 'running',
+            'started_at': time.time(),
+            'finished_at': None,
+            'files': [{'file': name, 'status': 'pending'} for name in files]
+        }
+        self.state.set(f"batch_job:{job_id}", job, ex=self.ttl)
+        return job
+
+    def update(self, job_id: str, index: int, result: Dict[str, Any]):
+        with self._lock:
+            job = self.state.get(f"batch_job:{job_id}")
+            if job is None:
+                return
+            job['files'][index] = result
+            self.state.set(f"batch_job:{job_id}", job, ex=self.ttl)
+
+    def finish(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self.state.get(f"batch_job:{job_id}")
+            if job is None:
+                return None
+            failed = any(entry['status'] == 'failed' for entry in job['files'])
+            job['status'] = 'failed' if failed else 'completed'
+            job['finished_at'] = time.time()
+            self.state.set(f"batch_job:{job_id}", job, ex=self.ttl)
+            return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.state.get(f"batch_job:{job_id}")
@@ -0,0 +1,120 @@
+import os
+import threading
+from typing import Dict, Optional
+
+from metrics import register_collector
+
+BATCH_MIN_ROWS = int(os.getenv("BATCH_MIN_ROWS", "1000"))
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "1000000"))
+BATCH_INITIAL_ROWS = int(os.getenv("BATCH_INITIAL_ROWS", "10000"))
+BATCH_TARGET_SECONDS = float(os.getenv("BATCH_TARGET_SECONDS", "1.0"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Bound how fast the size moves after a single noisy measurement
+MAX_GROWTH = 2.0
+MAX_SHRINK = 0.5
+
+
+class BatchStats:
+    """Running summary of the batch sizes chosen for one pipeline"""
+
+    def __init__(self):
+        self.batches = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.min_rows: Optional[int] = None
+        self.max_rows: Optional[int] = None
+        self.last_rows: Optional[int] = None
+
+    def record(self, rows: int, nbytes: Optional[int], seconds: float):
+        self.batches += 1
+        self.rows += rows
+        self.bytes += nbytes or 0
+        self.seconds += seconds
+        self.min_rows = rows if self.min_rows is None else min(self.min_rows, rows)
+        self.max_rows = rows if self.max_rows is None else max(self.max_rows, rows)
+        self.last_rows = rows
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 6),
+            "min_rows": self.min_rows,
+            "max_rows": self.max_rows,
+            "last_rows": self.last_rows,
+            "avg_rows": self.rows / self.batches if self.batches else None,
+            "rows_per_second": self.rows / self.seconds if self.seconds else None
+        }
+
+
+_stats: Dict[str, BatchStats] = {}
+_stats_lock = threading.Lock()
+
+
+def batch_stats() -> Dict[str, Dict[str, Optional[float]]]:
+    with _stats_lock:
+        return {name: stats.to_dict() for name, stats in _stats.items()}
+
+
+def _batch_metrics():
+    stats = batch_stats()
+    return [
+        ('batch_last_rows', 'Row count chosen for the most recent batch',
+         [({'pipeline': name}, values['last_rows'] or 0) for name, values in stats.items()]),
+        ('batch_avg_rows', 'Average rows per batch since startup',
+         [({'pipeline': name}, values['avg_rows'] or 0) for name, values in stats.items()])
+    ]
+
+
+register_collector(_batch_metrics)
+
+
+class AdaptiveBatcher:
+    """Picks the next batch size from the latency and size of the previous one.
+
+    The row count is scaled towards whichever limit is tighter: the target
+    seconds per batch or the byte ceiling per batch, clamped to min/max rows.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_rows: int = BATCH_MIN_ROWS,
+        max_rows: int = BATCH_MAX_ROWS,
+        initial_rows: int = BATCH_INITIAL_ROWS,
+        target_seconds: float = BATCH_TARGET_SECONDS,
+        max_bytes: int = BATCH_MAX_BYTES
+    ):
+        self.name = name
+        self.min_rows = min_rows
+        self.max_rows = max(max_rows, min_rows)
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.rows = self._clamp(initial_rows)
+        with _stats_lock:
+            self.stats = _stats.setdefault(name, BatchStats())
+
+    def _clamp(self, rows: float) -> int:
+        return int(max(self.min_rows, min(self.max_rows, rows)))
+
+    def observe(self, rows: int, seconds: float, nbytes: Optional[int] = None) -> int:
+        """Record a finished batch and return the size to use for the next one"""
+        with _stats_lock:
+            self.stats.record(rows, nbytes, seconds)
+        if rows <= 0:
+            return self.rows
+
+        factor = MAX_GROWTH
+        if seconds > 0:
+            factor = min(factor, self.target_seconds / seconds)
+        if nbytes:
+            factor = min(factor, self.max_bytes / nbytes)
+        factor = max(MAX_SHRINK, factor)
+        # Shrink from what was actually sent, but grow from the current size so
+        # a short trailing batch does not drag the next one down
+        basis = rows if rows >= self.rows or factor < 1 else self.rows
+        self.rows = self._clamp(basis * factor)
+        return self.rows
@@ -0,0 +1,24 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='session')
+def backend_main():
+    import main
+    return main
+
+
+@pytest.fixture(scope='session')
+def root_main():
+    # Both services name their module main, so load the root one under another name
+    spec = importlib.util.spec_from_file_location('root_main', os.path.join(ROOT_DIR, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
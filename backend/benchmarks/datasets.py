@@ -0,0 +1,399 @@
+"""Synthetic uk_price_paid and ontime data at any scale, for load tests.
+
+Rows follow the exact table definitions in setup_example_datasets.py and are
+generated in NumPy blocks, each seeded by its position, so the output is the
+same for any number of workers.
+
+    cd backend
+    python -m benchmarks.datasets uk_price_paid --rows 1000000 --output uk_price_paid.csv.gz
+    python -m benchmarks.datasets ontime --rows 100000000 --output ontime.parquet --workers 8
+    python -m benchmarks.datasets ontime --rows 1000000000 --clickhouse --table ontime_1b --workers 8
+
+Files written with --no-header are accepted by setup_example_datasets.py --mirror.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from setup_example_datasets import CLICKHOUSE_HOST, CLICKHOUSE_PASSWORD, CLICKHOUSE_PORT, CLICKHOUSE_USER  # noqa: E402
+from setup_example_datasets import ONTIME_TABLE, UK_PRICE_PAID_TABLE, insert_csv  # noqa: E402
+
+DEFAULT_BLOCK_ROWS = 1_000_000
+LETTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+NUMBERS = np.array([str(i) for i in range(10000)])
+
+POSTCODE_AREAS = (
+    'AB AL B BA BB BD BH BL BN BR BS CA CB CF CH CM CO CR CT CV CW DA DD DE DH DL DN DT DY E EC EH EN EX '
+    'FY G GL GU HA HD HG HP HR HU HX IG IP KT L LA LE LN LS LU M ME MK N NE NG NN NP NR NW OL OX PE PL PO '
+    'PR RG RH RM S SE SG SK SL SM SN SO SP SR SS ST SW SY TA TF TN TQ TR TS TW UB W WA WC WD WF WN WR WS WV YO'
+).split()
+STREET_SUFFIXES = ['ROAD', 'STREET', 'LANE', 'AVENUE', 'CLOSE', 'DRIVE', 'WAY', 'GARDENS', 'COURT', 'PLACE',
+                   'CRESCENT', 'GROVE', 'TERRACE', 'HILL', 'PARK', 'WALK']
+PROPERTY_TYPES = (['terraced', 'semi-detached', 'detached', 'flat', 'other'], [0.28, 0.27, 0.23, 0.18, 0.04])
+DURATIONS = (['freehold', 'leasehold', 'unknown'], [0.7598, 0.24, 0.0002])
+CATEGORIES = (['A', 'B'], [0.98, 0.02])
+
+CARRIERS = ['WN', 'DL', 'AA', 'UA', 'OO', 'US', 'MQ', 'EV', 'NW', 'CO', 'B6', 'AS', 'XE', 'OH', 'F9', 'NK',
+            '9E', 'YX', 'HA', 'G4']
+STATES = (
+    'AL AK AZ AR CA CO CT DE DC FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN MS MO MT NE NV NH NJ NM NY NC ND '
+    'OH OK OR PA PR RI SC SD TN TX UT VT VA WA WV WI WY'
+).split()
+CANCELLATION_CODES = (['A', 'B', 'C', 'D'], [0.3, 0.45, 0.249, 0.001])
+
+
+def table_columns(ddl: str) -> List[Tuple[str, str]]:
+    """(name, type) of each column in a one-column-per-line CREATE TABLE"""
+    body = ddl[ddl.index('(') + 1:ddl.index(') ENGINE')]
+    columns = []
+    for line in body.strip().splitlines():
+        name, ch_type = line.strip().rstrip(',').split(' ', 1)
+        columns.append((name, ch_type))
+    return columns
+
+
+def _zipf(n: int, s: float = 1.0) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _words(rng: np.random.Generator, count: int, lengths=range(4, 10)) -> np.ndarray:
+    """count random upper-case words, built as fixed-width character rows"""
+    words = []
+    for length in lengths:
+        letters = LETTERS[rng.integers(0, 26, (count // len(lengths) + 1, length))]
+        words.append(np.ascontiguousarray(letters).view(f'<U{length}').ravel())
+    return np.unique(np.concatenate(words))[:count].astype(object)
+
+
+def _choice(rng: np.random.Generator, values, rows: int, p=None) -> np.ndarray:
+    return np.asarray(values, dtype=object)[rng.choice(len(values), rows, p=p)]
+
+
+@lru_cache(maxsize=None)
+def _uk_vocabulary() -> Dict[str, np.ndarray]:
+    # Fixed seed: the same places, towns and streets whatever seed the rows use
+    rng = np.random.default_rng(0)
+    letters = np.array(list('ABDEFGHJLNPQRSTUWXYZ'))
+    outward = np.array([f"{area}{district}" for area in POSTCODE_AREAS for district in range(1, 26)], dtype=object)
+    inward = np.array([f"{digit}{a}{b}" for digit in range(10) for a in letters for b in letters], dtype=object)
+    stems = _words(rng, 6000)
+    streets = np.array([f"{stem} {suffix}" for stem in stems for suffix in STREET_SUFFIXES], dtype=object)
+    towns, districts, counties = _words(rng, 1200), _words(rng, 470), _words(rng, 130)
+    # Each town lies in one district and each district in one county
+    town_district = rng.integers(0, len(districts), len(towns))
+    district_county = rng.integers(0, len(counties), len(districts))
+    return {
+        'outward': outward[rng.permutation(len(outward))],
+        'inward': inward,
+        'streets': streets[rng.permutation(len(streets))],
+        'house_names': stems,
+        'localities': _words(rng, 20000),
+        'towns': towns,
+        'town_district': districts[town_district],
+        'town_county': counties[district_county[town_district]],
+        'flats': np.array([f"FLAT {n}" for n in range(1, 200)], dtype=object)
+    }
+
+
+def uk_price_paid_block(rng: np.random.Generator, rows: int) -> Dict[str, Any]:
+    vocabulary = _uk_vocabulary()
+    towns = rng.choice(len(vocabulary['towns']), rows, p=_zipf(len(vocabulary['towns']), 1.1))
+    named = rng.random(rows) < 0.12
+    house_numbers = NUMBERS[np.minimum(rng.geometric(1 / 40, rows), 9999)].astype(object)
+    house_names = vocabulary['house_names'][rng.integers(0, len(vocabulary['house_names']), rows)]
+    locality = vocabulary['localities'][rng.choice(len(vocabulary['localities']), rows, p=_zipf(len(vocabulary['localities']), 0.7))]
+    return {
+        'price': np.clip(rng.lognormal(np.log(180000), 0.75, rows), 100, 4_000_000_000).astype(np.uint32),
+        'date': np.datetime64('1995-01-01') + rng.integers(0, 10957, rows).astype('timedelta64[D]'),
+        'postcode1': vocabulary['outward'][rng.choice(len(vocabulary['outward']), rows, p=_zipf(len(vocabulary['outward']), 0.6))],
+        'postcode2': vocabulary['inward'][rng.integers(0, len(vocabulary['inward']), rows)],
+        'type': _choice(rng, PROPERTY_TYPES[0], rows, p=PROPERTY_TYPES[1]),
+        'is_new': (rng.random(rows) < 0.1).astype(np.uint8),
+        'duration': _choice(rng, DURATIONS[0], rows, p=DURATIONS[1]),
+        'addr1': np.where(named, house_names, house_numbers),
+        'addr2': np.where(rng.random(rows) < 0.12, vocabulary['flats'][rng.integers(0, 199, rows)], ''),
+        'street': vocabulary['streets'][rng.choice(len(vocabulary['streets']), rows, p=_zipf(len(vocabulary['streets']), 0.5))],
+        'locality': np.where(rng.random(rows) < 0.35, '', locality),
+        'town': vocabulary['towns'][towns],
+        'district': vocabulary['town_district'][towns],
+        'county': vocabulary['town_county'][towns],
+        'category': _choice(rng, CATEGORIES[0], rows, p=CATEGORIES[1])
+    }
+
+
+@lru_cache(maxsize=None)
+def _ontime_vocabulary() -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    codes = np.unique(np.ascontiguousarray(LETTERS[rng.integers(0, 26, (2000, 3))]).view('<U3').ravel())
+    airports = rng.permutation(codes)[:350].astype(object)
+    states = rng.integers(0, len(STATES), len(airports))
+    cities = _words(rng, len(airports))
+    tails = np.unique(np.array([f"N{n}{a}{b}" for n, a, b in zip(
+        rng.integers(100, 9999, 9000), LETTERS[rng.integers(0, 26, 9000)], LETTERS[rng.integers(0, 26, 9000)]
+    )], dtype=object))
+    return {
+        'airports': airports,
+        'airport_state': np.array(STATES, dtype=object)[states],
+        'airport_fips': np.array([f"{i + 1:02d}" for i in range(len(STATES))], dtype=object)[states],
+        'airport_state_name': np.array([f"State of {code}" for code in STATES], dtype=object)[states],
+        'airport_wac': (states * 10 + 1).astype(np.int32),
+        'airport_city': np.array([f"{city.title()}, {STATES[state]}" for city, state in zip(cities, states)], dtype=object),
+        'tails': tails,
+        'time_blocks': np.array([f"{hour:02d}00-{hour:02d}59" for hour in range(24)], dtype=object),
+        'delay_groups': np.array([str(group) for group in range(-2, 13)], dtype=object)
+    }
+
+
+def _hhmm(minutes: np.ndarray) -> np.ndarray:
+    minutes = minutes % 1440
+    return ((minutes // 60) * 100 + minutes % 60).astype(np.int32)
+
+
+def ontime_block(rng: np.random.Generator, rows: int) -> Dict[str, Any]:
+    vocabulary = _ontime_vocabulary()
+    airport_weights = _zipf(len(vocabulary['airports']), 1.0)
+    origin = rng.choice(len(airport_weights), rows, p=airport_weights)
+    dest = rng.choice(len(airport_weights), rows, p=airport_weights)
+    dest = np.where(dest == origin, (dest + 1) % len(airport_weights), dest)
+    carrier = rng.choice(len(CARRIERS), rows, p=_zipf(len(CARRIERS), 0.8))
+    dates = np.datetime64('1987-10-01') + rng.integers(0, 13241, rows).astype('timedelta64[D]')
+    months = dates.astype('datetime64[M]')
+    month = months.astype(np.int64) % 12 + 1
+
+    distance = np.clip(rng.lognormal(np.log(650), 0.65, rows), 31, 4983).astype(np.int32)
+    crs_elapsed = (distance / 7.8 + 45).astype(np.int32)
+    taxi_out = (5 + rng.gamma(2.0, 6.0, rows)).astype(np.int32)
+    taxi_in = (3 + rng.gamma(2.0, 2.5, rows)).astype(np.int32)
+    air_time = np.maximum(distance / 7.8 + 18 + rng.normal(0, 6, rows), 15).astype(np.int32)
+    actual_elapsed = air_time + taxi_out + taxi_in
+    # Most flights leave within minutes of schedule; a minority is badly late
+    dep_delay = np.round(rng.exponential(10, rows) - 7 + (rng.random(rows) < 0.18) * rng.exponential(45, rows)).astype(np.int32)
+    arr_delay = dep_delay + actual_elapsed - crs_elapsed
+    crs_dep = rng.integers(300, 1440, rows)
+    dep = crs_dep + dep_delay
+
+    cancelled = rng.random(rows) < 0.017
+    diverted = ~cancelled & (rng.random(rows) < 0.0025)
+    flown = ~cancelled
+    late = flown & (arr_delay >= 15)
+    causes = rng.gamma(0.5, 1.0, (rows, 5))
+    causes = (causes / causes.sum(axis=1, keepdims=True) * np.where(late, arr_delay, 0)[:, None]).astype(np.int32)
+
+    def when_flown(values):
+        return np.where(flown, values, 0).astype(np.int32)
+
+    block = {
+        'Year': (months.astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.uint16),
+        'Quarter': ((month - 1) // 3 + 1).astype(np.uint8),
+        'Month': month.astype(np.uint8),
+        'DayofMonth': ((dates - months).astype(np.int64) + 1).astype(np.uint8),
+        # 1970-01-01 was a Thursday; 1 is Monday
+        'DayOfWeek': ((dates.astype(np.int64) + 3) % 7 + 1).astype(np.uint8),
+        'FlightDate': dates,
+        'UniqueCarrier': np.array(CARRIERS, dtype=object)[carrier],
+        'AirlineID': (19000 + carrier).astype(np.int32),
+        'Carrier': np.array(CARRIERS, dtype=object)[carrier],
+        'TailNum': vocabulary['tails'][rng.integers(0, len(vocabulary['tails']), rows)],
+        'FlightNum': NUMBERS[rng.integers(1, 7500, rows)].astype(object),
+        'CRSDepTime': _hhmm(crs_dep),
+        'DepTime': when_flown(_hhmm(dep)),
+        'DepDelay': when_flown(dep_delay),
+        'DepDelayMinutes': when_flown(np.maximum(dep_delay, 0)),
+        'DepDel15': when_flown(dep_delay >= 15),
+        'DepartureDelayGroups': np.where(flown, vocabulary['delay_groups'][np.clip(dep_delay // 15, -2, 12) + 2], ''),
+        'DepTimeBlk': vocabulary['time_blocks'][(crs_dep // 60) % 24],
+        'TaxiOut': when_flown(taxi_out),
+        'WheelsOff': when_flown(_hhmm(dep + taxi_out)),
+        'WheelsOn': when_flown(_hhmm(dep + taxi_out + air_time)),
+        'TaxiIn': when_flown(taxi_in),
+        'CRSArrTime': _hhmm(crs_dep + crs_elapsed),
+        'ArrTime': when_flown(_hhmm(dep + actual_elapsed)),
+        'ArrDelay': when_flown(arr_delay),
+        'ArrDelayMinutes': when_flown(np.maximum(arr_delay, 0)),
+        'ArrDel15': when_flown(arr_delay >= 15),
+        'ArrivalDelayGroups': np.where(flown, vocabulary['delay_groups'][np.clip(arr_delay // 15, -2, 12) + 2], ''),
+        'ArrTimeBlk': vocabulary['time_blocks'][((crs_dep + crs_elapsed) // 60) % 24],
+        'Cancelled': cancelled.astype(np.uint8),
+        'CancellationCode': np.where(cancelled, _choice(rng, CANCELLATION_CODES[0], rows, p=CANCELLATION_CODES[1]), ''),
+        'Diverted': diverted.astype(np.uint8),
+        'CRSElapsedTime': crs_elapsed,
+        'ActualElapsedTime': when_flown(actual_elapsed),
+        'AirTime': when_flown(air_time),
+        'Flights': np.ones(rows, dtype=np.int32),
+        'Distance': distance,
+        'DistanceGroup': np.minimum(distance // 250 + 1, 11).astype(np.uint8),
+        'CarrierDelay': causes[:, 0],
+        'WeatherDelay': causes[:, 1],
+        'NASDelay': causes[:, 2],
+        'SecurityDelay': causes[:, 3],
+        'LateAircraftDelay': causes[:, 4]
+    }
+    for prefix, airport in (('Origin', origin), ('Dest', dest)):
+        block.update({
+            f'{prefix}AirportID': (10000 + airport).astype(np.int32),
+            f'{prefix}AirportSeqID': ((10000 + airport) * 100 + 2).astype(np.int32),
+            f'{prefix}CityMarketID': (30000 + airport % 300).astype(np.int32),
+            prefix: vocabulary['airports'][airport],
+            f'{prefix}CityName': vocabulary['airport_city'][airport],
+            f'{prefix}State': vocabulary['airport_state'][airport],
+            f'{prefix}StateFips': vocabulary['airport_fips'][airport],
+            f'{prefix}StateName': vocabulary['airport_state_name'][airport],
+            f'{prefix}Wac': vocabulary['airport_wac'][airport]
+        })
+    return block
+
+
+DATASETS: Dict[str, Tuple[str, Callable[[np.random.Generator, int], Dict[str, Any]]]] = {
+    'uk_price_paid': (UK_PRICE_PAID_TABLE, uk_price_paid_block),
+    'ontime': (ONTIME_TABLE, ontime_block)
+}
+
+
+def _generate(name: str, index: int, rows: int, seed: int) -> Tuple[Dict[str, Any], List[Tuple[str, str]]]:
+    ddl, generate = DATASETS[name]
+    return generate(np.random.default_rng([seed, index]), rows), table_columns(ddl)
+
+
+def _frame(data: Dict[str, Any], columns: List[Tuple[str, str]], rows: int) -> pd.DataFrame:
+    frame = {}
+    for column, ch_type in columns:
+        if column in data:
+            frame[column] = data[column]
+        else:
+            # Diversion details and other rarely filled columns stay empty
+            frame[column] = np.zeros(rows, dtype=np.int32) if 'Int' in ch_type else np.full(rows, '', dtype=object)
+    return pd.DataFrame(frame)
+
+
+def make_block(name: str, index: int, rows: int, seed: int = 0) -> pd.DataFrame:
+    """Block number index of a dataset, in table column order"""
+    data, columns = _generate(name, index, rows, seed)
+    return _frame(data, columns, rows)
+
+
+def make_csv_block(name: str, index: int, rows: int, seed: int = 0) -> bytes:
+    """The same block as headerless CSV"""
+    data, columns = _generate(name, index, rows, seed)
+    # Empty columns at the end of the table are rendered once, as a suffix of every line
+    filled = len(columns)
+    while filled and columns[filled - 1][0] not in data:
+        filled -= 1
+    csv = _frame(data, columns[:filled], rows).to_csv(index=False, header=False).encode()
+    suffix = b''.join(b',0' if 'Int' in ch_type else b',' for _, ch_type in columns[filled:])
+    return csv.replace(b'\n', suffix + b'\n') if suffix else csv
+
+
+def iter_blocks(make: Callable, name: str, rows: int, block_rows: int = DEFAULT_BLOCK_ROWS, seed: int = 0,
+                workers: int = 1) -> Iterator[Any]:
+    """make() for each block of the dataset in order, spread over worker processes"""
+    blocks = [(index, min(block_rows, rows - start)) for index, start in enumerate(range(0, rows, block_rows))]
+    if workers <= 1:
+        for index, count in blocks:
+            yield make(name, index, count, seed)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        # Only a few blocks ahead of the consumer are kept in memory
+        pending = deque()
+        for index, count in blocks:
+            pending.append(executor.submit(make, name, index, count, seed))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_csv(name: str, path: str, rows: int, header: bool = True, **options) -> int:
+    size = 0
+    # Fast compression keeps gzip from becoming the bottleneck of large runs
+    with (gzip.open(path, 'wb', compresslevel=1) if path.endswith('.gz') else open(path, 'wb')) as f:
+        if header:
+            f.write(','.join(column for column, _ in table_columns(DATASETS[name][0])).encode() + b'\n')
+        for data in iter_blocks(make_csv_block, name, rows, **options):
+            f.write(data)
+            size += len(data)
+    return size
+
+
+def write_parquet(name: str, path: str, rows: int, **options) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet output requires the pyarrow package")
+    writer = None
+    try:
+        for frame in iter_blocks(make_block, name, rows, **options):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            for i, (column, ch_type) in enumerate(table_columns(DATASETS[name][0])):
+                if ch_type == 'Date':
+                    table = table.set_column(i, column, table.column(i).cast(pa.date32()))
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return os.path.getsize(path)
+
+
+def load_clickhouse(name: str, table: str, rows: int, **options) -> int:
+    """Create table with the dataset's schema and stream the rows into it"""
+    from clickhouse_driver import Client
+
+    ddl = DATASETS[name][0].replace(f"EXISTS {name} (", f"EXISTS {table} (", 1)
+    client = Client(CLICKHOUSE_HOST, port=CLICKHOUSE_PORT, user=CLICKHOUSE_USER, password=CLICKHOUSE_PASSWORD)
+    client.execute(ddl)
+    size = 0
+
+    def blocks():
+        nonlocal size
+        for data in iter_blocks(make_csv_block, name, rows, **options):
+            size += len(data)
+            yield data
+
+    insert_csv(f"INSERT INTO {table} FORMAT CSV", blocks())
+    return size
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataset', choices=sorted(DATASETS))
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--block-rows', type=int, default=DEFAULT_BLOCK_ROWS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='generator processes')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output', help='.csv, .csv.gz or .parquet file to write')
+    target.add_argument('--clickhouse', action='store_true', help='insert into the ClickHouse from CLICKHOUSE_*')
+    parser.add_argument('--table', help='table to load with --clickhouse (default: the dataset name)')
+    parser.add_argument('--no-header', action='store_true', help='omit the CSV header, as in the public downloads')
+    args = parser.parse_args(argv)
+
+    options = {'block_rows': args.block_rows, 'seed': args.seed, 'workers': args.workers}
+    started = time.perf_counter()
+    if args.clickhouse:
+        size = load_clickhouse(args.dataset, args.table or args.dataset, args.rows, **options)
+    elif args.output.endswith('.parquet'):
+        size = write_parquet(args.dataset, args.output, args.rows, **options)
+    else:
+        size = write_csv(args.dataset, args.output, args.rows, header=not args.no_header, **options)
+    elapsed = time.perf_counter() - started
+    print(f"{args.rows} rows ({size / 1e6:.0f} MB) in {elapsed:.1f}s, {args.rows / elapsed:.0f} rows/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Micro-benchmarks for the pure-Python hot paths, run without a server.
+
+    cd backend
+    pytest benchmarks/ --benchmark-only
+    pytest benchmarks/ --benchmark-only --benchmark-autosave --benchmark-compare
+"""
+import asyncio
+import io
+
+import pytest
+
+from benchmarks.transfers import synthetic_frame, schema_for
+from fake_clickhouse import FakeClient
+import query_builder
+
+ROWS = 10000
+
+
+@pytest.fixture(scope='module')
+def frame():
+    return synthetic_frame(ROWS, 8, ['int', 'float', 'str', 'date'])
+
+
+@pytest.fixture(scope='module')
+def csv_bytes(frame):
+    return frame.to_csv(index=False).encode()
+
+
+@pytest.fixture
+def fake_client(frame):
+    client = FakeClient()
+    client.add_table('bench', schema_for(frame), list(frame.itertuples(index=False, name=None)))
+    return client
+
+
+def test_check_type_compatibility(benchmark, backend_main, frame):
+    values = list(frame['c0_int'])
+
+    def check():
+        return [backend_main.check_type_compatibility(value, 'Nullable(Int64)') for value in values]
+
+    assert all(ok for ok, _ in benchmark(check))
+
+
+def test_convert_value(benchmark, root_main, frame):
+    values = list(frame['c3_date'])
+    benchmark(lambda: [root_main.convert_value(value, 'date') for value in values])
+
+
+def test_infer_python_type(benchmark, root_main, frame):
+    values = list(frame['c3_date'][:1000]) + list(frame['c2_str'][:1000])
+    benchmark(lambda: [root_main.infer_python_type(value) for value in values])
+
+
+@pytest.mark.parametrize('module_name', ['backend_main', 'root_main'])
+def test_build_join_query(benchmark, request, module_name):
+    module = request.getfixturevalue(module_name)
+    join_config = {
+        'joinType': 'LEFT',
+        'tables': [{'table': f"t{i}", 'key': 'id'} for i in range(5)]
+    }
+    columns = [f"t0.c{i}" for i in range(20)]
+    assert benchmark(module.build_join_query, join_config, columns).sql.startswith('SELECT')
+
+
+def test_frame_to_rows(benchmark, backend_main, frame):
+    assert len(benchmark(backend_main.frame_to_rows, frame)) == ROWS
+
+
+def test_import_csv_pipeline(benchmark, backend_main, csv_bytes, fake_client):
+    def run():
+        return backend_main.import_csv(fake_client, 'bench', io.BytesIO(csv_bytes))
+
+    assert benchmark(run)['records_processed'] == ROWS
+
+
+def test_stream_data_export(benchmark, backend_main, frame, fake_client):
+    query = query_builder.select('bench', list(frame.columns))
+
+    async def drain():
+        rows = 0
+        async for batch in backend_main.stream_data(fake_client, query):
+            rows += len(batch)
+        return rows
+
+    assert benchmark(lambda: asyncio.run(drain())) == ROWS
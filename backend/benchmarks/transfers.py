@@ -0,0 +1,234 @@
+"""Throughput benchmarks for the import, export, preview and root transfer paths.
+
+Each scenario runs in a fresh process so its peak RSS is measured in
+isolation. Requests are driven in-process through the ASGI apps, either
+against a live ClickHouse (--live) or the in-memory FakeClient.
+
+    cd backend
+    python -m benchmarks.transfers --rows 200000 --output results.json
+    python -m benchmarks.transfers --rows 200000 --baseline results.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+SCENARIOS = ('import', 'export', 'preview', 'transfer')
+TYPE_MIX = ('int', 'float', 'str', 'date')
+CLICKHOUSE_TYPES = {'int': 'Int64', 'float': 'Float64', 'str': 'String', 'date': 'Date'}
+IMPORT_TABLE = 'bench_import'
+EXPORT_TABLE = 'bench_export'
+
+
+def synthetic_frame(rows: int, columns: int, type_mix: List[str], seed: int = 0) -> pd.DataFrame:
+    """Build a DataFrame whose column types cycle through type_mix"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(columns):
+        kind = type_mix[i % len(type_mix)]
+        name = f"c{i}_{kind}"
+        if kind == 'int':
+            data[name] = rng.integers(0, 1_000_000, rows)
+        elif kind == 'float':
+            data[name] = rng.random(rows) * 1000
+        elif kind == 'date':
+            data[name] = (np.datetime64('2000-01-01') + rng.integers(0, 9000, rows)).astype(str)
+        else:
+            vocabulary = np.array([f"value_{n}" for n in range(1000)])
+            data[name] = vocabulary[rng.integers(0, len(vocabulary), rows)]
+    return pd.DataFrame(data)
+
+
+def schema_for(frame: pd.DataFrame) -> List[tuple]:
+    return [(name, CLICKHOUSE_TYPES[name.split('_', 1)[1]]) for name in frame.columns]
+
+
+def _load_root_app():
+    # Both services name their module main, so load the root one under another name
+    spec = importlib.util.spec_from_file_location('root_main', os.path.join(ROOT_DIR, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_scenario(scenario: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one scenario in the current process and return its measurements"""
+    sys.path.insert(0, BACKEND_DIR)
+    work_dir = tempfile.mkdtemp(prefix='ch_bench_')
+    os.environ.setdefault('CHECKPOINT_DB', os.path.join(work_dir, 'checkpoints.db'))
+    os.environ.setdefault('REPORT_DB', os.path.join(work_dir, 'reports.db'))
+
+    from fastapi.testclient import TestClient
+    import main as backend_main
+    from fake_clickhouse import FakeClient
+
+    frame = synthetic_frame(options['rows'], options['columns'], options['types'], options['seed'])
+    schema = schema_for(frame)
+    csv_path = os.path.join(work_dir, 'input.csv')
+    frame.to_csv(csv_path, index=False)
+    csv_bytes = os.path.getsize(csv_path)
+    column_defs = ', '.join(f"{name} {ch_type}" for name, ch_type in schema)
+    connection = {
+        'host': os.getenv('CLICKHOUSE_HOST', 'localhost'),
+        'port': int(os.getenv('CLICKHOUSE_PORT', '9000')),
+        'database': os.getenv('CLICKHOUSE_DATABASE', 'default'),
+        'user': os.getenv('CLICKHOUSE_USER', 'default'),
+        'password': os.getenv('CLICKHOUSE_PASSWORD', '')
+    }
+
+    if options['live']:
+        client = backend_main.get_clickhouse_client(backend_main.ClickHouseConfig(**connection))
+        for table in (IMPORT_TABLE, EXPORT_TABLE):
+            client.execute(f"DROP TABLE IF EXISTS {table}")
+            client.execute(f"CREATE TABLE {table} ({column_defs}) ENGINE = MergeTree() ORDER BY tuple()")
+        if scenario in ('export', 'preview'):
+            client.insert_dataframe(f"INSERT INTO {EXPORT_TABLE} VALUES", frame.astype(object),
+                                    settings={'use_numpy': False})
+    else:
+        client = FakeClient()
+        client.add_table(IMPORT_TABLE, schema)
+        client.add_table(EXPORT_TABLE, schema, list(frame.itertuples(index=False, name=None)))
+        backend_main.set_client_factory(lambda config=None: client)
+
+    backend_main.app.dependency_overrides[backend_main.verify_token] = lambda: {}
+    http = TestClient(backend_main.app)
+    columns = list(frame.columns)
+
+    if scenario == 'import':
+        def request():
+            with open(csv_path, 'rb') as f:
+                return http.post(f"/ingest/file-to-ch?table={IMPORT_TABLE}&dedup=false", files={'file': ('input.csv', f)})
+    elif scenario == 'export':
+        def request():
+            return http.post(f"/ingest/ch-to-file?table={EXPORT_TABLE}",
+                             json={'columns': columns, 'config': connection})
+    elif scenario == 'preview':
+        def request():
+            return http.post(f"/clickhouse/preview?table={EXPORT_TABLE}&limit=100", json=columns)
+    elif scenario == 'transfer':
+        root_main = _load_root_app()
+        root_main.app.dependency_overrides[root_main.verify_token] = lambda: None
+        if not options['live']:
+            root_main.connect_from_config = lambda config, token: client
+        root_http = TestClient(root_main.app)
+
+        def request():
+            return root_http.post(
+                "/transfer",
+                params={'source': 'flatfile', 'target': 'clickhouse', 'table': IMPORT_TABLE,
+                        'transfer_id': uuid.uuid4().hex},
+                json={'columns': columns, 'config': {'filePath': csv_path, 'delimiter': ',',
+                                                    'username': connection['user'], **connection}}
+            )
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    rows_per_request = min(100, options['rows']) if scenario == 'preview' else options['rows']
+    latencies = []
+    for i in range(options['warmup'] + options['repeat']):
+        started = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"{scenario} failed with {response.status_code}: {response.text[:500]}")
+        if i >= options['warmup']:
+            latencies.append(elapsed)
+
+    total = sum(latencies)
+    return {
+        'scenario': scenario,
+        'rows': rows_per_request,
+        'csv_bytes': csv_bytes,
+        'repeat': len(latencies),
+        'rows_per_second': rows_per_request * len(latencies) / total if total else 0.0,
+        'p50_seconds': _percentile(latencies, 50),
+        'p99_seconds': _percentile(latencies, 99),
+        'mean_seconds': statistics.mean(latencies),
+        # ru_maxrss is reported in KiB on Linux and bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """List the scenarios whose throughput, latency or memory regressed past tolerance"""
+    regressions = []
+    for scenario, result in results.items():
+        previous = baseline.get(scenario)
+        if not previous:
+            continue
+        if result['rows_per_second'] < previous['rows_per_second'] * (1 - tolerance):
+            regressions.append(f"{scenario}: rows/s {result['rows_per_second']:.0f} < baseline {previous['rows_per_second']:.0f}")
+        if result['p99_seconds'] > previous['p99_seconds'] * (1 + tolerance):
+            regressions.append(f"{scenario}: p99 {result['p99_seconds']:.3f}s > baseline {previous['p99_seconds']:.3f}s")
+        if result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{scenario}: peak RSS {result['peak_rss_mb']:.0f}MB > baseline {previous['peak_rss_mb']:.0f}MB")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset of %s' % ', '.join(SCENARIOS))
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=8)
+    parser.add_argument('--types', default=','.join(TYPE_MIX), help='column type mix, cycled across columns')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--live', action='store_true', help='use the ClickHouse from CLICKHOUSE_* instead of the fake client')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against a previous results file')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative regression')
+    args = parser.parse_args(argv)
+
+    options = {
+        'rows': args.rows, 'columns': args.columns, 'types': args.types.split(','),
+        'repeat': args.repeat, 'warmup': args.warmup, 'seed': args.seed, 'live': args.live
+    }
+    results = {}
+    for scenario in args.scenarios.split(','):
+        # A fresh process per scenario keeps peak RSS and module state independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(run_scenario, scenario, options).result()
+        results[scenario] = result
+        print(f"{scenario:<10} {result['rows_per_second']:>12,.0f} rows/s  "
+              f"p50 {result['p50_seconds']:.3f}s  p99 {result['p99_seconds']:.3f}s  "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': options, 'python': platform.python_version(), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('options') != options:
+            print("warning: baseline was recorded with different options")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from clickhouse_driver import Client
+
+from arrow_plane import ClickHouseHTTP
+from query_builder import identifier, quote_identifier
+from reports import query_id, record_query
+
+# 'remote' has the target server pull rows with INSERT ... SELECT FROM remote(),
+# 'stream' pipes Native blocks from the source's HTTP interface into the target's
+TRANSFER_MODES = ('remote', 'stream')
+TRANSFER_MODE = os.getenv("TRANSFER_MODE", "remote")
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+def target_columns(columns: Sequence[str]) -> List[str]:
+    """Target column names: joined columns lose their table prefix"""
+    names = [column.split('.')[-1] for column in columns]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Columns would collide in the target table: {', '.join(duplicates)}")
+    return names
+
+
+def remote_source(address: str, database: str, user: str, password: str, params: Dict[str, Any],
+                  secure: bool = False) -> Callable[[str], str]:
+    """Table mapper for query_builder.join_select() reading tables through remote() on address.
+
+    The arguments go into params and are bound by the driver; each remote()
+    is aliased to the bare table name so join conditions still resolve.
+    """
+    function = 'remoteSecure' if secure else 'remote'
+    params.update({'source_address': address, 'source_user': user, 'source_password': password})
+
+    def source(table: str) -> str:
+        table_database, name = table.split('.', 1) if '.' in table else (database, table)
+        index = len([key for key in params if key.startswith('source_table_')])
+        params[f'source_database_{index}'] = table_database
+        params[f'source_table_{index}'] = name
+        return (f"{function}(%(source_address)s, %(source_database_{index})s, %(source_table_{index})s, "
+                f"%(source_user)s, %(source_password)s) AS {identifier(name)}")
+
+    return source
+
+
+def create_target(source_client: Client, target_client: Client, target_table: str, select: str,
+                  columns: Sequence[str]) -> Dict[str, str]:
+    """Create target_table from the result types of select on the source, if it does not exist"""
+    described = source_client.execute(f"DESCRIBE ({select})")
+    type_map = {name: ch_type for (_, ch_type, *_), name in zip(described, target_columns(columns))}
+    definitions = ', '.join(f"{quote_identifier(name)} {ch_type}" for name, ch_type in type_map.items())
+    target_client.execute(
+        f"CREATE TABLE IF NOT EXISTS {identifier(target_table)} ({definitions}) ENGINE = MergeTree() ORDER BY tuple()"
+    )
+    return type_map
+
+
+def copy_remote(target_client: Client, target_table: str, columns: Sequence[str], select: str,
+                params: Dict[str, Any], settings: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+    """Run INSERT ... SELECT on the target server; returns (rows, bytes) written"""
+    names = ', '.join(quote_identifier(name) for name in target_columns(columns))
+    qid = query_id()
+    target_client.execute(
+        f"INSERT INTO {identifier(target_table)} ({names}) {select}",
+        params, settings=settings or {}, query_id=qid
+    )
+    record_query(target_client, qid)
+    progress = target_client.last_query.progress
+    return progress.written_rows, progress.written_bytes
+
+
+def copy_stream(source: ClickHouseHTTP, target: ClickHouseHTTP, target_table: str, columns: Sequence[str],
+                select: str, settings: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+    """Pipe select from source into target_table as Native blocks, never decoding them.
+
+    For servers that cannot reach each other; returns (rows, bytes) written.
+    """
+    with source.select_encoded(select, 'Native', settings) as response:
+        return target.insert_encoded(target_table, target_columns(columns),
+                                     response.iter_content(STREAM_BUFFER_SIZE), 'Native', settings)
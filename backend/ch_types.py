@@ -0,0 +1,452 @@
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+INT_RANGES = {
+    f"{prefix}Int{bits}": (0, 2 ** bits - 1) if prefix else (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+    for prefix in ('', 'U') for bits in (8, 16, 32, 64, 128, 256)
+}
+# Widths NumPy holds natively; wider integers stay Python ints
+NUMPY_INTS = {name: name.lower() for name in INT_RANGES if int(name.split('Int')[1]) <= 64}
+FLOATS = {'Float32': 'float32', 'Float64': 'float64'}
+DATE_RANGES = {
+    'Date': ('1970-01-01', '2149-06-06'),
+    'Date32': ('1900-01-01', '2299-12-31'),
+    'DateTime': ('1970-01-01', '2106-02-07 06:28:15')
+}
+WRAPPERS = ('Nullable', 'LowCardinality', 'SimpleAggregateFunction')
+TRUE_STRINGS = {'true', 't', '1', 'yes', 'y'}
+BOOL_STRINGS = TRUE_STRINGS | {'false', 'f', '0', 'no', 'n'}
+UUID_PATTERN = r'[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}'
+
+# String columns with at most this many distinct values, repeated on average
+# LOW_CARDINALITY_MIN_REPEATS times, are dictionary encoded
+LOW_CARDINALITY_MAX_DISTINCT = 10000
+LOW_CARDINALITY_MIN_REPEATS = 5
+
+
+@dataclass(frozen=True)
+class ChType:
+    """A parsed ClickHouse type expression.
+
+    args holds nested types for composite types (Array, Map, Tuple, Nullable...)
+    and literal parameters otherwise: FixedString(7) has (7,), Decimal(10, 2)
+    has (10, 2) and Enum8('a' = 1) has (('a', 1),).
+    """
+    name: str
+    args: Tuple[Any, ...] = ()
+    # Element names of a named Tuple or of Nested
+    fields: Tuple[str, ...] = ()
+
+    def __str__(self) -> str:
+        if not self.args:
+            return self.name
+        rendered = []
+        for i, arg in enumerate(self.args):
+            if isinstance(arg, tuple):
+                rendered.append(f"{_quote(arg[0])} = {arg[1]}")
+            elif isinstance(arg, str):
+                rendered.append(_quote(arg))
+            else:
+                rendered.append(f"{self.fields[i]} {arg}" if self.fields else str(arg))
+        return f"{self.name}({', '.join(rendered)})"
+
+    @property
+    def nullable(self) -> bool:
+        return self.name == 'Nullable' or (self.name in WRAPPERS and self.args[-1].nullable)
+
+    @property
+    def low_cardinality(self) -> bool:
+        return self.name == 'LowCardinality'
+
+    @property
+    def inner(self) -> 'ChType':
+        """The type with Nullable and LowCardinality wrappers removed"""
+        return self.args[-1].inner if self.name in WRAPPERS else self
+
+    @property
+    def kind(self) -> str:
+        name = self.inner.name
+        if name in INT_RANGES:
+            return 'int'
+        if name in FLOATS:
+            return 'float'
+        if name.startswith('Decimal'):
+            return 'decimal'
+        if name in ('Date', 'Date32'):
+            return 'date'
+        if name.startswith('DateTime'):
+            return 'datetime'
+        if name.startswith('Enum'):
+            return 'enum'
+        if name == 'Bool':
+            return 'bool'
+        if name in ('Array', 'Nested'):
+            return 'list'
+        if name == 'Map':
+            return 'dict'
+        if name == 'Tuple':
+            return 'tuple'
+        return 'str'
+
+    @property
+    def enum_values(self) -> Tuple[str, ...]:
+        return tuple(name for name, _ in self.inner.args)
+
+    @property
+    def decimal_digits(self) -> Tuple[int, int]:
+        """(precision, scale) of a Decimal type"""
+        inner = self.inner
+        if inner.name == 'Decimal':
+            return inner.args[0], inner.args[1] if len(inner.args) > 1 else 0
+        # Decimal32(S) and friends fix the precision by width
+        return {'Decimal32': 9, 'Decimal64': 18, 'Decimal128': 38, 'Decimal256': 76}[inner.name], inner.args[0]
+
+    @property
+    def timezone(self) -> Optional[str]:
+        inner = self.inner
+        zones = [arg for arg in inner.args if isinstance(arg, str)]
+        return zones[0] if inner.name.startswith('DateTime') and zones else None
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+class _Parser:
+    TOKEN = re.compile(r"\s*(?:(?P<string>'(?:[^'\\]|\\.)*')|(?P<number>-?\d+(?:\.\d+)?)|(?P<word>[A-Za-z_][A-Za-z0-9_]*)|(?P<symbol>[(),=]))")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = []
+        position = 0
+        while position < len(text.rstrip()):
+            match = self.TOKEN.match(text, position)
+            if not match:
+                raise ValueError(f"Cannot parse ClickHouse type {text!r} at {position}")
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self.index = 0
+
+    def peek(self, offset: int = 0) -> Tuple[Optional[str], Optional[str]]:
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, value: Optional[str] = None) -> Tuple[str, str]:
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise ValueError(f"Cannot parse ClickHouse type {self.text!r}: expected {value or 'more'}")
+        self.index += 1
+        return token
+
+    def parse(self) -> ChType:
+        parsed = self.type()
+        if self.peek()[0] is not None:
+            raise ValueError(f"Cannot parse ClickHouse type {self.text!r}: trailing {self.peek()[1]!r}")
+        return parsed
+
+    def type(self) -> ChType:
+        kind, name = self.take()
+        if kind != 'word':
+            raise ValueError(f"Cannot parse ClickHouse type {self.text!r}: unexpected {name!r}")
+        if self.peek()[1] != '(':
+            return ChType(name)
+        self.take('(')
+        args, fields = [], []
+        while self.peek()[1] != ')':
+            args.append(self.argument(fields))
+            if self.peek()[1] == ',':
+                self.take(',')
+        self.take(')')
+        if name.startswith('Enum') and args and not isinstance(args[0], tuple):
+            # Enum('a', 'b') numbers its values from 1
+            args = [(value, i) for i, value in enumerate(args, 1)]
+        return ChType(name, tuple(args), tuple(fields) if len(fields) == len(args) else ())
+
+    def argument(self, fields: List[str]) -> Any:
+        kind, value = self.peek()
+        if kind == 'string':
+            self.take()
+            text = re.sub(r"\\(.)", r"\1", value[1:-1])
+            if self.peek()[1] == '=':
+                self.take('=')
+                return text, int(self.take()[1])
+            return text
+        if kind == 'number':
+            self.take()
+            return float(value) if '.' in value else int(value)
+        if kind == 'word' and self.peek(1)[0] == 'word':
+            # Named element of a Tuple or Nested, e.g. Tuple(a String)
+            fields.append(self.take()[1])
+        return self.type()
+
+
+@lru_cache(maxsize=1024)
+def parse_type(expression: str) -> ChType:
+    """Parse a ClickHouse type expression once; results are cached"""
+    return _Parser(expression).parse()
+
+
+def pandas_dtype(ch_type: str) -> Any:
+    """The cheapest pandas dtype that holds values of ch_type"""
+    parsed = parse_type(ch_type)
+    inner = parsed.inner
+    if inner.name in NUMPY_INTS:
+        # Masked integer dtypes keep NULLs without falling back to float
+        return inner.name if parsed.nullable else NUMPY_INTS[inner.name]
+    if inner.name in FLOATS:
+        return FLOATS[inner.name]
+    if inner.name == 'Bool':
+        return 'boolean' if parsed.nullable else 'bool'
+    if parsed.kind == 'enum':
+        return pd.CategoricalDtype(parsed.enum_values)
+    if parsed.kind in ('date', 'datetime'):
+        return pd.DatetimeTZDtype('ns', parsed.timezone) if parsed.timezone else 'datetime64[ns]'
+    if parsed.low_cardinality and inner.name == 'String':
+        return 'category'
+    return object
+
+
+def categorical_dtypes(type_map: Dict[str, str]) -> Dict[str, str]:
+    """read_csv dtypes that parse LowCardinality and Enum columns straight into Categoricals"""
+    dtypes = {}
+    for column, ch_type in type_map.items():
+        parsed = parse_type(ch_type)
+        if parsed.kind == 'enum' or (parsed.low_cardinality and parsed.kind == 'str'):
+            dtypes[column] = 'category'
+    return dtypes
+
+
+def is_low_cardinality(values: pd.Series) -> bool:
+    """Whether a string column repeats few enough values to be dictionary encoded"""
+    if not (isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values)
+            or values.dtype == object):
+        return False
+    distinct = int(values.nunique())
+    present = int(values.notna().sum())
+    return 0 < distinct <= LOW_CARDINALITY_MAX_DISTINCT and distinct * LOW_CARDINALITY_MIN_REPEATS <= present
+
+
+def python_type(ch_type: str) -> str:
+    """Name of the Python type values of ch_type convert to"""
+    return parse_type(ch_type).kind
+
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values.astype(str), errors='coerce', format='ISO8601')
+    unparsed = parsed.isna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(values[unparsed].astype(str), errors='coerce', format='mixed')
+    return parsed
+
+
+def _invalid_present(values: pd.Series, parsed: ChType) -> pd.Series:
+    """Mask of the non-missing values that do not fit parsed"""
+    inner = parsed.inner
+    kind = parsed.kind
+    if kind == 'int':
+        numbers = pd.to_numeric(values, errors='coerce')
+        low, high = INT_RANGES[inner.name]
+        return numbers.isna() | (numbers % 1 != 0) | (numbers < low) | (numbers > high)
+    if kind == 'float':
+        return pd.to_numeric(values, errors='coerce').isna()
+    if kind == 'decimal':
+        precision, scale = parsed.decimal_digits
+        numbers = pd.to_numeric(values, errors='coerce')
+        return numbers.isna() | (numbers.abs() >= 10.0 ** (precision - scale))
+    if kind in ('date', 'datetime'):
+        parsed_values = _to_datetime(values)
+        bad = parsed_values.isna()
+        bounds = DATE_RANGES.get(inner.name)
+        if bounds:
+            naive = parsed_values.dt.tz_localize(None) if parsed_values.dt.tz is not None else parsed_values
+            bad |= (naive < pd.Timestamp(bounds[0])) | (naive > pd.Timestamp(bounds[1]))
+        return bad
+    if kind == 'enum':
+        text = values.astype(str)
+        codes = {str(code) for _, code in inner.args}
+        return ~(text.isin(parsed.enum_values) | text.isin(codes))
+    if kind == 'bool':
+        return ~values.astype(str).str.lower().isin(BOOL_STRINGS)
+    if inner.name == 'FixedString':
+        return values.astype(str).str.encode('utf-8').str.len() > inner.args[0]
+    if inner.name == 'UUID':
+        return ~values.astype(str).str.fullmatch(UUID_PATTERN)
+    if kind in ('list', 'dict', 'tuple'):
+        return values.map(lambda value: check_value(value, parsed) is not None)
+    return pd.Series(False, index=values.index)
+
+
+def invalid_values(values: pd.Series, ch_type: str) -> pd.Series:
+    """Mask of the values in a column that cannot be stored as ch_type"""
+    parsed = parse_type(ch_type)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Check each distinct value once and spread the result over the codes
+        categories = pd.Series(values.cat.categories.astype(object))
+        bad_categories = invalid_values(categories, ch_type).to_numpy(dtype=bool)
+        missing_bad = bool(invalid_values(pd.Series([None], dtype=object), ch_type).iloc[0])
+        codes = values.cat.codes.to_numpy()
+        return pd.Series(np.append(bad_categories, missing_bad)[codes], index=values.index)
+    missing = values.isna()
+    bad = pd.Series(False, index=values.index)
+    if not parsed.nullable and parsed.kind not in ('str', 'enum'):
+        # Missing strings are inserted as empty ones; other types need a value
+        bad |= missing
+    present = values[~missing]
+    if not present.empty:
+        bad[~missing] = _invalid_present(present, parsed).to_numpy(dtype=bool)
+    return bad
+
+
+def column_warnings(values: pd.Series, ch_type: str) -> List[str]:
+    """A warning for every value in a column that does not fit ch_type"""
+    return [f"Cannot convert {value} to {ch_type}" for value in values[invalid_values(values, ch_type)]]
+
+
+def check_value(value: Any, ch_type: Any) -> Optional[str]:
+    """Why a single value does not fit ch_type, or None if it does"""
+    parsed = parse_type(ch_type) if isinstance(ch_type, str) else ch_type
+    if value is None:
+        return None
+    inner = parsed.inner
+    kind = parsed.kind
+    try:
+        if kind == 'list':
+            if not isinstance(value, (list, tuple, np.ndarray)):
+                return f"Expected array, got {type(value)}"
+            # Nested(a T, b U) holds an array of (a, b) tuples
+            element = ChType('Tuple', inner.args, inner.fields) if inner.name == 'Nested' else inner.args[0]
+            return next((warning for warning in (check_value(item, element) for item in value) if warning), None)
+        if kind == 'dict':
+            if not isinstance(value, dict):
+                return f"Expected map, got {type(value)}"
+            for key, item in value.items():
+                warning = check_value(key, inner.args[0]) or check_value(item, inner.args[1])
+                if warning:
+                    return warning
+            return None
+        if kind == 'tuple':
+            if not isinstance(value, (list, tuple)) or len(value) != len(inner.args):
+                return f"Expected tuple of {len(inner.args)}, got {value!r}"
+            return next((warning for warning in map(check_value, value, inner.args) if warning), None)
+        if isinstance(value, float) and np.isnan(value):
+            return None if parsed.nullable or kind in ('str', 'enum') else f"Cannot convert {value} to {parsed}"
+        if kind == 'int':
+            number = float(value) if not isinstance(value, int) else value
+            low, high = INT_RANGES[inner.name]
+            if number != int(number) or not low <= number <= high:
+                return f"Cannot convert {value} to {parsed}: out of range"
+        elif kind == 'float':
+            float(value)
+        elif kind == 'decimal':
+            precision, scale = parsed.decimal_digits
+            if abs(Decimal(str(value))) >= Decimal(10) ** (precision - scale):
+                return f"Cannot convert {value} to {parsed}: too many digits"
+        elif kind in ('date', 'datetime'):
+            if not isinstance(value, (date, datetime)):
+                datetime.fromisoformat(str(value))
+        elif kind == 'enum':
+            if str(value) not in parsed.enum_values and value not in [code for _, code in inner.args]:
+                return f"Cannot convert {value} to {parsed}: not one of {', '.join(parsed.enum_values)}"
+        elif kind == 'bool':
+            if not isinstance(value, bool) and str(value).lower() not in BOOL_STRINGS:
+                return f"Cannot convert {value} to {parsed}"
+        elif inner.name == 'FixedString':
+            if len(str(value).encode('utf-8')) > inner.args[0]:
+                return f"Cannot convert {value} to {parsed}: longer than {inner.args[0]} bytes"
+        elif inner.name == 'UUID':
+            uuid.UUID(str(value))
+        return None
+    except (ValueError, TypeError, InvalidOperation, OverflowError) as e:
+        return f"Cannot convert {value} to {parsed}: {str(e)}"
+
+
+def _to_decimal(value: Any, limit: Decimal) -> Optional[Decimal]:
+    """value as a Decimal below limit in magnitude, or None like other values validation rejects"""
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() and abs(number) < limit else None
+
+
+def to_driver(values: pd.Series, ch_type: str) -> List[Any]:
+    """Convert a parsed column into the Python values clickhouse_driver inserts for ch_type"""
+    parsed = parse_type(ch_type)
+    kind = parsed.kind
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Convert each distinct value once; rows share the converted objects
+        lookup = to_driver(pd.Series(values.cat.categories.astype(object)), ch_type)
+        lookup += to_driver(pd.Series([None], dtype=object), ch_type)
+        return np.array(lookup, dtype=object)[values.cat.codes.to_numpy()].tolist()
+    missing = values.isna()
+    if kind == 'int':
+        numbers = pd.to_numeric(values, errors='coerce')
+        low, high = INT_RANGES[parsed.inner.name]
+        # Fractions and out-of-range values would wrap or truncate in the cast;
+        # like unparseable ones, they become None and are reported by validation
+        fits = numbers.notna() & (numbers % 1 == 0) & (numbers >= low) & (numbers <= high)
+        if fits.all() and parsed.inner.name in NUMPY_INTS:
+            return numbers.astype(NUMPY_INTS[parsed.inner.name]).tolist()
+        converted = numbers.astype(object).where(fits, None)
+        return [None if value is None else int(value) for value in converted]
+    if kind == 'float':
+        numbers = pd.to_numeric(values, errors='coerce').astype('float64')
+        return numbers.astype(object).where(numbers.notna(), None).tolist() if parsed.nullable else numbers.tolist()
+    if kind == 'decimal':
+        precision, scale = parsed.decimal_digits
+        limit = Decimal(10) ** (precision - scale)
+        return [None if is_missing else _to_decimal(value, limit) for value, is_missing in zip(values, missing)]
+    if kind in ('date', 'datetime'):
+        moments = _to_datetime(values)
+        if parsed.timezone and moments.dt.tz is None:
+            moments = moments.dt.tz_localize(parsed.timezone)
+        converted = moments.dt.date if kind == 'date' else pd.Series(moments.dt.to_pydatetime(), index=values.index, dtype=object)
+        return converted.astype(object).where(moments.notna(), None).tolist()
+    if kind == 'bool':
+        return [None if is_missing else (value if isinstance(value, bool) else str(value).lower() in TRUE_STRINGS)
+                for value, is_missing in zip(values, missing)]
+    if kind in ('str', 'enum'):
+        if not missing.any() and values.dtype == object:
+            return values.tolist()
+        text = values.astype(str).astype(object)
+        return text.where(~missing, None if parsed.nullable else '').tolist()
+    return values.astype(object).where(~missing, None).tolist()
+
+
+def infer_type(values: pd.Series) -> str:
+    """ClickHouse type for a parsed column, used when creating tables from files"""
+    present = values.dropna()
+    if pd.api.types.is_bool_dtype(values):
+        ch_type = 'Bool'
+    elif pd.api.types.is_integer_dtype(values):
+        ch_type = 'Int64'
+    elif pd.api.types.is_float_dtype(values):
+        # pandas reads integer columns with gaps as floats
+        ch_type = 'Int64' if not present.empty and (present % 1 == 0).all() else 'Float64'
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        ch_type = 'DateTime'
+    elif present.empty:
+        ch_type = 'String'
+    else:
+        text = present.astype(str)
+        moments = pd.to_datetime(text, errors='coerce', format='ISO8601')
+        if moments.notna().all():
+            ch_type = 'Date' if (text.str.len() == 10).all() else 'DateTime'
+        else:
+            ch_type = 'String'
+    if len(present) < len(values):
+        ch_type = f"Nullable({ch_type})"
+    if ch_type.endswith('String)') or ch_type == 'String':
+        if is_low_cardinality(values):
+            ch_type = f"LowCardinality({ch_type})"
+    return ch_type
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from state import sqlite_connection
+
+CHECKPOINT_DB = os.getenv(
+    "CHECKPOINT_DB", os.path.join(tempfile.gettempdir(), "clickhouse_transfer_checkpoints.db")
+)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Rows per chunk of checkpointed imports. Stored with each checkpoint: a resume
+# must cut the file where the interrupted run did for the chunk tokens to match
+CHECKPOINT_CHUNK_ROWS = int(os.getenv("CHECKPOINT_CHUNK_ROWS", "100000"))
+
+
+class CheckpointConflict(Exception):
+    """A transfer id is already taken by a transfer with other parameters"""
+
+
+class CheckpointStore:
+    """SQLite-backed record of the last committed chunk of each transfer"""
+
+    def __init__(self, path: str = CHECKPOINT_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                transfer_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                target_table TEXT NOT NULL,
+                params TEXT NOT NULL,
+                source_size INTEGER,
+                byte_offset INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                rows INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+
+    def get(self, transfer_id: str) -> Optional[Dict[str, Any]]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                "SELECT * FROM checkpoints WHERE transfer_id = ?", (transfer_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        checkpoint = dict(row)
+        checkpoint['params'] = json.loads(checkpoint['params'])
+        return checkpoint
+
+    def start(self, transfer_id: str, kind: str, table: str, params: Dict[str, Any],
+              source_size: Optional[int] = None) -> Dict[str, Any]:
+        """Register a transfer, keeping the progress of an existing one with the same id.
+
+        Raises CheckpointConflict when the id belongs to a transfer of another
+        file, table or parameters, whose progress would not apply to this one.
+        """
+        with self._lock, sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                "SELECT kind, target_table, params, source_size FROM checkpoints WHERE transfer_id = ?",
+                (transfer_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO checkpoints "
+                    "(transfer_id, kind, target_table, params, source_size, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'running', ?)",
+                    (transfer_id, kind, table, json.dumps(params), source_size, time.time())
+                )
+            else:
+                # Stored params may have been extended since, e.g. with inferred types
+                stored = json.loads(row['params'])
+                if ((row['kind'], row['target_table'], row['source_size']) != (kind, table, source_size)
+                        or any(stored.get(key) != value for key, value in json.loads(json.dumps(params)).items())):
+                    raise CheckpointConflict(f"Transfer {transfer_id} already exists with different parameters")
+        return self.get(transfer_id)
+
+    def update_params(self, transfer_id: str, params: Dict[str, Any]):
+        with self._lock, sqlite_connection(self.path) as conn:
+            conn.execute(
+                "UPDATE checkpoints SET params = ?, updated_at = ? WHERE transfer_id = ?",
+                (json.dumps(params), time.time(), transfer_id)
+            )
+
+    def commit_chunk(self, transfer_id: str, byte_offset: int, rows: int):
+        """Record that everything before byte_offset has been inserted"""
+        with self._lock, sqlite_connection(self.path) as conn:
+            conn.execute(
+                "UPDATE checkpoints SET byte_offset = ?, chunks = chunks + 1, rows = rows + ?, "
+                "status = 'running', updated_at = ? WHERE transfer_id = ?",
+                (byte_offset, rows, time.time(), transfer_id)
+            )
+
+    def finish(self, transfer_id: str, status: str = 'completed'):
+        with self._lock, sqlite_connection(self.path) as conn:
+            conn.execute(
+                "UPDATE checkpoints SET status = ?, updated_at = ? WHERE transfer_id = ?",
+                (status, time.time(), transfer_id)
+            )
+
+
+def encode_watermark(value: Any) -> str:
+    """Serialise a watermark so it is read back with its Python type"""
+    if isinstance(value, datetime):
+        return json.dumps({'type': 'datetime', 'value': value.isoformat()})
+    if isinstance(value, date):
+        return json.dumps({'type': 'date', 'value': value.isoformat()})
+    return json.dumps({'type': 'json', 'value': value})
+
+
+def decode_watermark(encoded: str) -> Any:
+    watermark = json.loads(encoded)
+    if watermark['type'] == 'datetime':
+        return datetime.fromisoformat(watermark['value'])
+    if watermark['type'] == 'date':
+        return date.fromisoformat(watermark['value'])
+    return watermark['value']
+
+
+class WatermarkStore:
+    """Last exported watermark per (table, target) for incremental exports"""
+
+    def __init__(self, path: str = CHECKPOINT_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                source_table TEXT NOT NULL,
+                target TEXT NOT NULL,
+                watermark_column TEXT NOT NULL,
+                watermark TEXT NOT NULL,
+                exports INTEGER NOT NULL DEFAULT 0,
+                rows INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (source_table, target)
+            )
+            """)
+
+    def get(self, table: str, target: str) -> Optional[Dict[str, Any]]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                "SELECT * FROM watermarks WHERE source_table = ? AND target = ?", (table, target)
+            ).fetchone()
+        if row is None:
+            return None
+        watermark = dict(row)
+        watermark['watermark'] = decode_watermark(watermark['watermark'])
+        return watermark
+
+    def list(self, table: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM watermarks"
+        params: tuple = ()
+        if table:
+            query += " WHERE source_table = ?"
+            params = (table,)
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(query + " ORDER BY source_table, target", params).fetchall()
+        return [{**dict(row), 'watermark': decode_watermark(row['watermark'])} for row in rows]
+
+    def advance(self, table: str, target: str, column: str, watermark: Any, rows: int):
+        """Record that rows up to and including watermark have been exported"""
+        with self._lock, sqlite_connection(self.path) as conn:
+            conn.execute(
+                "INSERT INTO watermarks (source_table, target, watermark_column, watermark, exports, rows, updated_at) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (source_table, target) DO UPDATE SET watermark_column = excluded.watermark_column, "
+                "watermark = excluded.watermark, exports = exports + 1, rows = rows + excluded.rows, "
+                "updated_at = excluded.updated_at",
+                (table, target, column, encode_watermark(watermark), rows, time.time())
+            )
+
+    def reset(self, table: str, target: str) -> bool:
+        with self._lock, sqlite_connection(self.path) as conn:
+            cursor = conn.execute(
+                "DELETE FROM watermarks WHERE source_table = ? AND target = ?", (table, target)
+            )
+        return cursor.rowcount > 0
+
+
+def dedup_token(source: str, byte_offset: int) -> Dict[str, Any]:
+    """Insert settings that make a retried chunk a no-op on the server; source is a transfer id or file hash"""
+    return {
+        'insert_deduplicate': 1,
+        'insert_deduplication_token': f"{source}:{byte_offset}"
+    }
+
+
+def file_hash(f: BinaryIO) -> str:
+    """Hash a seekable file in blocks and rewind it"""
+    digest = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+class ImportIndex:
+    """Hashes of files fully imported into each table"""
+
+    def __init__(self, path: str = CHECKPOINT_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS imported_files (
+                target_table TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                rows INTEGER NOT NULL,
+                imported_at REAL NOT NULL,
+                PRIMARY KEY (target_table, file_hash)
+            )
+            """)
+
+    def get(self, table: str, digest: str) -> Optional[Dict[str, Any]]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                "SELECT * FROM imported_files WHERE target_table = ? AND file_hash = ?", (table, digest)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def add(self, table: str, digest: str, size: int, rows: int):
+        with self._lock, sqlite_connection(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO imported_files (target_table, file_hash, size, rows, imported_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (table, digest, size, rows, time.time())
+            )
+
+    def remove(self, table: str, digest: str) -> bool:
+        with self._lock, sqlite_connection(self.path) as conn:
+            cursor = conn.execute(
+                "DELETE FROM imported_files WHERE target_table = ? AND file_hash = ?", (table, digest)
+            )
+        return cursor.rowcount > 0
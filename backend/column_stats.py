@@ -0,0 +1,224 @@
+import io
+import math
+from collections import Counter
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from clickhouse_driver import Client
+
+from ch_types import parse_type
+from csv_chunks import CsvChunk
+from query_builder import Query, identifier, quote_identifier
+from state import StateBackend
+
+DEFAULT_TOP_K = 5
+
+# Types min() and max() cannot be applied to
+UNORDERED_TYPES = {'Array', 'Map', 'Tuple', 'Nested', 'Object', 'JSON', 'AggregateFunction'}
+
+
+def _jsonable(value: Any) -> Any:
+    """Make a statistic safe to cache as JSON and return from the API"""
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return float(value) if math.isfinite(value) else None
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, np.generic):
+        return _jsonable(value.item())
+    return str(value)
+
+
+def table_stats_query(table: str, columns: Sequence[Tuple[str, str]], top_k: int = DEFAULT_TOP_K,
+                      sample: Optional[float] = None) -> Query:
+    """One aggregation computing every column's statistics in a single scan.
+
+    Its key identifies the statistics in the cache: equal for the same columns, top_k and sample.
+    """
+    expressions = ['count()']
+    for name, ch_type in columns:
+        column = quote_identifier(name)
+        ordered = parse_type(ch_type).inner.name not in UNORDERED_TYPES
+        expressions += [
+            f"uniqCombined({column})",
+            f"countIf(isNull({column}))",
+            f"min({column})" if ordered else "NULL",
+            f"max({column})" if ordered else "NULL",
+            f"topK({int(top_k)})({column})"
+        ]
+    sample_clause = f" SAMPLE {float(sample)}" if sample else ""
+    return Query(f"SELECT {', '.join(expressions)} FROM {identifier(table)}{sample_clause}")
+
+
+def table_column_stats(client: Client, table: str, columns: Sequence[Tuple[str, str]],
+                       top_k: int = DEFAULT_TOP_K, sample: Optional[float] = None) -> Dict[str, Any]:
+    row = table_stats_query(table, columns, top_k, sample).execute(client)[0]
+    total = row[0]
+    stats = []
+    for i, (name, ch_type) in enumerate(columns):
+        distinct, nulls, minimum, maximum, top = row[1 + i * 5:6 + i * 5]
+        stats.append({
+            'name': name,
+            'type': ch_type,
+            'count': total,
+            'nulls': nulls,
+            'null_fraction': nulls / total if total else 0.0,
+            'distinct': distinct,
+            'min': _jsonable(minimum),
+            'max': _jsonable(maximum),
+            'top': _jsonable(top)
+        })
+    return {'table': table, 'rows': total, 'sample': sample, 'columns': stats}
+
+
+class HyperLogLog:
+    """Distinct-count estimate from 64-bit hashes, updated a whole array at a time"""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray):
+        if not len(hashes):
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # Position of the first set bit in the remaining bits; the guard bit caps it
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        _, exponent = np.frexp(rest.astype(np.float64))
+        rank = (65 - exponent).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+
+class ColumnProfile:
+    """Running statistics of one flat-file column"""
+
+    def __init__(self, name: str, top_capacity: int):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.integral = True
+        # Numeric extremes count only while every value is a number; text
+        # extremes are always kept, so neither depends on the order of chunks
+        self.minimum: Any = None
+        self.maximum: Any = None
+        self.text_minimum: Any = None
+        self.text_maximum: Any = None
+        self.hll = HyperLogLog()
+        self.counts: Counter = Counter()
+        self.top_capacity = top_capacity
+
+    def update(self, series: pd.Series):
+        self.count += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        self.hll.update(pd.util.hash_pandas_object(values, index=False).to_numpy())
+        self.counts.update(values.value_counts().to_dict())
+        if len(self.counts) > self.top_capacity:
+            # Like topK, keep only the heaviest candidates between chunks
+            self.counts = Counter(dict(self.counts.most_common(self.top_capacity)))
+
+        low, high = values.min(), values.max()
+        self.text_minimum = low if self.text_minimum is None else min(self.text_minimum, low)
+        self.text_maximum = high if self.text_maximum is None else max(self.text_maximum, high)
+        if self.numeric:
+            numbers = pd.to_numeric(values, errors='coerce')
+            if numbers.notna().all():
+                self.integral = self.integral and bool((numbers % 1 == 0).all())
+                low, high = numbers.min(), numbers.max()
+                self.minimum = low if self.minimum is None else min(self.minimum, low)
+                self.maximum = high if self.maximum is None else max(self.maximum, high)
+            else:
+                self.numeric = False
+
+    def result(self, top_k: int) -> Dict[str, Any]:
+        if self.numeric and self.minimum is not None:
+            inferred = 'Int64' if self.integral else 'Float64'
+            minimum, maximum = self.minimum, self.maximum
+        else:
+            inferred = 'String'
+            minimum, maximum = self.text_minimum, self.text_maximum
+        return {
+            'name': self.name,
+            'type': inferred,
+            'count': self.count,
+            'nulls': self.nulls,
+            'null_fraction': self.nulls / self.count if self.count else 0.0,
+            'distinct': self.hll.estimate(),
+            'min': _jsonable(minimum),
+            'max': _jsonable(maximum),
+            'top': [value for value, _ in self.counts.most_common(top_k)]
+        }
+
+
+class FlatFileProfiler:
+    """Column statistics of a CSV accumulated chunk by chunk in one pass"""
+
+    def __init__(self, delimiter: str = ',', top_k: int = DEFAULT_TOP_K):
+        self.delimiter = delimiter
+        self.top_k = top_k
+        self.rows = 0
+        self.columns: Dict[str, ColumnProfile] = {}
+
+    def update(self, chunk: CsvChunk):
+        # Text columns keep every chunk's hashes and counts consistent,
+        # whatever type pandas would infer for that chunk alone
+        frame = pd.read_csv(io.BytesIO(chunk.header + chunk.data), delimiter=self.delimiter, dtype=str)
+        self.rows += len(frame)
+        for name in frame.columns:
+            profile = self.columns.get(name)
+            if profile is None:
+                profile = self.columns[name] = ColumnProfile(name, max(100, 10 * self.top_k))
+            profile.update(frame[name])
+
+    def result(self) -> Dict[str, Any]:
+        return {'rows': self.rows, 'columns': [profile.result(self.top_k) for profile in self.columns.values()]}
+
+
+def profile_columns(chunks, delimiter: str = ',', top_k: int = DEFAULT_TOP_K) -> Dict[str, Any]:
+    profiler = FlatFileProfiler(delimiter, top_k)
+    for chunk in chunks:
+        profiler.update(chunk)
+    return profiler.result()
+
+
+class StatsCache:
+    """Column statistics kept next to the schema they were computed against.
+
+    A cached entry is dropped as soon as the schema it was stored with changes.
+    """
+
+    def __init__(self, state: StateBackend, ttl: float):
+        self.state = state
+        self.ttl = ttl
+
+    def get(self, key: str, schema: Any, params: str) -> Optional[Dict[str, Any]]:
+        entry = self.state.get(f"column_stats:{key}")
+        if not entry or entry['schema'] != schema:
+            return None
+        return entry['stats'].get(params)
+
+    def put(self, key: str, schema: Any, params: str, stats: Dict[str, Any]):
+        entry = self.state.get(f"column_stats:{key}")
+        if not entry or entry['schema'] != schema:
+            entry = {'schema': schema, 'stats': {}}
+        entry['stats'][params] = stats
+        self.state.set(f"column_stats:{key}", entry, ex=self.ttl)
+
+    def invalidate(self, key: str):
+        self.state.delete(f"column_stats:{key}")
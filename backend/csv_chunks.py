@@ -0,0 +1,186 @@
+import io
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from batching import AdaptiveBatcher
+
+DEFAULT_CHUNK_ROWS = 1000
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class CsvChunk:
+    """A run of complete CSV records and its byte span in the source file"""
+    start: int
+    end: int
+    header: bytes
+    data: bytes
+    lines: int
+
+
+def _complete_records(f: BinaryIO, lines: List[bytes], quotechar: bytes) -> List[bytes]:
+    # A record ends at a newline only when the quotes seen so far are balanced,
+    # so keep reading lines while a quoted field is still open
+    quotes = sum(line.count(quotechar) for line in lines)
+    while quotes % 2:
+        line = f.readline()
+        if not line:
+            break
+        lines.append(line)
+        quotes += line.count(quotechar)
+    return lines
+
+
+def read_header(f: BinaryIO, quotechar: bytes = b'"') -> bytes:
+    """Read the header record from the start of the file"""
+    f.seek(0)
+    first = f.readline()
+    return b''.join(_complete_records(f, [first], quotechar)) if first else b''
+
+
+def iter_csv_chunks(
+    f: BinaryIO,
+    max_rows: int = DEFAULT_CHUNK_ROWS,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    offset: int = 0,
+    quotechar: bytes = b'"',
+    batcher: Optional[AdaptiveBatcher] = None
+) -> Iterator[CsvChunk]:
+    """Split a seekable binary CSV into record-aligned chunks starting at offset.
+
+    With a batcher, each chunk is sized from its current row and byte limits.
+    """
+    header = read_header(f, quotechar)
+    position = max(offset, len(header))
+    f.seek(position)
+
+    line_size = 256
+    while True:
+        if batcher is not None:
+            max_rows, max_bytes = batcher.rows, batcher.max_bytes
+        lines: List[bytes] = []
+        size = 0
+        # readlines() stops just past its size hint, so size the hint from the
+        # observed line length to avoid reading far beyond max_rows
+        while len(lines) < max_rows and size < max_bytes:
+            hint = min(max_bytes - size, (max_rows - len(lines)) * line_size)
+            more = f.readlines(max(hint, 1))
+            if not more:
+                break
+            lines.extend(more)
+            size += sum(len(line) for line in more)
+            line_size = max(1, size // len(lines))
+        if not lines:
+            return
+        if len(lines) > max_rows:
+            lines = lines[:max_rows]
+            f.seek(position + sum(len(line) for line in lines))
+        lines = _complete_records(f, lines, quotechar)
+        data = b''.join(lines)
+        yield CsvChunk(position, position + len(data), header, data, len(lines))
+        position += len(data)
+
+
+class CsvStreamSplitter:
+    """Cut a CSV arriving in arbitrary byte blocks into record-aligned chunks.
+
+    feed() returns the chunks completed by a block, close() the remainder.
+    """
+
+    def __init__(self, max_rows: int = DEFAULT_CHUNK_ROWS, max_bytes: int = DEFAULT_CHUNK_BYTES,
+                 quotechar: bytes = b'"', batcher: Optional[AdaptiveBatcher] = None):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.quotechar = quotechar
+        self.batcher = batcher
+        self.header: Optional[bytes] = None
+        self.position = 0
+        self._buffer = bytearray()
+        # Bytes scanned so far, end of the last complete record, records before
+        # it and quotes seen since it
+        self._scanned = 0
+        self._boundary = 0
+        self._records = 0
+        self._quotes = 0
+
+    def _full(self) -> bool:
+        return self._records >= self.max_rows or self._boundary >= self.max_bytes
+
+    def _take_lines(self, start: int, count: int) -> int:
+        for _ in range(count):
+            start = self._buffer.find(b'\n', start) + 1
+        return start
+
+    def _cut(self) -> CsvChunk:
+        data = bytes(self._buffer[:self._boundary])
+        del self._buffer[:self._boundary]
+        chunk = CsvChunk(self.position, self.position + len(data), self.header, data, self._records)
+        self.position += len(data)
+        self._scanned -= self._boundary
+        self._boundary = 0
+        self._records = 0
+        return chunk
+
+    def feed(self, data: bytes) -> List[CsvChunk]:
+        buffer = self._buffer
+        buffer += data
+        chunks = []
+        start = self._scanned
+        if self.batcher is not None:
+            self.max_rows, self.max_bytes = self.batcher.rows, self.batcher.max_bytes
+        while True:
+            if self.header is not None and self._quotes == 0 and buffer.find(self.quotechar, start) == -1:
+                # No quotes ahead, so every newline ends a record and they can be counted in bulk
+                last = buffer.rfind(b'\n', start)
+                if last == -1:
+                    break
+                lines = buffer.count(b'\n', start, last + 1)
+                wanted = self.max_rows - self._records
+                if lines > wanted:
+                    self._records += wanted
+                    start = self._boundary = self._take_lines(start, wanted)
+                else:
+                    self._records += lines
+                    start = self._boundary = last + 1
+            else:
+                newline = buffer.find(b'\n', start)
+                if newline == -1:
+                    break
+                self._quotes += buffer.count(self.quotechar, start, newline + 1)
+                start = newline + 1
+                # A newline inside an open quoted field does not end the record
+                if self._quotes % 2:
+                    continue
+                self._quotes = 0
+                self._boundary = start
+                if self.header is None:
+                    self.header = bytes(buffer[:start])
+                    del buffer[:start]
+                    self.position = start
+                    start = self._boundary = 0
+                    continue
+                self._records += 1
+            if self._full():
+                self._scanned = start
+                chunks.append(self._cut())
+                start = self._scanned
+        self._scanned = start
+        return chunks
+
+    def close(self) -> List[CsvChunk]:
+        """Flush the records left once the stream has ended"""
+        if self.header is None:
+            self.header = bytes(self._buffer)
+            self._buffer.clear()
+        if len(self._buffer) > self._boundary:
+            # The last record may lack a trailing newline
+            self._records += 1
+            self._boundary = len(self._buffer)
+        return [self._cut()] if self._records else []
+
+
+def read_chunk(chunk: CsvChunk, delimiter: str = ',', dtype: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """Parse a chunk into a DataFrame using the file's header"""
+    return pd.read_csv(io.BytesIO(chunk.header + chunk.data), delimiter=delimiter, dtype=dtype)
@@ -0,0 +1,90 @@
+import re
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SELECT_RE = re.compile(r"^\s*SELECT\s+(?P<columns>.+?)\s+FROM\s+(?P<table>[\w.]+)(?P<rest>.*)$", re.I | re.S)
+LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+)", re.I)
+INSERT_RE = re.compile(r"^\s*INSERT\s+INTO\s+(?P<table>[\w.]+)", re.I)
+DESCRIBE_RE = re.compile(r"^\s*DESCRIBE\s+TABLE\s+(?P<table>[\w.]+)", re.I)
+
+
+class FakeClient:
+    """In-memory stand-in for clickhouse_driver.Client.
+
+    Tables are registered with a schema and optional canned rows; SELECTs
+    project the requested columns from those rows and INSERTs are recorded,
+    so the pure-Python parts of a transfer can run without a server.
+
+    latency adds a fixed delay per query and rows_per_second throttles rows
+    served or inserted, to emulate a slower server; by default it is instant.
+    """
+
+    def __init__(self, latency: float = 0.0, rows_per_second: Optional[float] = None,
+                 block_size: int = 65536):
+        self.latency = latency
+        self.rows_per_second = rows_per_second
+        self.block_size = block_size
+        self.schemas: Dict[str, List[Tuple[str, str]]] = {}
+        self.rows: Dict[str, List[tuple]] = {}
+        self.inserted_rows: Dict[str, int] = defaultdict(int)
+        self.insert_calls: List[Tuple[str, int, Optional[Dict[str, Any]]]] = []
+        self.queries: List[str] = []
+
+    def add_table(self, table: str, schema: List[Tuple[str, str]], rows: Optional[List[tuple]] = None):
+        self.schemas[table] = list(schema)
+        self.rows[table] = list(rows or [])
+
+    def _throttle(self, rows: int, latency: float = 0.0):
+        delay = latency + (rows / self.rows_per_second if self.rows_per_second else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _select(self, query: str) -> List[tuple]:
+        match = SELECT_RE.match(query)
+        if not match:
+            return [(1,)]
+        table = match.group('table')
+        rows = self.rows.get(table, [])
+        names = [name for name, _ in self.schemas.get(table, [])]
+        requested = [column.strip() for column in match.group('columns').split(',')]
+        if requested != ['*'] and all(column in names for column in requested):
+            indexes = [names.index(column) for column in requested]
+            rows = [tuple(row[i] for i in indexes) for row in rows]
+        limit = LIMIT_RE.search(match.group('rest'))
+        return rows[:int(limit.group(1))] if limit else rows
+
+    def execute(self, query: str, params=None, with_column_types=False, external_tables=None,
+                query_id=None, settings=None, types_check=False, columnar=False):
+        self.queries.append(query)
+        self._throttle(0, self.latency)
+        describe = DESCRIBE_RE.match(query)
+        if describe:
+            return [(name, ch_type, '', '', '', '', '') for name, ch_type in self.schemas.get(describe.group('table'), [])]
+        insert = INSERT_RE.match(query)
+        if insert:
+            count = len(params or [])
+            self._throttle(count)
+            self.inserted_rows[insert.group('table')] += count
+            self.insert_calls.append((insert.group('table'), count, settings))
+            return count
+        if query.lstrip().upper().startswith('SELECT'):
+            rows = self._select(query)
+            self._throttle(len(rows))
+            return rows
+        return []
+
+    def execute_iter(self, query: str, params=None, with_column_types=False, external_tables=None,
+                     query_id=None, settings=None, types_check=False, chunk_size=1) -> Iterator[tuple]:
+        self.queries.append(query)
+        self._throttle(0, self.latency)
+        rows = self._select(query)
+        block_size = (settings or {}).get('max_block_size', self.block_size)
+        # Rows arrive block by block, like packets from the native protocol
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            self._throttle(len(block))
+            yield from block
+
+    def disconnect(self):
+        pass
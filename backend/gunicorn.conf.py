@@ -0,0 +1,12 @@
+# Multi-process serving: gunicorn -c gunicorn.conf.py main:app
+# Progress and checkpoints live in shared stores (STATE_BACKEND, CHECKPOINT_DB,
+# REPORT_DB), so any worker can answer for a transfer another one runs.
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Large imports and exports hold a request open for a long time
+timeout = int(os.getenv("WORKER_TIMEOUT", "600"))
+graceful_timeout = 30
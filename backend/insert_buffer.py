@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional
+
+INSERT_BUFFER_MAX_ROWS = int(os.getenv("INSERT_BUFFER_MAX_ROWS", "100000"))
+INSERT_BUFFER_MAX_BYTES = int(os.getenv("INSERT_BUFFER_MAX_BYTES", str(32 * 1024 * 1024)))
+INSERT_BUFFER_MAX_WAIT = float(os.getenv("INSERT_BUFFER_MAX_WAIT", "1.0"))
+
+
+class InsertBuffer:
+    """Coalesces rows for one table from concurrent requests into larger INSERTs.
+
+    Each add() returns a future that resolves once the flush containing those
+    rows has been acknowledged by the server, or fails with the flush's error.
+    """
+
+    def __init__(
+        self,
+        insert: Callable[[List[tuple]], None],
+        max_rows: int = INSERT_BUFFER_MAX_ROWS,
+        max_bytes: int = INSERT_BUFFER_MAX_BYTES,
+        max_wait: float = INSERT_BUFFER_MAX_WAIT
+    ):
+        self._insert = insert
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self._rows: List[tuple] = []
+        self._bytes = 0
+        self._waiters: List[Future] = []
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="insert-buffer", daemon=True)
+        self._thread.start()
+
+    def add(self, rows: List[tuple], nbytes: int = 0) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Insert buffer is closed")
+            self._rows.extend(rows)
+            self._bytes += nbytes
+            self._waiters.append(future)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify()
+        return future
+
+    def _due(self) -> bool:
+        if self._oldest is None:
+            return False
+        return (
+            len(self._rows) >= self.max_rows
+            or self._bytes >= self.max_bytes
+            or time.monotonic() - self._oldest >= self.max_wait
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(0.0, self._oldest + self.max_wait - time.monotonic())
+                    self._cond.wait(timeout)
+                if not self._waiters:
+                    return
+                rows, waiters = self._rows, self._waiters
+                self._rows, self._bytes, self._waiters, self._oldest = [], 0, [], None
+
+            try:
+                if rows:
+                    self._insert(rows)
+            except Exception as e:
+                for waiter in waiters:
+                    waiter.set_exception(e)
+            else:
+                for waiter in waiters:
+                    waiter.set_result(len(rows))
+
+    def close(self):
+        """Flush whatever is pending and stop the flusher thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+_buffers: Dict[Hashable, InsertBuffer] = {}
+_buffers_lock = threading.Lock()
+
+
+def get_buffer(key: Hashable, insert: Callable[[List[tuple]], None]) -> InsertBuffer:
+    """Return the buffer registered under key, creating it with insert on first use"""
+    with _buffers_lock:
+        buffer = _buffers.get(key)
+        if buffer is None:
+            buffer = InsertBuffer(insert)
+            _buffers[key] = buffer
+        return buffer
+
+
+def close_buffers():
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+        _buffers.clear()
+    for buffer in buffers:
+        buffer.close()
@@ -1,19 +1,51 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, status
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from typing import Optional, List, Dict, Any
+from fastapi.responses import JSONResponse, FileResponse, Response
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple
 import pandas as pd
 from clickhouse_driver import Client
 import os
 from pydantic import BaseModel
 import jwt
 from datetime import datetime, timedelta
+import hashlib
+import hmac
 import json
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import secrets
+import re
 import tempfile
+import shutil
 import csv
 import asyncio
+import time
+import uuid
+from contextlib import nullcontext
+from itertools import islice
 from typing import Generator
+from pool import ClickHousePool, get_pool
+from parallel_export import EXPORT_DIR, export_parallel, OUTPUT_MODES
+from csv_chunks import CsvChunk, CsvStreamSplitter, iter_csv_chunks, read_chunk
+from parallel_parse import PARSE_WORKERS, close_parse_pool, iter_parsed, parse_chunk
+from checkpoints import CheckpointStore, ImportIndex, WatermarkStore, dedup_token
+from checkpoints import CHECKPOINT_CHUNK_ROWS, file_hash
+from batching import AdaptiveBatcher, batch_stats
+from insert_buffer import INSERT_BUFFER_MAX_ROWS, get_buffer, close_buffers
+import metrics
+from metrics import ROWS_TOTAL, BYTES_TOTAL
+from auth import SECRET_KEY, ALGORITHM, decode_token, verify_token
+from profiling import PROFILE_MODES, stage, profile_request, list_profiles, load_profile, profile_output_path
+from profiling import run_in_thread
+import reports
+from reports import ReportStore, transfer_report, query_id, record_query
+from ch_types import categorical_dtypes, check_value, column_warnings, to_driver
+from column_stats import DEFAULT_TOP_K, StatsCache, profile_columns, table_column_stats, table_stats_query
+from state import get_state
+from batch_ingest import BATCH_INGEST_ROOT, BATCH_MAX_PARALLELISM, BatchJobStore, expand_glob
+import arrow_plane
+from arrow_plane import CLICKHOUSE_HTTP_PORT, DATA_PLANE, DATA_PLANES, ClickHouseHTTP
+import query_builder
+from query_builder import Query
+from ch_transfer import TRANSFER_MODE, TRANSFER_MODES, copy_remote, copy_stream, create_target, remote_source
 
 app = FastAPI()
 
@@ -26,17 +58,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# JWT Settings
-SECRET_KEY = "your-secret-key"  # In production, use a secure secret key
-ALGORITHM = "HS256"
-security = HTTPBearer()
-
 # ClickHouse connection settings
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "clickhouse")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "9000"))
 CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
 
+# Keys credential hashes in pool keys; new per process, so the hashes are useless elsewhere
+CREDENTIAL_KEY_SECRET = secrets.token_bytes(32)
+
+# Upper bound on concurrent connections a single export may open
+EXPORT_MAX_PARALLELISM = int(os.getenv("EXPORT_MAX_PARALLELISM", "8"))
+
+# Users whose tokens may request profiling and read stored profiles
+PROFILE_ADMINS = set(os.getenv("PROFILE_ADMINS", "admin").split(","))
+
+# Per-chunk progress of resumable imports
+checkpoint_store = CheckpointStore()
+
+# Hashes of files already imported into each table, to skip re-sent uploads
+import_index = ImportIndex()
+
+# Rows per chunk of deduplicated imports; chunks must cut the same way on
+# every upload of a file for their content tokens to match
+DEDUP_CHUNK_ROWS = int(os.getenv("DEDUP_CHUNK_ROWS", "100000"))
+
+# Last exported value of the watermark column per (table, target)
+watermark_store = WatermarkStore()
+
+# Stage timings and server statistics of finished transfers
+report_store = ReportStore()
+
+# Column statistics are cached next to the schema they describe for this many seconds
+COLUMN_STATS_TTL = int(os.getenv("COLUMN_STATS_TTL", "600"))
+stats_cache = StatsCache(get_state(), COLUMN_STATS_TTL)
+
+# Seconds previews are kept in the server's query cache (ClickHouse 23.1+); 0 disables it
+PREVIEW_QUERY_CACHE_TTL = int(os.getenv("PREVIEW_QUERY_CACHE_TTL", "0"))
+
+# Per-file progress of batch imports
+batch_jobs = BatchJobStore(get_state())
+
+# Parsed chunks of a streamed upload that may wait for ClickHouse before the
+# body stops being read
+STREAM_MAX_PENDING_CHUNKS = int(os.getenv("STREAM_MAX_PENDING_CHUNKS", "2"))
+
+# How import chunks reach the table: one INSERT per chunk, server-side async
+# inserts acknowledged once flushed, or coalesced in-process across requests
+INSERT_MODES = ('sync', 'async', 'buffered')
+INSERT_MODE_SETTINGS = {
+    'sync': {},
+    'async': {'async_insert': 1, 'wait_for_async_insert': 1}
+}
+
 # Models
 class TokenRequest(BaseModel):
     username: str
@@ -49,6 +123,7 @@ class ClickHouseConfig(BaseModel):
     user: str
     password: str
     jwtToken: Optional[str] = None
+    httpPort: Optional[int] = None
 
 class FlatFileConfig(BaseModel):
     file_path: str
@@ -75,101 +150,138 @@ class LoginRequest(BaseModel):
     username: str
     password: str
 
-# Type mapping between ClickHouse and Python
-CLICKHOUSE_TO_PYTHON_TYPES = {
-    'UInt8': int,
-    'UInt16': int,
-    'UInt32': int,
-    'UInt64': int,
-    'Int8': int,
-    'Int16': int,
-    'Int32': int,
-    'Int64': int,
-    'Float32': float,
-    'Float64': float,
-    'String': str,
-    'Date': str,
-    'DateTime': str,
-    'Array': list,
-    'Nullable': lambda x: x
-}
+def connect_clickhouse_driver(config: Optional[ClickHouseConfig] = None) -> Client:
+    if config:
+        return Client(
+            host=config.host,
+            port=config.port,
+            database=config.database,
+            user=config.user,
+            password=config.jwtToken or config.password
+        )
+    return Client(
+        host=CLICKHOUSE_HOST,
+        port=CLICKHOUSE_PORT,
+        user=CLICKHOUSE_USER,
+        password=CLICKHOUSE_PASSWORD,
+        database='default'
+    )
+
+# Builds the client behind every get_clickhouse_client call; tests and
+# benchmarks swap in a FakeClient through set_client_factory
+client_factory: Callable[[Optional[ClickHouseConfig]], Client] = connect_clickhouse_driver
+
+def set_client_factory(factory: Optional[Callable[[Optional[ClickHouseConfig]], Client]] = None):
+    """Use factory to create ClickHouse clients; None restores the native driver"""
+    global client_factory
+    client_factory = factory or connect_clickhouse_driver
 
 def get_clickhouse_client(config: Optional[ClickHouseConfig] = None):
     try:
-        if config:
-            client = Client(
-                host=config.host,
-                port=config.port,
-                database=config.database,
-                user=config.user,
-                password=config.jwtToken or config.password
-            )
-        else:
-            client = Client(
-                host=CLICKHOUSE_HOST,
-                port=CLICKHOUSE_PORT,
-                user=CLICKHOUSE_USER,
-                password=CLICKHOUSE_PASSWORD,
-                database='default'
-            )
+        client = client_factory(config)
         # Test connection
         client.execute('SELECT 1')
         return client
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to connect to ClickHouse: {str(e)}")
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+def get_clickhouse_http(config: Optional[ClickHouseConfig] = None) -> ClickHouseHTTP:
+    """HTTP interface of the same server, used by the Arrow data plane"""
+    if config:
+        return ClickHouseHTTP(
+            config.host, config.httpPort or CLICKHOUSE_HTTP_PORT, config.user,
+            config.jwtToken or config.password, config.database
+        )
+    return ClickHouseHTTP(CLICKHOUSE_HOST, CLICKHOUSE_HTTP_PORT, CLICKHOUSE_USER, CLICKHOUSE_PASSWORD)
+
+def check_data_plane(data_plane: str):
+    if data_plane not in DATA_PLANES:
+        raise HTTPException(status_code=400, detail=f"data_plane must be one of {', '.join(DATA_PLANES)}")
+
+def credential_key(secret: str) -> str:
+    """Keyed hash of a password or token, so pool keys do not keep it in the clear"""
+    return hmac.new(CREDENTIAL_KEY_SECRET, secret.encode(), hashlib.sha256).hexdigest()
+
+def get_clickhouse_pool(config: Optional[ClickHouseConfig] = None, size: int = 4) -> ClickHousePool:
+    """Return the shared connection pool for the given server configuration.
+
+    The credentials are part of the key, so a request never borrows connections
+    authenticated with someone else's password.
+    """
+    if config:
+        server = (config.host, config.port, config.database, config.user)
+        secret = config.jwtToken or config.password
+    else:
+        server = (CLICKHOUSE_HOST, CLICKHOUSE_PORT, 'default', CLICKHOUSE_USER)
+        secret = CLICKHOUSE_PASSWORD
+    host, port, database, user = server
+    return get_pool(server + (credential_key(secret),), lambda: get_clickhouse_client(config), size,
+                    label=f"{user}@{host}:{port}/{database}")
+
+def is_admin(payload: Dict[str, Any]) -> bool:
+    return payload.get('role') == 'admin' or payload.get('sub') in PROFILE_ADMINS
+
+def verify_admin(payload: Dict[str, Any] = Depends(verify_token)):
+    if not is_admin(payload):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return payload
 
 def check_type_compatibility(value, ch_type):
     """Check if a value is compatible with ClickHouse type"""
     try:
-        if value is None:
-            return True, None
-        
-        # Handle Nullable types
-        if ch_type.startswith('Nullable('):
-            base_type = ch_type[9:-1]
-            return check_type_compatibility(value, base_type)
-        
-        # Handle Array types
-        if ch_type.startswith('Array('):
-            base_type = ch_type[6:-1]
-            if not isinstance(value, list):
-                return False, f"Expected array, got {type(value)}"
-            for item in value:
-                compatible, warning = check_type_compatibility(item, base_type)
-                if not compatible:
-                    return False, warning
-            return True, None
-        
-        # Get the Python type converter
-        python_type = CLICKHOUSE_TO_PYTHON_TYPES.get(ch_type, str)
-        try:
-            python_type(value)
-            return True, None
-        except (ValueError, TypeError) as e:
-            return False, f"Cannot convert {value} to {ch_type}: {str(e)}"
+        warning = check_value(value, ch_type)
+        return warning is None, warning
     except Exception as e:
         return False, f"Type checking error: {str(e)}"
 
-async def stream_data(client: Client, query: str, batch_size: int = 1000) -> Generator[List[Dict], None, None]:
-    """Stream data from ClickHouse in batches"""
-    offset = 0
+async def stream_data(client: Client, query: Query, batcher: Optional[AdaptiveBatcher] = None,
+                      route: str = 'ch-to-file') -> Generator[List[Dict], None, None]:
+    """Stream data from ClickHouse in adaptively sized batches"""
+    batcher = batcher or AdaptiveBatcher('export')
+    qid = query_id()
+    result = query.execute_iter(client, settings={'max_block_size': batcher.rows}, query_id=qid)
     while True:
-        batch_query = f"{query} LIMIT {batch_size} OFFSET {offset}"
-        batch = client.execute(batch_query)
+        started = time.perf_counter()
+        with stage(route, 'fetch'):
+            batch = list(islice(result, batcher.rows))
         if not batch:
             break
         yield batch
-        offset += batch_size
+        # Timed across the consumer's handling of the batch as well
+        batcher.observe(len(batch), time.perf_counter() - started)
+    record_query(client, qid)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """Profile a request when asked via ?profile=<mode> or an X-Profile header"""
+    mode = request.query_params.get('profile') or request.headers.get('X-Profile')
+    if not mode:
+        return await call_next(request)
+    if mode in ('1', 'true'):
+        mode = 'cprofile'
+    if mode not in PROFILE_MODES:
+        return JSONResponse(status_code=400, content={"detail": f"profile must be one of {', '.join(PROFILE_MODES)}"})
+    
+    # Profiling exposes code paths and timings, so only admins may turn it on
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    try:
+        if scheme.lower() != 'bearer' or not is_admin(decode_token(token)):
+            raise HTTPException(status_code=403, detail="Profiling requires an admin token")
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail})
+    
+    with profile_request(mode, f"{request.method} {request.url.path}") as session:
+        response = await call_next(request)
+    response.headers['X-Profile-Id'] = session.id
+    return response
+
+@app.on_event("shutdown")
+def flush_insert_buffers():
+    close_buffers()
+
+@app.on_event("shutdown")
+def stop_parse_workers():
+    close_parse_pool()
 
 # Routes
 @app.get("/")
@@ -177,7 +289,7 @@ async def root():
     return {"message": "Data Ingestion API"}
 
 @app.post("/connect/clickhouse")
-async def connect_clickhouse(config: ClickHouseConfig, credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def connect_clickhouse(config: ClickHouseConfig, claims: Dict[str, Any] = Depends(verify_token)):
     try:
         client = get_clickhouse_client(config)
         return {"status": "success", "message": "Connected successfully"}
@@ -188,7 +300,7 @@ async def connect_clickhouse(config: ClickHouseConfig, credentials: HTTPAuthoriz
         )
 
 @app.get("/clickhouse/tables")
-async def get_tables(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_tables(claims: Dict[str, Any] = Depends(verify_token)):
     try:
         client = get_clickhouse_client()
         result = client.execute("SHOW TABLES")
@@ -197,11 +309,47 @@ async def get_tables(credentials: HTTPAuthorizationCredentials = Depends(securit
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/clickhouse/columns")
-async def get_columns(table: str, credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_columns(table: str, claims: Dict[str, Any] = Depends(verify_token)):
     try:
         client = get_clickhouse_client()
-        result = client.execute(f"DESCRIBE TABLE {table}")
+        result = query_builder.describe(table).execute(client)
         return {"columns": [{"name": row[0], "type": row[1]} for row in result]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/clickhouse/columns/stats")
+async def get_column_stats(
+    table: str,
+    columns: Optional[List[str]] = Query(None),
+    sample: Optional[float] = None,
+    top_k: int = DEFAULT_TOP_K,
+    refresh: bool = False,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    """Cardinality, null fraction, min/max and top values per column from one aggregate query"""
+    if sample is not None and not 0 < sample <= 1:
+        raise HTTPException(status_code=400, detail="sample must be in (0, 1]")
+    try:
+        client = get_clickhouse_client()
+        schema = [[name, ch_type] for name, ch_type in get_type_map(client, table).items()]
+        selected = [(name, ch_type) for name, ch_type in schema if not columns or name in columns]
+        missing = set(columns or []) - {name for name, _ in selected}
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(sorted(missing))}")
+        key = table_stats_query(table, selected, top_k, sample).key
+        stats = None if refresh else stats_cache.get(f"table:{table}", schema, key)
+        if stats is not None:
+            return {**stats, "cached": True}
+        with stage('column_stats', 'query'):
+            stats = await run_in_thread(table_column_stats, client, table, selected, top_k, sample)
+        stats_cache.put(f"table:{table}", schema, key, stats)
+        return {**stats, "cached": False}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -210,33 +358,39 @@ async def preview_clickhouse(
     table: str,
     columns: List[str],
     limit: int = 100,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    claims: Dict[str, Any] = Depends(verify_token)
 ):
     try:
+        query = query_builder.select(table, columns, limit=limit)
+        cache_settings = {'use_query_cache': 1, 'query_cache_ttl': PREVIEW_QUERY_CACHE_TTL} if PREVIEW_QUERY_CACHE_TTL else None
         client = get_clickhouse_client()
-        columns_str = ', '.join(columns)
-        result = client.execute(f"SELECT {columns_str} FROM {table} LIMIT {limit}")
-        
-        # Get column types
-        column_types = client.execute(f"DESCRIBE TABLE {table}")
+        with stage('preview', 'query'):
+            result = query.execute(client, cache_settings)
+            
+            # Get column types
+            column_types = query_builder.describe(table).execute(client)
         type_map = {col[0]: col[1] for col in column_types}
         
         # Check type compatibility
         type_warnings = []
-        for row in result:
-            for i, value in enumerate(row):
-                col_name = columns[i]
-                col_type = type_map.get(col_name)
-                if col_type:
-                    compatible, warning = check_type_compatibility(value, col_type)
-                    if not compatible and warning:
-                        type_warnings.append(warning)
+        with stage('preview', 'validate'):
+            for row in result:
+                for i, value in enumerate(row):
+                    col_name = columns[i]
+                    col_type = type_map.get(col_name)
+                    if col_type:
+                        compatible, warning = check_type_compatibility(value, col_type)
+                        if not compatible and warning:
+                            type_warnings.append(warning)
+        ROWS_TOTAL.inc(len(result), route='preview', table=table)
         
         return {
             "data": result,
             "columns": columns,
             "typeWarnings": type_warnings
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -255,42 +409,678 @@ async def preview_flatfile(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/flatfile/stats")
+async def flatfile_stats(
+    file: UploadFile = File(...),
+    delimiter: str = ',',
+    top_k: int = DEFAULT_TOP_K,
+    refresh: bool = False
+):
+    """Per-column statistics of a whole file, read once in chunks"""
+    try:
+        digest = file_hash(file.file)
+        params = json.dumps([delimiter, top_k])
+        stats = None if refresh else stats_cache.get(f"file:{digest}", None, params)
+        if stats is not None:
+            return {**stats, "cached": True}
+        with stage('column_stats', 'parse'):
+            stats = await run_in_thread(
+                profile_columns, iter_csv_chunks(file.file, max_rows=DEDUP_CHUNK_ROWS), delimiter, top_k
+            )
+        stats_cache.put(f"file:{digest}", None, params, stats)
+        return {**stats, "cached": False}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/profiles")
+async def get_profiles(admin: Dict[str, Any] = Depends(verify_admin)):
+    return {"profiles": list_profiles()}
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, admin: Dict[str, Any] = Depends(verify_admin)):
+    """Stage spans and totals of a stored profile"""
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return profile
+
+@app.get("/profiles/{profile_id}/download")
+async def download_profile(profile_id: str, admin: Dict[str, Any] = Depends(verify_admin)):
+    """The raw pstats dump or collapsed-stack file of a stored profile"""
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    path = profile_output_path(profile)
+    return FileResponse(path, media_type='application/octet-stream', filename=os.path.basename(path))
+
+@app.get("/ingest/batching")
+async def get_batching_stats(claims: Dict[str, Any] = Depends(verify_token)):
+    """Summary of the batch sizes chosen by each pipeline since startup"""
+    return batch_stats()
+
 @app.post("/ingest/ch-to-file")
 async def clickhouse_to_file(
     table: str,
     columns: List[str],
     config: ClickHouseConfig,
     joinConfig: Optional[Dict] = None,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    parallelism: int = 1,
+    split_by: Optional[str] = None,
+    output: str = 'merged',
+    server_stats: bool = False,
+    watermark_column: Optional[str] = None,
+    target: str = 'default',
+    data_plane: str = DATA_PLANE,
+    partition_by: Optional[str] = None,
+    max_rows_per_file: Optional[int] = None,
+    max_bytes_per_file: Optional[int] = None,
+    claims: Dict[str, Any] = Depends(verify_token)
 ):
+    if output not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"output must be one of {', '.join(OUTPUT_MODES)}")
+    check_data_plane(data_plane)
+    is_join = bool(joinConfig and len(joinConfig.get('tables', [])) > 1)
+    if watermark_column and is_join:
+        raise HTTPException(status_code=400, detail="Incremental exports are only supported for single tables")
+    split_files = bool(partition_by or max_rows_per_file or max_bytes_per_file)
+    if (split_files or output != 'merged') and is_join:
+        raise HTTPException(status_code=400, detail="Split exports are only supported for single tables")
+    if split_files and output == 'merged':
+        raise HTTPException(status_code=400, detail="Split exports need output=shards or output=manifest")
+    if partition_by and not re.fullmatch(r'\w+', partition_by):
+        raise HTTPException(status_code=400, detail="partition_by must be a column name")
+    if split_by not in (None, 'partition', 'key') and not re.fullmatch(r'\w+', split_by):
+        raise HTTPException(status_code=400, detail="split_by must be partition, key or a column name")
+    parallel = (parallelism > 1 or output != 'merged') and not is_join
+    with transfer_report('ch-to-file-parallel' if parallel else 'ch-to-file', table) as report:
+        try:
+            where = None
+            watermark_headers = {}
+            if watermark_column:
+                where, upper, watermark_headers = await run_in_thread(
+                    plan_incremental_export, config, table, watermark_column, target
+                )
+            
+            # Single tables can be split into ranges and read on several connections
+            if parallel:
+                parallelism = min(parallelism, EXPORT_MAX_PARALLELISM)
+                pool = get_clickhouse_pool(config, size=parallelism)
+                path, total_rows, shard_count = await run_in_thread(
+                    export_parallel, pool, table, columns, parallelism, split_by, output, None, where,
+                    partition_by, max_rows_per_file, max_bytes_per_file
+                )
+                manifest = None
+                if output == 'manifest':
+                    with open(path) as f:
+                        manifest = json.load(f)
+                    size = sum(entry['bytes'] for entry in manifest['files'])
+                else:
+                    size = os.path.getsize(path)
+                ROWS_TOTAL.inc(total_rows, route='ch-to-file-parallel', table=table)
+                BYTES_TOTAL.inc(size, route='ch-to-file-parallel', table=table)
+                report.finish(total_rows, size)
+                if server_stats:
+                    with pool.connection() as client:
+                        report.collect_server_stats(client, flush=True)
+                report_store.save(report)
+                if watermark_column and total_rows:
+                    watermark_store.advance(table, target, watermark_column, upper, total_rows)
+                headers = {
+                    "X-Record-Count": str(total_rows),
+                    "X-Shard-Count": str(shard_count),
+                    "X-Report-Id": report.id,
+                    **watermark_headers
+                }
+                if manifest is not None:
+                    return JSONResponse(manifest, headers=headers)
+                if output == 'shards':
+                    return FileResponse(path, media_type='application/zip',
+                                        filename=f"{table}_export.zip", headers=headers)
+                return FileResponse(path, media_type='text/csv',
+                                    filename=f"{table}_export.csv", headers=headers)
+
+            client = get_clickhouse_client(config)
+            
+            exported = None
+            if data_plane == 'arrow' and not is_join:
+                exported = await run_in_thread(export_arrow, client, config, table, columns, where)
+            if exported:
+                path, total_rows, size = exported
+            else:
+                # Build query based on join config
+                if is_join:
+                    query = build_join_query(joinConfig, columns)
+                else:
+                    query = query_builder.select(table, columns, where)
+                
+                # Create a temporary file
+                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv') as tmp_file:
+                    writer = csv.writer(tmp_file)
+                    writer.writerow(columns)
+                    
+                    total_rows = 0
+                    async for batch in stream_data(client, query):
+                        with stage('ch-to-file', 'export_serialize'):
+                            writer.writerows(batch)
+                        total_rows += len(batch)
+                    path, size = tmp_file.name, tmp_file.tell()
+            
+            ROWS_TOTAL.inc(total_rows, route='ch-to-file', table=table)
+            BYTES_TOTAL.inc(size, route='ch-to-file', table=table)
+            report.finish(total_rows, size)
+            if server_stats:
+                report.collect_server_stats(client, flush=True)
+            report_store.save(report)
+            if watermark_column and total_rows:
+                watermark_store.advance(table, target, watermark_column, upper, total_rows)
+            return FileResponse(
+                path,
+                media_type='text/csv',
+                filename=f"{table}_export.csv",
+                headers={"X-Record-Count": str(total_rows), "X-Report-Id": report.id, **watermark_headers}
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except HTTPException:
+            raise
+        except Exception as e:
+            report.finish(report.rows, report.bytes, 'failed')
+            report_store.save(report)
+            raise HTTPException(status_code=500, detail=str(e))
+
+def export_directory(export_id: str) -> str:
+    if not re.fullmatch(r'[0-9a-f]{32}', export_id) or not os.path.isdir(os.path.join(EXPORT_DIR, export_id)):
+        raise HTTPException(status_code=404, detail=f"Export {export_id} not found")
+    return os.path.join(EXPORT_DIR, export_id)
+
+@app.get("/ingest/exports/{export_id}")
+async def get_export_manifest(export_id: str, claims: Dict[str, Any] = Depends(verify_token)):
+    return FileResponse(os.path.join(export_directory(export_id), 'manifest.json'), media_type='application/json')
+
+@app.get("/ingest/exports/{export_id}/{name}")
+async def download_export_file(export_id: str, name: str, claims: Dict[str, Any] = Depends(verify_token)):
+    """One file of a manifest export; only names listed in its manifest are served"""
+    directory = export_directory(export_id)
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        names = {entry['name'] for entry in json.load(f)['files']}
+    if name not in names:
+        raise HTTPException(status_code=404, detail=f"{name} is not part of export {export_id}")
+    return FileResponse(os.path.join(directory, name), media_type='text/csv', filename=name)
+
+@app.delete("/ingest/exports/{export_id}")
+async def delete_export(export_id: str, claims: Dict[str, Any] = Depends(verify_token)):
+    shutil.rmtree(export_directory(export_id))
+    return {"status": "success", "message": f"Export {export_id} deleted"}
+
+@app.post("/ingest/ch-to-ch")
+async def clickhouse_to_clickhouse(
+    table: str,
+    columns: List[str],
+    source: ClickHouseConfig,
+    target: ClickHouseConfig,
+    joinConfig: Optional[Dict] = None,
+    target_table: Optional[str] = None,
+    mode: str = TRANSFER_MODE,
+    source_address: Optional[str] = None,
+    secure: bool = False,
+    create_table: bool = True,
+    parallelism: int = 1,
+    server_stats: bool = False,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    """Copy a table or join between two servers without moving rows through Python"""
+    if mode not in TRANSFER_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(TRANSFER_MODES)}")
+    tables = (joinConfig or {}).get('tables', [])
+    if len(tables) > 1:
+        table = tables[0].get('table')
+    joins = [(left.get('table'), left.get('key'), right.get('table'), right.get('key'))
+             for left, right in zip(tables, tables[1:])]
+    join_type = (joinConfig or {}).get('joinType', 'INNER')
+    target_table = target_table or table
+    settings = {'max_threads': parallelism, 'max_insert_threads': parallelism} if parallelism > 1 else None
+    with transfer_report('ch-to-ch', target_table) as report:
+        try:
+            select = query_builder.join_select(columns, table, joins, join_type).sql
+            source_client = get_clickhouse_client(source)
+            target_client = get_clickhouse_client(target)
+            if create_table:
+                await run_in_thread(create_target, source_client, target_client, target_table, select, columns)
+            if mode == 'remote':
+                # The target server pulls the rows, so the source address is as seen from there
+                params: Dict[str, Any] = {}
+                remote_select = query_builder.join_select(columns, table, joins, join_type, remote_source(
+                    source_address or f"{source.host}:{source.port}", source.database, source.user,
+                    source.jwtToken or source.password, params, secure
+                )).sql
+                rows, size = await run_in_thread(
+                    copy_remote, target_client, target_table, columns, remote_select, params, settings
+                )
+            else:
+                rows, size = await run_in_thread(
+                    copy_stream, get_clickhouse_http(source), get_clickhouse_http(target),
+                    target_table, columns, select, settings
+                )
+            ROWS_TOTAL.inc(rows, route='ch-to-ch', table=target_table)
+            BYTES_TOTAL.inc(size, route='ch-to-ch', table=target_table)
+            report.finish(rows, size)
+            if server_stats:
+                report.collect_server_stats(target_client, flush=True)
+            return {
+                "status": "success",
+                "message": f"Successfully copied {rows} rows",
+                "mode": mode,
+                "rows": rows,
+                "bytes": size,
+                "report": report_store.save(report)
+            }
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except HTTPException:
+            raise
+        except Exception as e:
+            report.finish(report.rows, report.bytes, 'failed')
+            report_store.save(report)
+            raise HTTPException(status_code=500, detail=str(e))
+
+def export_arrow(
+    client: Client,
+    config: Optional[ClickHouseConfig],
+    table: str,
+    columns: List[str],
+    where: Optional[Tuple[str, Dict[str, Any]]] = None
+) -> Optional[Tuple[str, int, int]]:
+    """Export a table through Arrow record batches; returns path, rows and bytes.
+
+    None when a column is not a plain column of the table, so the export takes the Python plane.
+    """
+    type_map = get_type_map(client, table)
+    if any(col not in type_map for col in columns):
+        return None
+    select = arrow_plane.export_select([(col, type_map[col]) for col in columns])
+    query = Query(f"SELECT {', '.join(select)} FROM {query_builder.identifier(table)}")
+    if where is not None:
+        predicate, query.params = query_builder.server_predicate(*where)
+        query.sql += f" WHERE {predicate}"
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
+        with stage('ch-to-file', 'export_serialize'):
+            total_rows = get_clickhouse_http(config).export_csv(query.sql, tmp_file, columns, query.http_settings())
+        return tmp_file.name, total_rows, tmp_file.tell()
+
+def plan_incremental_export(
+    config: ClickHouseConfig,
+    table: str,
+    column: str,
+    target: str
+) -> tuple:
+    """Bound the next delta of table by its stored and current watermark.
+
+    Returns the WHERE predicate with its parameters, the new upper watermark and
+    response headers. The upper bound is fixed before exporting, so rows added
+    meanwhile are left for the next run instead of being split across two.
+    """
+    stored = watermark_store.get(table, target)
+    if stored and stored['watermark_column'] != column:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Target {target} tracks {stored['watermark_column']}; reset its watermark to switch columns"
+        )
+    client = get_clickhouse_client(config)
+    lower = stored['watermark'] if stored else None
+    quoted = query_builder.identifier(column)
+    query = Query(f"SELECT max({quoted}), count() FROM {query_builder.identifier(table)}")
+    if stored:
+        query.sql += f" WHERE {quoted} > {query_builder.bind(query.params, 'watermark_from', lower)}"
+    upper, new_rows = query.execute(client)[0]
+    
+    headers = {"X-Watermark-Column": column}
+    if lower is not None:
+        headers["X-Watermark-From"] = str(lower)
+    if not new_rows:
+        # Nothing new since the last run; export an empty delta
+        return ("0", {}), lower, headers
+    headers["X-Watermark-To"] = str(upper)
+    where = f"{quoted} <= %(watermark_to)s"
+    if stored:
+        where = f"{quoted} > %(watermark_from)s AND {where}"
+    return (where, {'watermark_from': lower, 'watermark_to': upper}), upper, headers
+
+def frame_to_rows(frame: pd.DataFrame, type_map: Optional[Dict[str, str]] = None) -> List[tuple]:
+    """Convert a parsed chunk into the row tuples the driver inserts.
+
+    With a type_map, each column is first converted to the values its ClickHouse type expects.
+    """
+    if not type_map:
+        return [tuple(row) for row in frame.itertuples(index=False)]
+    columns = [to_driver(frame[col], type_map[col]) if col in type_map else frame[col].tolist() for col in frame.columns]
+    return list(zip(*columns))
+
+def collect_type_warnings(frame: pd.DataFrame, type_map: Dict[str, str], type_warnings: List[str]):
+    """Append a warning for every value in frame that does not fit its column type"""
+    for col in frame.columns:
+        if col in type_map:
+            type_warnings.extend(column_warnings(frame[col], type_map[col]))
+
+def get_type_map(client: Client, table: str) -> Dict[str, str]:
+    """Column name to ClickHouse type for table"""
+    column_types = query_builder.describe(table).execute(client)
+    return {col[0]: col[1] for col in column_types}
+
+def insert_chunk(
+    client: Client,
+    table: str,
+    chunk: CsvChunk,
+    delimiter: str,
+    type_map: Dict[str, str],
+    type_warnings: List[str],
+    insert_settings: Optional[Dict[str, Any]] = None,
+    route: str = 'file-to-ch',
+    http: Optional[ClickHouseHTTP] = None,
+    arrow_types: Optional[Dict[str, Any]] = None,
+    parsed: Any = None
+) -> int:
+    """Parse, validate and insert one chunk; returns the number of rows inserted.
+
+    With arrow_types, the chunk is parsed into an Arrow table and sent over http
+    as is; a chunk with values that do not parse falls back to the Python plane,
+    which reports them as type warnings. parsed is the chunk already parsed by
+    parse_chunk, e.g. in a parse worker.
+    """
+    if parsed is None:
+        with stage(route, 'parse'):
+            parsed = parse_chunk(chunk, delimiter, categorical_dtypes(type_map), arrow_types)
+    if not isinstance(parsed, pd.DataFrame):
+        qid = query_id()
+        with stage(route, 'insert'):
+            rows = http.insert(table, parsed, {**(insert_settings or {}), **({'query_id': qid} if qid else {})})
+        record_query(http, qid)
+        ROWS_TOTAL.inc(rows, route=route, table=table)
+        BYTES_TOTAL.inc(len(chunk.data), route=route, table=table)
+        return rows
+    frame = parsed
+    
+    # Check type compatibility
+    with stage(route, 'validate'):
+        collect_type_warnings(frame, type_map, type_warnings)
+    
+    # Prepare data for insertion
+    with stage(route, 'convert'):
+        data = frame_to_rows(frame, type_map)
+    qid = query_id()
+    with stage(route, 'insert'):
+        client.execute(
+            query_builder.insert(table, frame.columns),
+            data,
+            settings=insert_settings or None,
+            query_id=qid
+        )
+    record_query(client, qid)
+    ROWS_TOTAL.inc(len(data), route=route, table=table)
+    BYTES_TOTAL.inc(len(chunk.data), route=route, table=table)
+    return len(data)
+
+def import_csv(
+    client: Client,
+    table: str,
+    source,
+    delimiter: str = ',',
+    transfer_id: Optional[str] = None,
+    offset: int = 0,
+    insert_settings: Optional[Dict[str, Any]] = None,
+    dedup: bool = False,
+    http: Optional[ClickHouseHTTP] = None,
+    parse_workers: int = 1,
+    type_map: Optional[Dict[str, str]] = None,
+    chunk_rows: Optional[int] = None,
+    file_digest: Optional[str] = None
+) -> Dict[str, Any]:
+    """Insert a binary CSV stream chunk by chunk, checkpointing when transfer_id is set.
+
+    With dedup, chunks have a fixed row count and are tokened by the file's hash
+    (file_digest, if already computed) and their position in it, so chunks of a
+    re-sent file are dropped by the server while equal chunks elsewhere are kept.
+    Checkpointed imports also cut chunk_rows rows per chunk, so a resume re-sends
+    the same chunks under the same tokens; other imports size chunks adaptively.
+    With http, chunks take the Arrow data plane. With parse_workers, chunks are
+    parsed ahead in worker processes while earlier ones are inserted.
+    A type_map looked up once can be shared by several imports into table.
+    """
+    # Get column types from ClickHouse
+    if type_map is None:
+        type_map = get_type_map(client, table)
+    arrow_types = arrow_plane.column_types(type_map) if http else None
+    
+    total_rows = 0
+    type_warnings = []
+    batcher = AdaptiveBatcher('import')
+    if dedup and file_digest is None:
+        file_digest = file_hash(source)
+    if dedup or transfer_id:
+        chunk_rows = chunk_rows or (DEDUP_CHUNK_ROWS if dedup else CHECKPOINT_CHUNK_ROWS)
+        chunks = iter_csv_chunks(source, max_rows=chunk_rows, offset=offset)
+    else:
+        chunks = iter_csv_chunks(source, offset=offset, batcher=batcher)
+    
+    parsed_chunks = iter_parsed(chunks, delimiter, categorical_dtypes(type_map), arrow_types, parse_workers)
+    for chunk, parsed in parsed_chunks:
+        started = time.perf_counter()
+        settings = dict(insert_settings or {})
+        if dedup:
+            settings.update(dedup_token(file_digest, chunk.start))
+        elif transfer_id:
+            # A stable token per chunk lets the server drop a re-sent chunk on resume
+            settings.update(dedup_token(transfer_id, chunk.start))
+        rows = insert_chunk(client, table, chunk, delimiter, type_map, type_warnings, settings,
+                            http=http, arrow_types=arrow_types, parsed=parsed)
+        total_rows += rows
+        if transfer_id:
+            checkpoint_store.commit_chunk(transfer_id, chunk.end, rows)
+        batcher.observe(rows, time.perf_counter() - started, len(chunk.data))
+    
+    if transfer_id:
+        checkpoint_store.finish(transfer_id)
+    return {"records_processed": total_rows, "typeWarnings": type_warnings}
+
+async def import_csv_stream(
+    client: Client,
+    table: str,
+    body,
+    delimiter: str = ',',
+    insert_settings: Optional[Dict[str, Any]] = None,
+    http: Optional[ClickHouseHTTP] = None
+) -> Dict[str, Any]:
+    """Insert a CSV request body while it is still arriving.
+
+    Chunks are inserted one at a time in a worker thread. When
+    STREAM_MAX_PENDING_CHUNKS are waiting, reading the body pauses, so TCP
+    flow control slows the client down to what ClickHouse absorbs.
+    """
+    type_map = await run_in_thread(get_type_map, client, table)
+    arrow_types = arrow_plane.column_types(type_map) if http else None
+    
+    total_rows = 0
+    type_warnings = []
+    batcher = AdaptiveBatcher('stream')
+    splitter = CsvStreamSplitter(batcher=batcher)
+    pending: asyncio.Queue = asyncio.Queue(maxsize=STREAM_MAX_PENDING_CHUNKS)
+    
+    async def insert_pending():
+        nonlocal total_rows
+        while True:
+            chunk = await pending.get()
+            if chunk is None:
+                return
+            started = time.perf_counter()
+            rows = await run_in_thread(
+                insert_chunk, client, table, chunk, delimiter, type_map, type_warnings,
+                insert_settings, 'stream-to-ch', http, arrow_types
+            )
+            total_rows += rows
+            batcher.observe(rows, time.perf_counter() - started, len(chunk.data))
+    
+    inserter = asyncio.create_task(insert_pending())
+    
+    async def enqueue(chunk: Optional[CsvChunk]):
+        put = asyncio.ensure_future(pending.put(chunk))
+        await asyncio.wait({put, inserter}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            # The inserter failed; stop reading and surface its error
+            put.cancel()
+            inserter.result()
+    
+    received = 0
     try:
-        client = get_clickhouse_client(config)
-        columns_str = ', '.join(columns)
-        
-        # Build query based on join config
-        if joinConfig and len(joinConfig.get('tables', [])) > 1:
-            query = build_join_query(joinConfig, columns)
-        else:
-            query = f"SELECT {columns_str} FROM {table}"
+        async for data in body:
+            received += len(data)
+            for chunk in splitter.feed(data):
+                await enqueue(chunk)
+        for chunk in splitter.close():
+            await enqueue(chunk)
+        await enqueue(None)
+        await inserter
+    finally:
+        inserter.cancel()
+    return {"records_processed": total_rows, "bytes_received": received, "typeWarnings": type_warnings}
+
+def pool_type_map(pool: ClickHousePool, table: str) -> Dict[str, str]:
+    with pool.connection() as client:
+        return get_type_map(client, table)
+
+def next_buffered_chunk(
+    chunks: Iterator[CsvChunk],
+    delimiter: str,
+    dtypes: Dict[str, Any],
+    type_map: Dict[str, str],
+    type_warnings: List[Dict[str, Any]]
+) -> Optional[Tuple[CsvChunk, Tuple[str, ...], List[tuple]]]:
+    """Read, parse and convert the next chunk of a buffered upload; None once the source is exhausted"""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    with stage('file-to-ch-buffered', 'parse'):
+        frame = read_chunk(chunk, delimiter, dtypes)
+    with stage('file-to-ch-buffered', 'validate'):
+        collect_type_warnings(frame, type_map, type_warnings)
+    with stage('file-to-ch-buffered', 'convert'):
+        data = frame_to_rows(frame, type_map)
+    return chunk, tuple(frame.columns), data
+
+async def import_csv_buffered(
+    config: Optional[ClickHouseConfig],
+    table: str,
+    source,
+    delimiter: str = ','
+) -> Dict[str, Any]:
+    """Hand parsed chunks to the shared per-table buffer and wait until they are flushed.
+
+    Reading, parsing and converting happen in a worker thread, chunk by chunk.
+    """
+    pool = get_clickhouse_pool(config)
+    type_map = await run_in_thread(pool_type_map, pool, table)
+    # LowCardinality and Enum columns stay dictionary encoded from parse to insert
+    dtypes = categorical_dtypes(type_map)
+    
+    total_rows = 0
+    type_warnings = []
+    pending = []
+    chunks = iter_csv_chunks(source, max_rows=INSERT_BUFFER_MAX_ROWS)
+    
+    while True:
+        parsed = await run_in_thread(next_buffered_chunk, chunks, delimiter, dtypes, type_map, type_warnings)
+        if parsed is None:
+            break
+        chunk, columns, data = parsed
+        insert_query = query_builder.insert(table, columns)
         
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv') as tmp_file:
-            writer = csv.writer(tmp_file)
-            writer.writerow(columns)
-            
-            total_rows = 0
-            async for batch in stream_data(client, query):
-                writer.writerows(batch)
-                total_rows += len(batch)
+        def insert(rows, query=insert_query):
+            with stage('file-to-ch-buffered', 'insert'):
+                with pool.connection() as flush_client:
+                    flush_client.execute(query, rows)
         
-        return FileResponse(
-            tmp_file.name,
-            media_type='text/csv',
-            filename=f"{table}_export.csv",
-            headers={"X-Record-Count": str(total_rows)}
-        )
+        # Uploads with the same target and column layout share one buffer
+        buffer = get_buffer((id(pool), table, columns), insert)
+        pending.append(asyncio.wrap_future(buffer.add(data, len(chunk.data))))
+        total_rows += len(data)
+        ROWS_TOTAL.inc(len(data), route='file-to-ch-buffered', table=table)
+        BYTES_TOTAL.inc(len(chunk.data), route='file-to-ch-buffered', table=table)
+    
+    # Acknowledge only once every row of this upload is durable
+    await asyncio.gather(*pending)
+    return {"records_processed": total_rows, "typeWarnings": type_warnings}
+
+def file_size(f) -> int:
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+def import_batch_file(
+    pool: ClickHousePool,
+    table: str,
+    name: str,
+    source,
+    type_map: Dict[str, str],
+    delimiter: str = ',',
+    insert_settings: Optional[Dict[str, Any]] = None,
+    dedup: bool = True,
+    http: Optional[ClickHouseHTTP] = None
+) -> Dict[str, Any]:
+    """Import one file of a batch job; source is a path or an open binary file.
+
+    A failure is returned as the file's result instead of stopping the job.
+    """
+    try:
+        with open(source, 'rb') if isinstance(source, str) else nullcontext(source) as f:
+            size = file_size(f)
+            digest = file_hash(f) if dedup else None
+            if digest and import_index.get(table, digest):
+                return {"file": name, "status": "skipped", "rows": 0, "bytes": size,
+                        "file_hash": digest, "typeWarnings": []}
+            with pool.connection() as client:
+                result = import_csv(client, table, f, delimiter, insert_settings=insert_settings,
+                                    dedup=dedup, http=http, type_map=type_map, file_digest=digest)
+            if digest:
+                import_index.add(table, digest, size, result["records_processed"])
+            return {"file": name, "status": "imported", "rows": result["records_processed"], "bytes": size,
+                    "file_hash": digest, "typeWarnings": result["typeWarnings"]}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return {"file": name, "status": "failed", "rows": 0, "bytes": 0, "error": str(e)}
+
+async def ingest_batch(
+    pool: ClickHousePool,
+    table: str,
+    sources: List[Tuple[str, Any]],
+    job_id: str,
+    delimiter: str = ',',
+    insert_settings: Optional[Dict[str, Any]] = None,
+    dedup: bool = True,
+    http: Optional[ClickHouseHTTP] = None,
+    parallelism: int = 4
+) -> List[Dict[str, Any]]:
+    """Import (name, path or file) sources into table, parallelism files at a time.
+
+    The table schema is looked up once for the whole job.
+    """
+    type_map = await run_in_thread(pool_type_map, pool, table)
+    batch_jobs.start(job_id, table, [name for name, _ in sources])
+    limit = asyncio.Semaphore(parallelism)
+    
+    async def run(index: int, name: str, source) -> Dict[str, Any]:
+        async with limit:
+            result = await run_in_thread(
+                import_batch_file, pool, table, name, source, type_map, delimiter, insert_settings, dedup, http
+            )
+        batch_jobs.update(job_id, index, result)
+        return result
+    
+    results = await asyncio.gather(*(run(i, name, source) for i, (name, source) in enumerate(sources)))
+    batch_jobs.finish(job_id)
+    return list(results)
 
 @app.post("/ingest/file-to-ch")
 async def file_to_clickhouse(
@@ -298,48 +1088,301 @@ async def file_to_clickhouse(
     file: UploadFile = File(...),
     delimiter: str = ',',
     config: ClickHouseConfig = None,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    transfer_id: Optional[str] = None,
+    insert_mode: str = 'sync',
+    server_stats: bool = False,
+    dedup: bool = True,
+    data_plane: str = DATA_PLANE,
+    parse_workers: int = PARSE_WORKERS,
+    claims: Dict[str, Any] = Depends(verify_token)
 ):
-    try:
-        client = get_clickhouse_client(config)
-        
-        # Read the file in chunks
-        df = pd.read_csv(file.file, delimiter=delimiter, chunksize=1000)
-        
-        # Get column types from ClickHouse
-        column_types = client.execute(f'DESCRIBE TABLE {table}')
-        type_map = {col[0]: col[1] for col in column_types}
-        
-        total_rows = 0
-        type_warnings = []
-        
-        for chunk in df:
-            # Check type compatibility
-            for col in chunk.columns:
-                if col in type_map:
-                    for value in chunk[col]:
-                        compatible, warning = check_type_compatibility(value, type_map[col])
-                        if not compatible and warning:
-                            type_warnings.append(warning)
+    if insert_mode not in INSERT_MODES:
+        raise HTTPException(status_code=400, detail=f"insert_mode must be one of {', '.join(INSERT_MODES)}")
+    check_data_plane(data_plane)
+    if insert_mode == 'buffered' and transfer_id:
+        raise HTTPException(status_code=400, detail="Buffered inserts cannot be checkpointed; use sync or async mode")
+    if transfer_id and checkpoint_store.get(transfer_id) is not None:
+        # Starting over would reuse the old run's counters and deduplication tokens
+        raise HTTPException(
+            status_code=409,
+            detail=f"Transfer {transfer_id} already exists; continue it with /ingest/file-to-ch/resume/{transfer_id}"
+        )
+    route = 'file-to-ch-buffered' if insert_mode == 'buffered' else 'file-to-ch'
+    with transfer_report(route, table, transfer_id) as report:
+        try:
+            source_size = file_size(file.file)
+            digest = None
+            if dedup:
+                # One read of the spooled upload decides whether it is a re-send
+                with stage(route, 'hash'):
+                    digest = await run_in_thread(file_hash, file.file)
+                previous = import_index.get(table, digest)
+                if previous:
+                    report.finish(0, source_size, 'skipped')
+                    return {
+                        "status": "success",
+                        "message": f"File already imported into {table} ({previous['rows']} rows); skipped",
+                        "records_processed": 0,
+                        "typeWarnings": [],
+                        "duplicate": True,
+                        "file_hash": digest,
+                        "report": report_store.save(report)
+                    }
+            if insert_mode == 'buffered':
+                # Flushes are shared between uploads, so only client-side stages are reported;
+                # the shared buffer merges Python rows, so it always takes the Python plane
+                result = await import_csv_buffered(config, table, file.file, delimiter)
+            else:
+                client = get_clickhouse_client(config)
+                
+                if transfer_id:
+                    checkpoint_store.start(
+                        transfer_id, 'file-to-ch', table,
+                        {"delimiter": delimiter, "insert_mode": insert_mode, "dedup": dedup,
+                         "data_plane": data_plane,
+                         "chunk_rows": DEDUP_CHUNK_ROWS if dedup else CHECKPOINT_CHUNK_ROWS}, source_size
+                    )
+                
+                # Parsing and inserting block, so they run off the event loop
+                result = await run_in_thread(
+                    import_csv, client, table, file.file, delimiter, transfer_id,
+                    insert_settings=INSERT_MODE_SETTINGS[insert_mode], dedup=dedup,
+                    http=get_clickhouse_http(config) if data_plane == 'arrow' else None,
+                    parse_workers=min(parse_workers, PARSE_WORKERS), file_digest=digest
+                )
+            total_rows = result["records_processed"]
+            if digest:
+                import_index.add(table, digest, source_size, total_rows)
+            report.finish(total_rows, source_size)
+            if server_stats and insert_mode != 'buffered':
+                report.collect_server_stats(client, flush=True)
             
-            # Prepare data for insertion
-            data = [tuple(row) for row in chunk.itertuples(index=False)]
-            client.execute(
-                f'INSERT INTO {table} ({", ".join(chunk.columns)}) VALUES',
-                data
+            return {
+                "status": "success",
+                "message": f"Successfully imported {total_rows} rows",
+                **result,
+                "report": report_store.save(report)
+            }
+        except Exception as e:
+            if transfer_id:
+                checkpoint_store.finish(transfer_id, 'failed')
+            report.finish(report.rows, report.bytes, 'failed')
+            report_store.save(report)
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ingest/batch-to-ch")
+async def batch_to_clickhouse(
+    table: str,
+    files: Optional[List[UploadFile]] = File(None),
+    pattern: Optional[str] = None,
+    delimiter: str = ',',
+    config: ClickHouseConfig = None,
+    insert_mode: str = 'sync',
+    dedup: bool = True,
+    data_plane: str = DATA_PLANE,
+    parallelism: int = 4,
+    job_id: Optional[str] = None,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    """Import many CSV files, uploaded or matched by a server-local glob, into one table as one job"""
+    if insert_mode not in INSERT_MODE_SETTINGS:
+        raise HTTPException(status_code=400, detail=f"insert_mode must be one of {', '.join(INSERT_MODE_SETTINGS)}")
+    check_data_plane(data_plane)
+    sources = [(upload.filename, upload.file) for upload in files or []]
+    if pattern:
+        try:
+            paths = expand_glob(BATCH_INGEST_ROOT, pattern)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        sources += [(os.path.relpath(path, BATCH_INGEST_ROOT), path) for path in paths]
+    if not sources:
+        raise HTTPException(status_code=400, detail="No files to import")
+    job_id = job_id or uuid.uuid4().hex
+    parallelism = max(1, min(parallelism, BATCH_MAX_PARALLELISM))
+    
+    with transfer_report('batch-to-ch', table, job_id) as report:
+        try:
+            pool = get_clickhouse_pool(config, size=parallelism)
+            results = await ingest_batch(
+                pool, table, sources, job_id, delimiter, INSERT_MODE_SETTINGS[insert_mode], dedup,
+                get_clickhouse_http(config) if data_plane == 'arrow' else None, parallelism
             )
-            total_rows += len(data)
-        
+            total_rows = sum(result["rows"] for result in results)
+            failed = [result["file"] for result in results if result["status"] == 'failed']
+            report.finish(total_rows, sum(result["bytes"] for result in results), 'failed' if failed else 'completed')
+            
+            return {
+                "status": "failed" if failed else "success",
+                "message": f"Imported {total_rows} rows from {len(results) - len(failed)} of {len(results)} files",
+                "job_id": job_id,
+                "records_processed": total_rows,
+                "files": results,
+                "report": report_store.save(report)
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            report.finish(report.rows, report.bytes, 'failed')
+            report_store.save(report)
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/ingest/batch/{job_id}")
+async def get_batch_job(job_id: str, claims: Dict[str, Any] = Depends(verify_token)):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No batch job {job_id}")
+    return job
+
+@app.delete("/ingest/imports/{file_hash}")
+async def forget_import(file_hash: str, table: str, claims: Dict[str, Any] = Depends(verify_token)):
+    """Allow a file to be imported into table again, e.g. after the table was truncated"""
+    if not import_index.remove(table, file_hash):
+        raise HTTPException(status_code=404, detail=f"No import of {file_hash} into {table}")
+    return {"status": "success"}
+
+@app.get("/ingest/watermarks")
+async def get_watermarks(table: Optional[str] = None, claims: Dict[str, Any] = Depends(verify_token)):
+    return {"watermarks": watermark_store.list(table)}
+
+@app.delete("/ingest/watermarks")
+async def reset_watermark(table: str, target: str = 'default', claims: Dict[str, Any] = Depends(verify_token)):
+    """Forget the watermark so the next incremental export starts from the beginning"""
+    if not watermark_store.reset(table, target):
+        raise HTTPException(status_code=404, detail=f"No watermark for {table} and target {target}")
+    return {"status": "success"}
+
+@app.post("/ingest/stream-to-ch")
+async def stream_to_clickhouse(
+    request: Request,
+    table: str,
+    delimiter: str = ',',
+    insert_mode: str = 'sync',
+    server_stats: bool = False,
+    data_plane: str = DATA_PLANE,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    """Import a raw CSV request body (not multipart), inserting while it uploads"""
+    if insert_mode not in INSERT_MODE_SETTINGS:
+        raise HTTPException(status_code=400, detail=f"insert_mode must be one of {', '.join(INSERT_MODE_SETTINGS)}")
+    check_data_plane(data_plane)
+    with transfer_report('stream-to-ch', table) as report:
+        try:
+            client = get_clickhouse_client()
+            result = await import_csv_stream(
+                client, table, request.stream(), delimiter, INSERT_MODE_SETTINGS[insert_mode],
+                get_clickhouse_http() if data_plane == 'arrow' else None
+            )
+            total_rows = result["records_processed"]
+            report.finish(total_rows, result["bytes_received"])
+            if server_stats:
+                report.collect_server_stats(client, flush=True)
+            
+            return {
+                "status": "success",
+                "message": f"Successfully imported {total_rows} rows",
+                **result,
+                "report": report_store.save(report)
+            }
+        except Exception as e:
+            report.finish(report.rows, report.bytes, 'failed')
+            report_store.save(report)
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/ingest/checkpoints/{transfer_id}")
+async def get_checkpoint(transfer_id: str, claims: Dict[str, Any] = Depends(verify_token)):
+    checkpoint = checkpoint_store.get(transfer_id)
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail=f"No checkpoint for transfer {transfer_id}")
+    return checkpoint
+
+@app.get("/ingest/reports")
+async def get_reports(
+    limit: int = 50,
+    transfer_id: Optional[str] = None,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    return {"reports": report_store.list(limit, transfer_id)}
+
+@app.get("/ingest/reports/{report_id}")
+async def get_report(
+    report_id: str,
+    server_stats: bool = False,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    """A stored transfer report; server_stats looks its queries up in system.query_log now"""
+    report = report_store.get(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
+    if server_stats and report['queries']:
+        try:
+            client = get_clickhouse_client()
+            stats = reports.server_stats(client, list(report['queries']), report['started_at'])
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        report = report_store.attach_server_stats(report_id, stats)
+    return report
+
+@app.post("/ingest/file-to-ch/resume/{transfer_id}")
+async def resume_file_to_clickhouse(
+    transfer_id: str,
+    file: UploadFile = File(...),
+    config: ClickHouseConfig = None,
+    claims: Dict[str, Any] = Depends(verify_token)
+):
+    """Continue an interrupted import from its last committed chunk; the same file must be re-sent"""
+    checkpoint = checkpoint_store.get(transfer_id)
+    if checkpoint is None or checkpoint['kind'] != 'file-to-ch':
+        raise HTTPException(status_code=404, detail=f"No checkpoint for transfer {transfer_id}")
+    if checkpoint['status'] == 'completed':
         return {
             "status": "success",
-            "message": f"Successfully imported {total_rows} rows",
-            "records_processed": total_rows,
-            "typeWarnings": type_warnings
+            "message": "Transfer already completed",
+            "records_processed": checkpoint['rows'],
+            "typeWarnings": []
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if checkpoint['source_size'] is not None and file_size(file.file) != checkpoint['source_size']:
+        raise HTTPException(status_code=409, detail="Uploaded file does not match the checkpointed transfer")
+    
+    with transfer_report('file-to-ch', checkpoint['target_table'], transfer_id) as report:
+        try:
+            client = get_clickhouse_client(config)
+            digest = None
+            if checkpoint['params'].get('dedup'):
+                digest = await run_in_thread(file_hash, file.file)
+            result = await run_in_thread(
+                import_csv,
+                client,
+                checkpoint['target_table'],
+                file.file,
+                checkpoint['params']['delimiter'],
+                transfer_id,
+                offset=checkpoint['byte_offset'],
+                insert_settings=INSERT_MODE_SETTINGS[checkpoint['params'].get('insert_mode', 'sync')],
+                dedup=checkpoint['params'].get('dedup', False),
+                http=get_clickhouse_http(config) if checkpoint['params'].get('data_plane') == 'arrow' else None,
+                parse_workers=PARSE_WORKERS,
+                chunk_rows=checkpoint['params'].get('chunk_rows'),
+                file_digest=digest
+            )
+            total_rows = checkpoint['rows'] + result["records_processed"]
+            if digest:
+                import_index.add(checkpoint['target_table'], digest, file_size(file.file), total_rows)
+            report.finish(result["records_processed"], file_size(file.file) - checkpoint['byte_offset'])
+            
+            return {
+                "status": "success",
+                "message": f"Resumed at byte {checkpoint['byte_offset']}, imported {result['records_processed']} more rows",
+                "records_processed": total_rows,
+                "typeWarnings": result["typeWarnings"],
+                "report": report_store.save(report)
+            }
+        except Exception as e:
+            checkpoint_store.finish(transfer_id, 'failed')
+            report.finish(report.rows, report.bytes, 'failed')
+            report_store.save(report)
+            raise HTTPException(status_code=500, detail=str(e))
 
-def build_join_query(joinConfig: Dict, columns: List[str]) -> str:
+def build_join_query(joinConfig: Dict, columns: List[str]) -> Query:
     """Build SQL query for joining multiple tables"""
     join_type = joinConfig.get('joinType', 'INNER')
     tables = joinConfig.get('tables', [])
@@ -347,18 +1390,10 @@ def build_join_query(joinConfig: Dict, columns: List[str]) -> str:
     if len(tables) < 2:
         raise HTTPException(status_code=400, detail="At least two tables required for join")
     
-    # Start with the first table
-    query = f"SELECT {', '.join(columns)} FROM {tables[0].get('table')}"
-    
-    # Add joins
-    for i in range(1, len(tables)):
-        prev_table = tables[i-1]
-        curr_table = tables[i]
-        query += f" {join_type} JOIN {curr_table.get('table')} ON "
-        query += f"{prev_table.get('table')}.{prev_table.get('key')} = "
-        query += f"{curr_table.get('table')}.{curr_table.get('key')}"
-    
-    return query
+    # Each table joins the one before it
+    joins = [(prev_table.get('table'), prev_table.get('key'), curr_table.get('table'), curr_table.get('key'))
+             for prev_table, curr_table in zip(tables, tables[1:])]
+    return query_builder.join_select(columns, tables[0].get('table'), joins, join_type)
 
 @app.post("/api/login")
 async def login(login_request: LoginRequest):
@@ -382,4 +1417,6 @@ async def login(login_request: LoginRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001) 
\ No newline at end of file
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # Worker processes import the app themselves, so it is passed by name
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8001, workers=workers) 
\ No newline at end of file
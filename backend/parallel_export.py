@@ -0,0 +1,323 @@
+import contextvars
+import csv
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from clickhouse_driver import Client
+
+import query_builder
+from batching import AdaptiveBatcher
+from profiling import stage
+from query_builder import Query, identifier
+from reports import query_id, record_query
+from pool import ClickHousePool
+
+# A range is a WHERE predicate plus the parameters it references
+Range = Tuple[str, Dict[str, Any]]
+
+OUTPUT_MODES = ('merged', 'shards', 'manifest')
+KEY_SAMPLE_SIZE = 10000
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# 'manifest' exports are kept here until deleted, one directory per export
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), 'ch_exports'))
+PARTITION_MAX_FILES = int(os.getenv("PARTITION_MAX_FILES", "1000"))
+# With a byte limit, rows are written in slices this long between size checks
+ROLLOVER_CHECK_ROWS = 1000
+
+
+def _table_location(table: str) -> Tuple[Optional[str], str]:
+    if '.' in table:
+        database, name = table.split('.', 1)
+        return database, name
+    return None, table
+
+
+def _system_filter(table: str, name_column: str) -> Tuple[str, Dict[str, Any]]:
+    database, name = _table_location(table)
+    params = {'table': name}
+    if database:
+        params['database'] = database
+        return f"database = %(database)s AND {name_column} = %(table)s", params
+    return f"database = currentDatabase() AND {name_column} = %(table)s", params
+
+
+def partition_ranges(client: Client, table: str, parallelism: int) -> List[Range]:
+    """Group the table's active partitions into contiguous, row-balanced ranges"""
+    where, params = _system_filter(table, 'table')
+    partitions = client.execute(
+        f"SELECT partition_id, sum(rows) FROM system.parts WHERE {where} AND active "
+        "GROUP BY partition_id ORDER BY partition_id",
+        params
+    )
+    if len(partitions) < 2:
+        return []
+
+    total = sum(rows for _, rows in partitions)
+    target = total / parallelism
+    groups: List[List[str]] = [[]]
+    filled = 0
+    for partition_id, rows in partitions:
+        if groups[-1] and filled >= target and len(groups) < parallelism:
+            groups.append([])
+            filled = 0
+        groups[-1].append(partition_id)
+        filled += rows
+
+    # One parameter per partition id: values stay scalar, so IN prunes parts whichever side binds them
+    return [
+        (f"_partition_id IN ({', '.join(f'%(partition_{i})s' for i in range(len(group)))})",
+         {f'partition_{i}': partition_id for i, partition_id in enumerate(group)})
+        for group in groups
+    ]
+
+
+def sorting_key_column(client: Client, table: str) -> Optional[str]:
+    """Return the leading sorting key column if it is a plain column reference"""
+    where, params = _system_filter(table, 'name')
+    result = client.execute(f"SELECT sorting_key FROM system.tables WHERE {where}", params)
+    if not result or not result[0][0]:
+        return None
+    first = result[0][0].split(',')[0].strip()
+    return first if re.fullmatch(r'\w+', first) else None
+
+
+def key_ranges(client: Client, table: str, column: str, parallelism: int) -> List[Range]:
+    """Split the table into half-open ranges of column using sampled boundaries"""
+    column = identifier(column)
+    sample = client.execute(
+        f"SELECT arraySort(groupArraySample({KEY_SAMPLE_SIZE}, 1)({column})) FROM {identifier(table)}"
+    )[0][0]
+    if not sample:
+        return []
+
+    boundaries = []
+    for i in range(1, parallelism):
+        value = sample[len(sample) * i // parallelism]
+        if not boundaries or value > boundaries[-1]:
+            boundaries.append(value)
+    if not boundaries:
+        return []
+
+    # Comparisons with NULL are never true, so NULL keys go with the lowest range
+    ranges = [(f"({column} < %(upper)s OR isNull({column}))", {'upper': boundaries[0]})]
+    for lower, upper in zip(boundaries, boundaries[1:]):
+        ranges.append((f"{column} >= %(lower)s AND {column} < %(upper)s", {'lower': lower, 'upper': upper}))
+    ranges.append((f"{column} >= %(lower)s", {'lower': boundaries[-1]}))
+    return ranges
+
+
+def partition_value_ranges(client: Client, table: str, column: str,
+                           where: Optional[Range] = None) -> List[Tuple[Range, Any]]:
+    """One range per distinct value of column, paired with that value"""
+    column = identifier(column)
+    query = f"SELECT DISTINCT {column} FROM {identifier(table)}"
+    params: Dict[str, Any] = {}
+    if where is not None:
+        query += f" WHERE {where[0]}"
+        params = where[1]
+    values = [row[0] for row in client.execute(f"{query} ORDER BY {column} LIMIT {PARTITION_MAX_FILES + 1}", params)]
+    if len(values) > PARTITION_MAX_FILES:
+        raise ValueError(f"{column} has more than {PARTITION_MAX_FILES} distinct values")
+    return [
+        ((f"isNull({column})", {}) if value is None else (f"{column} = %(partition)s", {'partition': value}), value)
+        for value in values
+    ]
+
+
+def plan_ranges(client: Client, table: str, parallelism: int, split_by: Optional[str] = None) -> List[Range]:
+    """Plan disjoint ranges covering the table, ordered by partition or key"""
+    if parallelism < 2:
+        return [("1", {})]
+
+    ranges: List[Range] = []
+    if split_by in (None, 'partition'):
+        ranges = partition_ranges(client, table, parallelism)
+    if not ranges and split_by != 'partition':
+        if split_by not in (None, 'key') and not re.fullmatch(r'\w+', split_by):
+            raise ValueError("split_by must be 'partition', 'key' or a column name")
+        column = split_by if split_by not in (None, 'key') else sorting_key_column(client, table)
+        if column:
+            ranges = key_ranges(client, table, column, parallelism)
+    return ranges or [("1", {})]
+
+
+def _file_name(value: Any) -> str:
+    return re.sub(r'[^\w.-]', '_', 'null' if value is None else str(value))
+
+
+def _export_range(pool: ClickHousePool, query: Query, directory: str, prefix: str,
+                  header: List[str], settings: Dict[str, Any], max_rows: Optional[int] = None,
+                  max_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Write one range as prefix.csv, or as prefix_0000.csv, prefix_0001.csv... when files roll over.
+
+    Returns the name, rows and bytes of every file written, in order.
+    """
+    rolling = bool(max_rows or max_bytes)
+    files: List[Dict[str, Any]] = []
+    batcher = AdaptiveBatcher('parallel_export')
+    f = writer = None
+
+    def roll():
+        nonlocal f, writer
+        if f is not None:
+            files[-1]['bytes'] = f.tell()
+            f.close()
+        name = f"{prefix}_{len(files):04d}.csv" if rolling else f"{prefix}.csv"
+        f = open(os.path.join(directory, name), 'w', newline='')
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        files.append({'name': name, 'rows': 0, 'bytes': 0})
+
+    try:
+        roll()
+        with pool.connection() as client:
+            qid = query_id()
+            result = query.execute_iter(client, {'max_block_size': batcher.rows, **settings}, query_id=qid)
+            while True:
+                started = time.perf_counter()
+                with stage('ch-to-file-parallel', 'fetch'):
+                    batch = list(islice(result, batcher.rows))
+                if not batch:
+                    break
+                written = 0
+                with stage('ch-to-file-parallel', 'export_serialize'):
+                    offset = 0
+                    while offset < len(batch):
+                        current = files[-1]
+                        if current['rows'] and ((max_rows and current['rows'] >= max_rows) or
+                                                (max_bytes and f.tell() >= max_bytes)):
+                            roll()
+                            current = files[-1]
+                        take = len(batch) - offset
+                        if max_rows:
+                            take = min(take, max_rows - current['rows'])
+                        if max_bytes:
+                            take = min(take, ROLLOVER_CHECK_ROWS)
+                        position = f.tell()
+                        writer.writerows(batch[offset:offset + take])
+                        written += f.tell() - position
+                        current['rows'] += take
+                        offset += take
+                batcher.observe(len(batch), time.perf_counter() - started, written)
+            record_query(client, qid)
+    finally:
+        if f is not None:
+            files[-1]['bytes'] = f.tell()
+            f.close()
+    return files
+
+
+def _jsonable(value: Any) -> Any:
+    return value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+
+
+def export_parallel(
+    pool: ClickHousePool,
+    table: str,
+    columns: List[str],
+    parallelism: int,
+    split_by: Optional[str] = None,
+    output: str = 'merged',
+    settings: Optional[Dict[str, Any]] = None,
+    where: Optional[Range] = None,
+    partition_by: Optional[str] = None,
+    max_rows_per_file: Optional[int] = None,
+    max_bytes_per_file: Optional[int] = None
+) -> Tuple[str, int, int]:
+    """Export table ranges concurrently; returns (path, total rows, file count).
+
+    In 'merged' mode the shards are concatenated in range order into one CSV,
+    in 'shards' mode they are returned as separate CSVs inside a zip archive
+    and in 'manifest' mode they stay in a directory under EXPORT_DIR, and the
+    path is that of its manifest.json. where further restricts every range,
+    e.g. to rows past a watermark.
+
+    partition_by writes one file per distinct value of a column instead of
+    balanced ranges; max_rows_per_file and max_bytes_per_file roll a range
+    over into further files. Split files cannot be merged.
+    """
+    if output not in OUTPUT_MODES:
+        raise ValueError(f"Unsupported output mode: {output}")
+    split_files = bool(partition_by or max_rows_per_file or max_bytes_per_file)
+    if split_files and output == 'merged':
+        raise ValueError("Partitioned or rolled-over exports need output 'shards' or 'manifest'")
+
+    with pool.connection() as client:
+        if partition_by:
+            planned = partition_value_ranges(client, table, partition_by, where)
+        else:
+            planned = [(planned_range, None) for planned_range in plan_ranges(client, table, parallelism, split_by)]
+
+    if where is not None:
+        planned = [((f"({predicate}) AND ({where[0]})", {**params, **where[1]}), value)
+                   for (predicate, params), value in planned]
+
+    if partition_by:
+        prefixes = []
+        for (_, params), value in planned:
+            prefix = f"{table}_{partition_by}={_file_name(value)}"
+            # Distinct values can map to the same file name once sanitised
+            prefixes.append(prefix if prefix not in prefixes else f"{prefix}_{len(prefixes):04d}")
+    else:
+        prefixes = [f"{table}_part{i:04d}" for i in range(len(planned))]
+
+    work_dir = tempfile.mkdtemp(prefix='ch_export_')
+    # Shards only carry their own header when they are shipped individually
+    header = columns if output != 'merged' else []
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(planned)))) as executor:
+            futures = [
+                # Run each range in a copy of the caller's context so stage spans
+                # and query ids still reach an active profile or transfer report
+                executor.submit(
+                    contextvars.copy_context().run, _export_range, pool,
+                    query_builder.select(table, columns, planned_range), work_dir, prefix, header, settings or {}, max_rows_per_file, max_bytes_per_file
+                )
+                for (planned_range, _), prefix in zip(planned, prefixes)
+            ]
+            files = [
+                {**entry, 'partition': _jsonable(value)} if partition_by else entry
+                for future, (_, value) in zip(futures, planned) for entry in future.result()
+            ]
+        total_rows = sum(entry['rows'] for entry in files)
+        manifest = {'table': table, 'columns': columns, 'rows': total_rows, 'files': files}
+
+        if output == 'manifest':
+            export_id = uuid.uuid4().hex
+            export_dir = os.path.join(EXPORT_DIR, export_id)
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            shutil.move(work_dir, export_dir)
+            result_path = os.path.join(export_dir, 'manifest.json')
+            with open(result_path, 'w') as f:
+                json.dump({'export_id': export_id, **manifest}, f)
+        elif output == 'shards':
+            fd, result_path = tempfile.mkstemp(suffix='.zip')
+            os.close(fd)
+            with zipfile.ZipFile(result_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for entry in files:
+                    archive.write(os.path.join(work_dir, entry['name']), entry['name'])
+                if split_files:
+                    archive.writestr('manifest.json', json.dumps(manifest))
+        else:
+            fd, result_path = tempfile.mkstemp(suffix='.csv')
+            with os.fdopen(fd, 'w', newline='') as out:
+                csv.writer(out).writerow(columns)
+                for entry in files:
+                    with open(os.path.join(work_dir, entry['name']), 'r', newline='') as shard:
+                        shutil.copyfileobj(shard, out, COPY_BUFFER_SIZE)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return result_path, total_rows, len(files)
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import pandas as pd
+
+import arrow_plane
+from csv_chunks import CsvChunk, read_chunk
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "1"))
+# Arrow tables parsed by workers are handed back as files in shared memory
+PARSE_SHM_DIR = os.getenv("PARSE_SHM_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def parse_chunk(chunk: CsvChunk, delimiter: str = ',', dtype: Optional[Dict[str, Any]] = None,
+                arrow_types: Optional[Dict[str, Any]] = None):
+    """Arrow table when arrow_types are given and every value parses, DataFrame otherwise"""
+    if arrow_types:
+        table = arrow_plane.read_csv_chunk(chunk, delimiter, arrow_types)
+        if table is not None:
+            return table
+    return read_chunk(chunk, delimiter, dtype)
+
+
+def _parse_in_worker(chunk: CsvChunk, delimiter: str, dtype, arrow_types):
+    parsed = parse_chunk(chunk, delimiter, dtype, arrow_types)
+    if isinstance(parsed, pd.DataFrame):
+        return parsed
+    # Write the table's buffers once; the parent maps them instead of unpickling a copy
+    import pyarrow as pa
+    path = os.path.join(PARSE_SHM_DIR, f"chunk-{uuid.uuid4().hex}.arrow")
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_stream(sink, parsed.schema) as writer:
+        writer.write_table(parsed)
+    return path
+
+
+def _collect(future):
+    parsed = future.result()
+    if not isinstance(parsed, str):
+        return parsed
+    import pyarrow as pa
+    try:
+        return pa.ipc.open_stream(pa.memory_map(parsed)).read_all()
+    finally:
+        # The mapping stays valid until the table is freed
+        os.unlink(parsed)
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """The one pool of PARSE_WORKERS parse processes; spawned, since the server process runs threads"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def close_parse_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def iter_parsed(
+    chunks: Iterable[CsvChunk],
+    delimiter: str = ',',
+    dtype: Optional[Dict[str, Any]] = None,
+    arrow_types: Optional[Dict[str, Any]] = None,
+    workers: int = 1
+) -> Iterator[Tuple[CsvChunk, Any]]:
+    """Parse chunks on the shared pool, yielding them in file order.
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    however large the file is; callers keep workers within PARSE_WORKERS.
+    With one worker, chunks are parsed inline.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield chunk, parse_chunk(chunk, delimiter, dtype, arrow_types)
+        return
+    pool = get_parse_pool()
+    pending: deque = deque()
+    try:
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(_parse_in_worker, chunk, delimiter, dtype, arrow_types)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, _collect(future)
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, _collect(future)
+    finally:
+        # Drop what is still in flight, e.g. when the consumer failed
+        for _, future in pending:
+            if not future.cancel() and future.exception() is None and isinstance(future.result(), str):
+                os.unlink(future.result())
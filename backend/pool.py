@@ -0,0 +1,132 @@
+import itertools
+import os
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Optional
+
+from clickhouse_driver import Client
+
+from metrics import register_collector
+
+# Pools kept for distinct servers and credentials; the least recently used is closed beyond this
+POOL_MAX_COUNT = int(os.getenv("POOL_MAX_COUNT", "32"))
+
+
+class ClickHousePool:
+    """Fixed-size pool of ClickHouse connections shared between worker threads"""
+
+    def __init__(self, factory: Callable[[], Client], size: int = 4, label: str = ''):
+        self.factory = factory
+        self.size = size
+        # Shown in metrics; must not carry credentials
+        self.label = label
+        self._idle: "queue.Queue[Client]" = queue.Queue()
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, timeout: float = 60):
+        """Borrow a connection, creating one lazily until the pool is full"""
+        client = self._acquire(timeout)
+        try:
+            yield client
+        except Exception:
+            # The connection may be left mid-query; drop it instead of reusing it
+            self._discard(client)
+            raise
+        else:
+            if self._closed:
+                # Returned after the pool was evicted
+                self._discard(client)
+            else:
+                self._idle.put(client)
+
+    def _acquire(self, timeout: float) -> Client:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    def _discard(self, client: Client):
+        try:
+            client.disconnect()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "open": self._created, "idle": self._idle.qsize()}
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(client)
+
+
+_pools: "OrderedDict[Hashable, ClickHousePool]" = OrderedDict()
+_pools_lock = threading.Lock()
+_pool_ids = itertools.count(1)
+
+
+def get_pool(key: Hashable, factory: Callable[[], Client], size: int = 4,
+             label: Optional[str] = None) -> ClickHousePool:
+    """Return the pool registered under key, creating it on first use.
+
+    label (plus a counter) names the pool in metrics instead of the key. Beyond POOL_MAX_COUNT
+    pools, the least recently used one is closed.
+    """
+    evicted = []
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            # The counter keeps pools of one server with different credentials apart
+            pool = ClickHousePool(factory, size, f"{label or 'pool'}#{next(_pool_ids)}")
+            _pools[key] = pool
+            while len(_pools) > POOL_MAX_COUNT:
+                evicted.append(_pools.popitem(last=False)[1])
+        elif pool.size < size:
+            # Connections are created lazily, so growing is just raising the cap
+            pool.size = size
+        _pools.move_to_end(key)
+    for old in evicted:
+        old.close()
+    return pool
+
+
+def _pool_metrics():
+    with _pools_lock:
+        pools = list(_pools.items())
+    samples = {'size': [], 'open': [], 'idle': []}
+    for _, pool in pools:
+        label = {'pool': pool.label}
+        for stat, value in pool.stats().items():
+            samples[stat].append((label, value))
+    return [
+        ('clickhouse_pool_size', 'Maximum connections per pool', samples['size']),
+        ('clickhouse_pool_open_connections', 'Connections currently open per pool', samples['open']),
+        ('clickhouse_pool_idle_connections', 'Open connections waiting to be borrowed', samples['idle'])
+    ]
+
+
+register_collector(_pool_metrics)
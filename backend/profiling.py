@@ -0,0 +1,245 @@
+import asyncio
+import collections
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from metrics import STAGE_SECONDS
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "clickhouse_profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_KEEP = int(os.getenv("PROFILE_MAX_KEEP", "50"))
+
+# cprofile: deterministic call profile saved as pstats
+# sample: wall-clock stack samples saved as collapsed stacks for flamegraph.pl / speedscope
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_FILES = {'cprofile': 'pstats', 'sample': 'collapsed'}
+
+# Objects with an add_span() method that stage() reports to, e.g. the
+# active request profile or transfer report
+_span_sinks: contextvars.ContextVar[Tuple[Any, ...]] = contextvars.ContextVar('span_sinks', default=())
+
+# The profile of the request being handled, followed into its worker threads by run_in_thread()
+_active_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar(
+    'active_session', default=None
+)
+
+
+class StackSampler(threading.Thread):
+    """Samples the Python stacks of a changing set of threads at a fixed interval"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_ids: Set[int] = set()
+        self.interval = interval
+        self.counts: collections.Counter = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ProfileSession:
+    """Profiler state and stage spans for one profiled request.
+
+    Only the worker threads a request's work runs in are profiled, not the
+    event loop, which interleaves the coroutines of concurrent requests.
+    """
+
+    def __init__(self, mode: str, label: str):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.label = label
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.spans: List[Dict[str, Any]] = []
+        self._started = 0.0
+        self._profilers: List[cProfile.Profile] = []
+        self._sampler: Optional[StackSampler] = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == 'sample':
+            self._sampler = StackSampler()
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.duration = time.perf_counter() - self._started
+
+    @contextmanager
+    def profile_thread(self):
+        """Profile the calling thread for the duration of the block"""
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            self._profilers.append(profiler)
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        else:
+            thread_id = threading.get_ident()
+            self._sampler.thread_ids.add(thread_id)
+            try:
+                yield
+            finally:
+                self._sampler.thread_ids.discard(thread_id)
+
+    def add_span(self, route: str, stage_name: str, started: float, elapsed: float):
+        self.spans.append({
+            'route': route,
+            'stage': stage_name,
+            'start': round(started - self._started, 6),
+            'seconds': round(elapsed, 6)
+        })
+
+    def summary(self) -> Dict[str, Any]:
+        totals: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span['stage'], {'count': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] = round(total['seconds'] + span['seconds'], 6)
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'label': self.label,
+            'started_at': self.started_at,
+            'seconds': round(self.duration, 6),
+            'stages': totals,
+            'spans': self.spans
+        }
+
+    def save(self, directory: Optional[str] = None):
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        output = os.path.join(directory, f"{self.id}.{PROFILE_FILES[self.mode]}")
+        if self.mode == 'cprofile':
+            if self._profilers:
+                # One profiler per worker thread call, merged into a single dump
+                pstats.Stats(*self._profilers).dump_stats(output)
+            else:
+                cProfile.Profile().dump_stats(output)
+        elif self._sampler is not None:
+            with open(output, 'w') as f:
+                for stack, count in self._sampler.counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, f"{self.id}.json"), 'w') as f:
+            json.dump(self.summary(), f)
+        _prune(directory)
+
+
+def _prune(directory: str):
+    summaries = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in summaries[:-PROFILE_MAX_KEEP]:
+        profile_id = entry.name[:-len('.json')]
+        for suffix in ('json',) + tuple(PROFILE_FILES.values()):
+            try:
+                os.remove(os.path.join(directory, f"{profile_id}.{suffix}"))
+            except FileNotFoundError:
+                pass
+
+
+@contextmanager
+def collect_spans(sink: Any) -> Iterator[Any]:
+    """Send the spans of stages run in this context to sink as well"""
+    token = _span_sinks.set(_span_sinks.get() + (sink,))
+    try:
+        yield sink
+    finally:
+        _span_sinks.reset(token)
+
+
+@contextmanager
+def stage(route: str, stage_name: str):
+    """Time a pipeline stage into the stage histogram and any active span sinks"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, route=route, stage=stage_name)
+        for sink in _span_sinks.get():
+            sink.add_span(route, stage_name, started, elapsed)
+
+
+@contextmanager
+def profile_request(mode: str, label: str):
+    """Profile the work the enclosed block hands to run_in_thread() and persist the result under PROFILE_DIR"""
+    session = ProfileSession(mode, label)
+    token = _active_session.set(session)
+    with collect_spans(session):
+        session.start()
+        try:
+            yield session
+        finally:
+            session.stop()
+            _active_session.reset(token)
+            session.save()
+
+
+def _call_profiled(func: Callable, *args, **kwargs):
+    session = _active_session.get()
+    if session is None:
+        return func(*args, **kwargs)
+    with session.profile_thread():
+        return func(*args, **kwargs)
+
+
+async def run_in_thread(func: Callable, *args, **kwargs):
+    """asyncio.to_thread(), profiling func in the worker thread when the request is profiled"""
+    return await asyncio.to_thread(_call_profiled, func, *args, **kwargs)
+
+
+def list_profiles(directory: Optional[str] = None) -> List[Dict[str, Any]]:
+    directory = directory or PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            with open(entry.path) as f:
+                summary = json.load(f)
+            profiles.append({key: summary[key] for key in ('id', 'mode', 'label', 'started_at', 'seconds')})
+    return sorted(profiles, key=lambda profile: profile['started_at'], reverse=True)
+
+
+def load_profile(profile_id: str, directory: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    directory = directory or PROFILE_DIR
+    path = os.path.join(directory, f"{os.path.basename(profile_id)}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def profile_output_path(profile: Dict[str, Any], directory: Optional[str] = None) -> str:
+    directory = directory or PROFILE_DIR
+    return os.path.join(directory, f"{profile['id']}.{PROFILE_FILES[profile['mode']]}")
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from uuid import UUID
+
+from clickhouse_driver import Client
+
+JOIN_TYPES = ('INNER', 'LEFT', 'RIGHT', 'FULL', 'LEFT OUTER', 'RIGHT OUTER', 'FULL OUTER')
+PLAIN_IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w*')
+DRIVER_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+# (left table, left key, right table, right key) of each JOIN, in order
+Join = Tuple[str, str, str, str]
+
+
+@dataclass
+class Query:
+    """SQL with {name:Type} placeholders and the values the server binds to them"""
+    sql: str
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        """Stable cache key: equal for the same query shape with the same values"""
+        return hashlib.sha256(json.dumps([self.sql, self.params], sort_keys=True, default=str).encode()).hexdigest()
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        """Driver settings sending params to the server instead of rendering them into the SQL"""
+        return {'server_side_params': True} if self.params else {}
+
+    def http_settings(self) -> Dict[str, str]:
+        """The params as param_<name> arguments of the HTTP interface"""
+        return {f"param_{name}": _http_value(value) for name, value in self.params.items()}
+
+    def execute(self, client: Client, settings: Optional[Dict[str, Any]] = None, **kwargs):
+        return client.execute(self.sql, self.params or None, settings={**self.settings, **(settings or {})}, **kwargs)
+
+    def execute_iter(self, client: Client, settings: Optional[Dict[str, Any]] = None, **kwargs):
+        return client.execute_iter(self.sql, self.params or None,
+                                   settings={**self.settings, **(settings or {})}, **kwargs)
+
+
+def _http_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return str(value)
+
+
+def param_type(value: Any) -> str:
+    """ClickHouse type a Python value is bound as"""
+    if value is None:
+        return 'Nullable(String)'
+    if isinstance(value, bool):
+        return 'Bool'
+    if isinstance(value, int):
+        return 'UInt64' if value >= 2 ** 63 else 'Int64'
+    if isinstance(value, float):
+        return 'Float64'
+    if isinstance(value, Decimal):
+        return f"Decimal(38, {max(0, -value.as_tuple().exponent)})"
+    if isinstance(value, datetime):
+        return 'DateTime64(6)'
+    if isinstance(value, date):
+        return 'Date32'
+    if isinstance(value, UUID):
+        return 'UUID'
+    if isinstance(value, str):
+        return 'String'
+    if isinstance(value, (list, tuple)):
+        return f"Array({param_type(value[0]) if value else 'String'})"
+    raise ValueError(f"Cannot bind a {type(value).__name__} as a query parameter")
+
+
+def quote_identifier(name: str) -> str:
+    """Backquote one name part, escaping backslashes and backquotes"""
+    return '`' + name.replace('\\', '\\\\').replace('`', '\\`') + '`'
+
+
+def identifier(name: str) -> str:
+    """A table or column name, optionally qualified, safe to place in SQL.
+
+    Plain names are kept as they are; anything else is backquoted.
+    """
+    parts = name.split('.') if isinstance(name, str) else ['']
+    if not all(parts):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return '.'.join(part if PLAIN_IDENTIFIER_RE.fullmatch(part) else quote_identifier(part) for part in parts)
+
+
+def bind(params: Dict[str, Any], name: str, value: Any) -> str:
+    """Add value to params and return its placeholder"""
+    params[name] = value
+    return f"{{{name}:{param_type(value)}}}"
+
+
+def server_predicate(predicate: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Turn a predicate with %(name)s driver placeholders into one bound on the server"""
+    bound: Dict[str, Any] = {}
+    return DRIVER_PARAM_RE.sub(lambda match: bind(bound, match.group(1), params[match.group(1)]), predicate), bound
+
+
+def select(table: str, columns: Sequence[str], where: Optional[Tuple[str, Dict[str, Any]]] = None,
+           limit: Optional[int] = None) -> Query:
+    """SELECT columns FROM table; where is a predicate with %(name)s placeholders and their values"""
+    query = Query(f"SELECT {', '.join(identifier(column) for column in columns)} FROM {identifier(table)}")
+    if where is not None:
+        predicate, query.params = server_predicate(*where)
+        query.sql += f" WHERE {predicate}"
+    if limit is not None:
+        # A validated literal: older servers do not take parameters in LIMIT
+        query.sql += f" LIMIT {check_limit(limit)}"
+    return query
+
+
+def check_limit(limit: int) -> int:
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        raise ValueError("limit must be a non-negative integer")
+    return limit
+
+
+def join_select(columns: Sequence[str], table: str, joins: Sequence[Join], join_type: str = 'INNER',
+                source: Callable[[str], str] = identifier) -> Query:
+    """SELECT columns from table joined with each right table of joins.
+
+    source maps a table name to what is read, e.g. a remote() call aliased to it.
+    """
+    join_type = join_type.upper()
+    if join_type not in JOIN_TYPES:
+        raise ValueError(f"join type must be one of {', '.join(JOIN_TYPES)}")
+    sql = f"SELECT {', '.join(identifier(column) for column in columns)} FROM {source(table)}"
+    for left_table, left_key, right_table, right_key in joins:
+        sql += (f" {join_type} JOIN {source(right_table)} ON "
+                f"{identifier(left_table)}.{identifier(left_key)} = {identifier(right_table)}.{identifier(right_key)}")
+    return Query(sql)
+
+
+def describe(table: str) -> Query:
+    return Query(f"DESCRIBE TABLE {identifier(table)}")
+
+
+def count(table: str) -> Query:
+    return Query(f"SELECT count() FROM {identifier(table)}")
+
+
+def table_columns(database: str, table: str) -> Query:
+    """Name and type of every column of database.table from system.columns"""
+    params: Dict[str, Any] = {}
+    return Query(
+        "SELECT name, type FROM system.columns "
+        f"WHERE database = {bind(params, 'database', database)} AND table = {bind(params, 'table', table)}",
+        params
+    )
+
+
+def insert(table: str, columns: Sequence[str]) -> str:
+    """INSERT ... VALUES statement the driver sends rows with"""
+    return f"INSERT INTO {identifier(table)} ({', '.join(identifier(column) for column in columns)}) VALUES"
@@ -0,0 +1,255 @@
+import contextvars
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from clickhouse_driver import Client
+
+from profiling import collect_spans
+from state import sqlite_connection
+
+REPORT_DB = os.getenv(
+    "REPORT_DB", os.path.join(tempfile.gettempdir(), "clickhouse_transfer_reports.db")
+)
+REPORT_MAX_KEEP = int(os.getenv("REPORT_MAX_KEEP", "1000"))
+
+# Stages spent waiting on a query, as opposed to Python work on its rows
+QUERY_STAGES = ('fetch', 'insert', 'query')
+
+QUERY_LOG_COLUMNS = (
+    'query_id', 'query_duration_ms', 'read_rows', 'read_bytes', 'written_rows',
+    'written_bytes', 'result_rows', 'result_bytes', 'memory_usage'
+)
+
+_current_report: contextvars.ContextVar[Optional["TransferReport"]] = contextvars.ContextVar(
+    'transfer_report', default=None
+)
+
+
+class TransferReport:
+    """Stage timings and ClickHouse statistics for the queries of one transfer"""
+
+    def __init__(self, route: str, table: str, transfer_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.route = route
+        self.table = table
+        self.transfer_id = transfer_id
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status = 'running'
+        self.rows = 0
+        self.bytes = 0
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self.server: Optional[Dict[str, Any]] = None
+        self._started = time.perf_counter()
+        self._sequence = itertools.count(1)
+        # Parallel exports report from several worker threads
+        self._lock = threading.Lock()
+
+    def add_span(self, route: str, stage_name: str, started: float, elapsed: float):
+        with self._lock:
+            total = self.stages.setdefault(stage_name, {'count': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] += elapsed
+
+    def new_query_id(self) -> str:
+        with self._lock:
+            return f"{self.id}-{next(self._sequence)}"
+
+    def record_query(self, query_id: str, client: Client):
+        """Keep the profile and progress packets the driver saw for query_id"""
+        info = getattr(client, 'last_query', None)
+        stats: Dict[str, Any] = {}
+        if info is not None:
+            profile, progress = info.profile_info, info.progress
+            stats = {
+                'elapsed': round(info.elapsed, 6),
+                'profile': {'rows': profile.rows, 'blocks': profile.blocks, 'bytes': profile.bytes},
+                'progress': {
+                    'read_rows': progress.rows,
+                    'read_bytes': progress.bytes,
+                    'total_rows': progress.total_rows,
+                    'written_rows': progress.written_rows,
+                    'written_bytes': progress.written_bytes,
+                    'elapsed_ns': getattr(progress, 'elapsed_ns', 0)
+                }
+            }
+        with self._lock:
+            self.queries[query_id] = stats
+
+    def finish(self, rows: int, nbytes: int = 0, status: str = 'completed'):
+        self.rows = rows
+        self.bytes = nbytes
+        self.status = status
+        self.duration = time.perf_counter() - self._started
+
+    def collect_server_stats(self, client: Client, flush: bool = False):
+        if not self.queries:
+            return
+        try:
+            self.server = server_stats(client, list(self.queries), self.started_at, flush)
+        except Exception as e:
+            # Missing query_log access should not fail a finished transfer
+            self.server = {'error': str(e)}
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: {'count': total['count'], 'seconds': round(total['seconds'], 6)}
+                      for name, total in self.stages.items()}
+            queries = dict(self.queries)
+        return {
+            'id': self.id,
+            'route': self.route,
+            'table': self.table,
+            'transfer_id': self.transfer_id,
+            'status': self.status,
+            'started_at': self.started_at,
+            'seconds': round(self.duration, 6),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_second': round(self.rows / self.duration, 1) if self.duration else 0.0,
+            'stages': stages,
+            'queries': queries,
+            'server': self.server,
+            **time_breakdown(stages, queries, self.server)
+        }
+
+
+def server_stats(client: Client, query_ids: List[str], started_at: float, flush: bool = False) -> Dict[str, Any]:
+    """Sum the system.query_log entries of query_ids.
+
+    The log is written asynchronously; flush forces it out first, which
+    needs the SYSTEM FLUSH LOGS privilege.
+    """
+    if flush:
+        client.execute('SYSTEM FLUSH LOGS')
+    rows = client.execute(
+        f"SELECT {', '.join(QUERY_LOG_COLUMNS)} FROM system.query_log "
+        "WHERE type = 'QueryFinish' AND event_date >= toDate(%(started)s) "
+        "AND query_id IN %(query_ids)s",
+        {'started': int(started_at), 'query_ids': query_ids}
+    )
+    queries = [dict(zip(QUERY_LOG_COLUMNS, row)) for row in rows]
+    return {
+        'queries': queries,
+        'seconds': sum(query['query_duration_ms'] for query in queries) / 1000,
+        'read_rows': sum(query['read_rows'] for query in queries),
+        'read_bytes': sum(query['read_bytes'] for query in queries),
+        'written_rows': sum(query['written_rows'] for query in queries),
+        'written_bytes': sum(query['written_bytes'] for query in queries),
+        'peak_memory_usage': max((query['memory_usage'] for query in queries), default=0)
+    }
+
+
+def time_breakdown(stages: Dict[str, Dict[str, float]], queries: Dict[str, Dict[str, Any]],
+                   server: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Split stage time into server, network and Python shares and name the largest"""
+    waiting = sum(total['seconds'] for name, total in stages.items() if name in QUERY_STAGES)
+    python = sum(total['seconds'] for name, total in stages.items() if name not in QUERY_STAGES)
+    if server and 'error' not in server:
+        server_seconds = server['seconds']
+    else:
+        # Without the query log, fall back to the server-side elapsed time
+        # carried by progress packets (newer servers only)
+        server_seconds = sum(query.get('progress', {}).get('elapsed_ns', 0) for query in queries.values()) / 1e9
+    # Whatever part of the wait the server does not account for went to the
+    # network and the driver's decoding
+    server_seconds = min(server_seconds, waiting)
+    shares = {'server': server_seconds, 'network': waiting - server_seconds, 'python': python}
+    return {
+        **{f"{name}_seconds": round(seconds, 6) for name, seconds in shares.items()},
+        'bound': max(shares, key=shares.get) if any(shares.values()) else None
+    }
+
+
+@contextmanager
+def transfer_report(route: str, table: str, transfer_id: Optional[str] = None) -> Iterator[TransferReport]:
+    """Collect stage spans and query statistics of the enclosed transfer"""
+    report = TransferReport(route, table, transfer_id)
+    token = _current_report.set(report)
+    try:
+        with collect_spans(report):
+            yield report
+    finally:
+        _current_report.reset(token)
+
+
+def query_id() -> Optional[str]:
+    """A fresh query_id tied to the active report, or None when there is none"""
+    report = _current_report.get()
+    return report.new_query_id() if report is not None else None
+
+
+def record_query(client: Client, query_id: Optional[str]):
+    report = _current_report.get()
+    if report is not None and query_id:
+        report.record_query(query_id, client)
+
+
+class ReportStore:
+    """SQLite-backed store of finished transfer reports"""
+
+    def __init__(self, path: str = REPORT_DB, max_keep: int = REPORT_MAX_KEEP):
+        self.path = path
+        self.max_keep = max_keep
+        self._lock = threading.Lock()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                report_id TEXT PRIMARY KEY,
+                route TEXT NOT NULL,
+                target_table TEXT NOT NULL,
+                transfer_id TEXT,
+                started_at REAL NOT NULL,
+                report TEXT NOT NULL
+            )
+            """)
+
+    def save(self, report: TransferReport) -> Dict[str, Any]:
+        summary = report.to_dict()
+        with self._lock, sqlite_connection(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (report_id, route, target_table, transfer_id, started_at, report) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (report.id, report.route, report.table, report.transfer_id, report.started_at, json.dumps(summary))
+            )
+            conn.execute(
+                "DELETE FROM reports WHERE report_id NOT IN "
+                "(SELECT report_id FROM reports ORDER BY started_at DESC LIMIT ?)",
+                (self.max_keep,)
+            )
+        return summary
+
+    def get(self, report_id: str) -> Optional[Dict[str, Any]]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute("SELECT report FROM reports WHERE report_id = ?", (report_id,)).fetchone()
+        return json.loads(row['report']) if row else None
+
+    def attach_server_stats(self, report_id: str, server: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Store query log statistics looked up after the transfer and redo the breakdown"""
+        with self._lock, sqlite_connection(self.path) as conn:
+            row = conn.execute("SELECT report FROM reports WHERE report_id = ?", (report_id,)).fetchone()
+            if row is None:
+                return None
+            summary = json.loads(row['report'])
+            summary['server'] = server
+            summary.update(time_breakdown(summary['stages'], summary['queries'], server))
+            conn.execute("UPDATE reports SET report = ? WHERE report_id = ?", (json.dumps(summary), report_id))
+        return summary
+
+    def list(self, limit: int = 50, transfer_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT report_id, route, target_table, transfer_id, started_at FROM reports"
+        params: tuple = ()
+        if transfer_id:
+            query += " WHERE transfer_id = ?"
+            params = (transfer_id,)
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(query + " ORDER BY started_at DESC LIMIT ?", params + (limit,)).fetchall()
+        return [dict(row) for row in rows]
@@ -1,207 +1,337 @@
 from clickhouse_driver import Client
+import argparse
 import os
 import requests
 import gzip
-import shutil
-
-def download_and_extract(url, filename):
-    print(f"Downloading {filename}...")
-    response = requests.get(url, stream=True)
-    with open(filename, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    
-    print(f"Extracting {filename}...")
-    with gzip.open(filename, 'rb') as f_in:
-        with open(filename.replace('.gz', ''), 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-    
-    os.remove(filename)
-
-def setup_datasets():
-    # Create ClickHouse client
-    client = Client('localhost')
-    
-    # Create directory for datasets
-    os.makedirs('datasets', exist_ok=True)
-    os.chdir('datasets')
-    
-    # Download and setup UK Price Paid dataset
-    uk_price_paid_url = 'https://clickhouse-public-datasets.s3.amazonaws.com/uk_price_paid/uk_price_paid.csv.gz'
-    download_and_extract(uk_price_paid_url, 'uk_price_paid.csv.gz')
-    
-    # Create table for UK Price Paid
-    client.execute("""
-    CREATE TABLE IF NOT EXISTS uk_price_paid (
-        price UInt32,
-        date Date,
-        postcode1 String,
-        postcode2 String,
-        type Enum8('terraced' = 1, 'semi-detached' = 2, 'detached' = 3, 'flat' = 4, 'other' = 0),
-        is_new UInt8,
-        duration Enum8('freehold' = 1, 'leasehold' = 2, 'unknown' = 0),
-        addr1 String,
-        addr2 String,
-        street String,
-        locality String,
-        town String,
-        district String,
-        county String,
-        category Enum8('A' = 1, 'B' = 2, 'C' = 3, 'D' = 4, 'E' = 5, 'F' = 6, 'G' = 7, 'H' = 8)
-    ) ENGINE = MergeTree()
-    ORDER BY (postcode1, postcode2, addr1, addr2)
-    """)
-    
-    # Import data
-    client.execute("""
-    INSERT INTO uk_price_paid
-    SELECT
-        toUInt32(price_string),
-        parseDateTimeBestEffort(date_string),
-        postcode1,
-        postcode2,
-        type,
-        is_new,
-        duration,
-        addr1,
-        addr2,
-        street,
-        locality,
-        town,
-        district,
-        county,
-        category
-    FROM file('uk_price_paid.csv', CSV, 'price_string String, date_string String, postcode1 String, postcode2 String, type String, is_new String, duration String, addr1 String, addr2 String, street String, locality String, town String, district String, county String, category String')
-    """)
-    
-    # Download and setup OnTime dataset
-    ontime_url = 'https://clickhouse-public-datasets.s3.amazonaws.com/ontime/ontime.csv.gz'
-    download_and_extract(ontime_url, 'ontime.csv.gz')
-    
-    # Create table for OnTime
-    client.execute("""
-    CREATE TABLE IF NOT EXISTS ontime (
-        Year UInt16,
-        Quarter UInt8,
-        Month UInt8,
-        DayofMonth UInt8,
-        DayOfWeek UInt8,
-        FlightDate Date,
-        UniqueCarrier FixedString(7),
-        AirlineID Int32,
-        Carrier FixedString(2),
-        TailNum String,
-        FlightNum String,
-        OriginAirportID Int32,
-        OriginAirportSeqID Int32,
-        OriginCityMarketID Int32,
-        Origin FixedString(5),
-        OriginCityName String,
-        OriginState FixedString(2),
-        OriginStateFips String,
-        OriginStateName String,
-        OriginWac Int32,
-        DestAirportID Int32,
-        DestAirportSeqID Int32,
-        DestCityMarketID Int32,
-        Dest FixedString(5),
-        DestCityName String,
-        DestState FixedString(2),
-        DestStateFips String,
-        DestStateName String,
-        DestWac Int32,
-        CRSDepTime Int32,
-        DepTime Int32,
-        DepDelay Int32,
-        DepDelayMinutes Int32,
-        DepDel15 Int32,
-        DepartureDelayGroups String,
-        DepTimeBlk String,
-        TaxiOut Int32,
-        WheelsOff Int32,
-        WheelsOn Int32,
-        TaxiIn Int32,
-        CRSArrTime Int32,
-        ArrTime Int32,
-        ArrDelay Int32,
-        ArrDelayMinutes Int32,
-        ArrDel15 Int32,
-        ArrivalDelayGroups String,
-        ArrTimeBlk String,
-        Cancelled UInt8,
-        CancellationCode FixedString(1),
-        Diverted UInt8,
-        CRSElapsedTime Int32,
-        ActualElapsedTime Int32,
-        AirTime Int32,
-        Flights Int32,
-        Distance Int32,
-        DistanceGroup UInt8,
-        CarrierDelay Int32,
-        WeatherDelay Int32,
-        NASDelay Int32,
-        SecurityDelay Int32,
-        LateAircraftDelay Int32,
-        FirstDepTime String,
-        TotalAddGTime String,
-        LongestAddGTime String,
-        DivAirportLandings String,
-        DivReachedDest String,
-        DivActualElapsedTime String,
-        DivArrDelay String,
-        DivDistance String,
-        Div1Airport String,
-        Div1AirportID Int32,
-        Div1AirportSeqID Int32,
-        Div1WheelsOn String,
-        Div1TotalGTime String,
-        Div1LongestGTime String,
-        Div1WheelsOff String,
-        Div1TailNum String,
-        Div2Airport String,
-        Div2AirportID Int32,
-        Div2AirportSeqID Int32,
-        Div2WheelsOn String,
-        Div2TotalGTime String,
-        Div2LongestGTime String,
-        Div2WheelsOff String,
-        Div2TailNum String,
-        Div3Airport String,
-        Div3AirportID Int32,
-        Div3AirportSeqID Int32,
-        Div3WheelsOn String,
-        Div3TotalGTime String,
-        Div3LongestGTime String,
-        Div3WheelsOff String,
-        Div3TailNum String,
-        Div4Airport String,
-        Div4AirportID Int32,
-        Div4AirportSeqID Int32,
-        Div4WheelsOn String,
-        Div4TotalGTime String,
-        Div4LongestGTime String,
-        Div4WheelsOff String,
-        Div4TailNum String,
-        Div5Airport String,
-        Div5AirportID Int32,
-        Div5AirportSeqID Int32,
-        Div5WheelsOn String,
-        Div5TotalGTime String,
-        Div5LongestGTime String,
-        Div5WheelsOff String,
-        Div5TailNum String
-    ) ENGINE = MergeTree()
-    ORDER BY (Year, Month, DayofMonth)
-    """)
-    
-    # Import data
-    client.execute("""
-    INSERT INTO ontime
-    SELECT *
-    FROM file('ontime.csv', CSV)
-    """)
-    
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "localhost")
+CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "9000"))
+CLICKHOUSE_HTTP_PORT = int(os.getenv("CLICKHOUSE_HTTP_PORT", "8123"))
+CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
+CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
+
+# Size of download reads and of the decompressed blocks sent to ClickHouse
+BUFFER_SIZE = int(os.getenv("DATASET_BUFFER_SIZE", str(4 * 1024 * 1024)))
+DOWNLOAD_RETRIES = int(os.getenv("DATASET_DOWNLOAD_RETRIES", "5"))
+GZIP_MAGIC = b'\x1f\x8b'
+
+UK_PRICE_PAID_TABLE = """
+CREATE TABLE IF NOT EXISTS uk_price_paid (
+    price UInt32,
+    date Date,
+    postcode1 LowCardinality(String),
+    postcode2 LowCardinality(String),
+    type Enum8('terraced' = 1, 'semi-detached' = 2, 'detached' = 3, 'flat' = 4, 'other' = 0),
+    is_new UInt8,
+    duration Enum8('freehold' = 1, 'leasehold' = 2, 'unknown' = 0),
+    addr1 String,
+    addr2 String,
+    street LowCardinality(String),
+    locality LowCardinality(String),
+    town LowCardinality(String),
+    district LowCardinality(String),
+    county LowCardinality(String),
+    category Enum8('A' = 1, 'B' = 2, 'C' = 3, 'D' = 4, 'E' = 5, 'F' = 6, 'G' = 7, 'H' = 8)
+) ENGINE = MergeTree()
+ORDER BY (postcode1, postcode2, addr1, addr2)
+"""
+
+ONTIME_TABLE = """
+CREATE TABLE IF NOT EXISTS ontime (
+    Year UInt16,
+    Quarter UInt8,
+    Month UInt8,
+    DayofMonth UInt8,
+    DayOfWeek UInt8,
+    FlightDate Date,
+    UniqueCarrier FixedString(7),
+    AirlineID Int32,
+    Carrier FixedString(2),
+    TailNum String,
+    FlightNum String,
+    OriginAirportID Int32,
+    OriginAirportSeqID Int32,
+    OriginCityMarketID Int32,
+    Origin FixedString(5),
+    OriginCityName LowCardinality(String),
+    OriginState FixedString(2),
+    OriginStateFips String,
+    OriginStateName LowCardinality(String),
+    OriginWac Int32,
+    DestAirportID Int32,
+    DestAirportSeqID Int32,
+    DestCityMarketID Int32,
+    Dest FixedString(5),
+    DestCityName LowCardinality(String),
+    DestState FixedString(2),
+    DestStateFips String,
+    DestStateName LowCardinality(String),
+    DestWac Int32,
+    CRSDepTime Int32,
+    DepTime Int32,
+    DepDelay Int32,
+    DepDelayMinutes Int32,
+    DepDel15 Int32,
+    DepartureDelayGroups String,
+    DepTimeBlk LowCardinality(String),
+    TaxiOut Int32,
+    WheelsOff Int32,
+    WheelsOn Int32,
+    TaxiIn Int32,
+    CRSArrTime Int32,
+    ArrTime Int32,
+    ArrDelay Int32,
+    ArrDelayMinutes Int32,
+    ArrDel15 Int32,
+    ArrivalDelayGroups String,
+    ArrTimeBlk LowCardinality(String),
+    Cancelled UInt8,
+    CancellationCode FixedString(1),
+    Diverted UInt8,
+    CRSElapsedTime Int32,
+    ActualElapsedTime Int32,
+    AirTime Int32,
+    Flights Int32,
+    Distance Int32,
+    DistanceGroup UInt8,
+    CarrierDelay Int32,
+    WeatherDelay Int32,
+    NASDelay Int32,
+    SecurityDelay Int32,
+    LateAircraftDelay Int32,
+    FirstDepTime String,
+    TotalAddGTime String,
+    LongestAddGTime String,
+    DivAirportLandings String,
+    DivReachedDest String,
+    DivActualElapsedTime String,
+    DivArrDelay String,
+    DivDistance String,
+    Div1Airport String,
+    Div1AirportID Int32,
+    Div1AirportSeqID Int32,
+    Div1WheelsOn String,
+    Div1TotalGTime String,
+    Div1LongestGTime String,
+    Div1WheelsOff String,
+    Div1TailNum String,
+    Div2Airport String,
+    Div2AirportID Int32,
+    Div2AirportSeqID Int32,
+    Div2WheelsOn String,
+    Div2TotalGTime String,
+    Div2LongestGTime String,
+    Div2WheelsOff String,
+    Div2TailNum String,
+    Div3Airport String,
+    Div3AirportID Int32,
+    Div3AirportSeqID Int32,
+    Div3WheelsOn String,
+    Div3TotalGTime String,
+    Div3LongestGTime String,
+    Div3WheelsOff String,
+    Div3TailNum String,
+    Div4Airport String,
+    Div4AirportID Int32,
+    Div4AirportSeqID Int32,
+    Div4WheelsOn String,
+    Div4TotalGTime String,
+    Div4LongestGTime String,
+    Div4WheelsOff String,
+    Div4TailNum String,
+    Div5Airport String,
+    Div5AirportID Int32,
+    Div5AirportSeqID Int32,
+    Div5WheelsOn String,
+    Div5TotalGTime String,
+    Div5LongestGTime String,
+    Div5WheelsOff String,
+    Div5TailNum String
+) ENGINE = MergeTree()
+ORDER BY (Year, Month, DayofMonth)
+"""
+
+
+@dataclass
+class Dataset:
+    name: str
+    url: str
+    create: str
+    insert: str
+    # Rows of a complete load; when unset, the count recorded by the last load is used
+    expected_rows: Optional[int] = None
+
+
+DATASETS = [
+    Dataset(
+        'uk_price_paid',
+        'https://clickhouse-public-datasets.s3.amazonaws.com/uk_price_paid/uk_price_paid.csv.gz',
+        UK_PRICE_PAID_TABLE,
+        """
+        INSERT INTO uk_price_paid
+        SELECT
+            toUInt32(price_string),
+            parseDateTimeBestEffort(date_string),
+            postcode1,
+            postcode2,
+            type,
+            is_new,
+            duration,
+            addr1,
+            addr2,
+            street,
+            locality,
+            town,
+            district,
+            county,
+            category
+        FROM input('price_string String, date_string String, postcode1 String, postcode2 String, type String, is_new String, duration String, addr1 String, addr2 String, street String, locality String, town String, district String, county String, category String')
+        FORMAT CSV
+        """
+    ),
+    Dataset(
+        'ontime',
+        'https://clickhouse-public-datasets.s3.amazonaws.com/ontime/ontime.csv.gz',
+        ONTIME_TABLE,
+        "INSERT INTO ontime FORMAT CSV"
+    )
+]
+
+
+def usable(path: str) -> bool:
+    """Whether path holds data rather than being empty or, for .gz, e.g. a saved error page"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    if path.endswith('.gz'):
+        with open(path, 'rb') as f:
+            return f.read(2) == GZIP_MAGIC
+    return True
+
+
+def download(url: str, path: str) -> str:
+    """Fetch url to path, continuing the partial download an earlier run left behind"""
+    if usable(path):
+        return path
+    part = path + '.part'
+    for attempt in range(DOWNLOAD_RETRIES):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code == 416:
+                    # Nothing past offset: the partial file is already complete
+                    break
+                response.raise_for_status()
+                # Servers without range support send the whole file again
+                with open(part, 'ab' if response.status_code == 206 else 'wb') as f:
+                    for block in response.iter_content(chunk_size=BUFFER_SIZE):
+                        f.write(block)
+            break
+        except requests.RequestException as e:
+            print(f"Download of {os.path.basename(path)} interrupted ({e}), retrying...")
+            time.sleep(min(2 ** attempt, 30))
+    else:
+        raise RuntimeError(f"Could not download {url} after {DOWNLOAD_RETRIES} attempts")
+    os.replace(part, path)
+    if not usable(path):
+        os.remove(path)
+        raise RuntimeError(f"{url} did not return a gzip file")
+    return path
+
+
+def find_source(dataset: Dataset, data_dir: str, mirror: Optional[str]) -> str:
+    """Path of the dataset's CSV, downloading it unless a local copy exists"""
+    for directory in filter(None, [mirror, data_dir]):
+        for filename in (f"{dataset.name}.csv.gz", f"{dataset.name}.csv"):
+            path = os.path.join(directory, filename)
+            if usable(path):
+                return path
+    if mirror:
+        raise FileNotFoundError(f"{dataset.name}.csv.gz not found in mirror {mirror}")
+    print(f"Downloading {dataset.name}...")
+    return download(dataset.url, os.path.join(data_dir, f"{dataset.name}.csv.gz"))
+
+
+def read_blocks(path: str) -> Iterator[bytes]:
+    """Decompressed contents of a CSV or .csv.gz file in BUFFER_SIZE blocks"""
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+        while True:
+            block = f.read(BUFFER_SIZE)
+            if not block:
+                return
+            yield block
+
+
+def insert_csv(query: str, blocks: Iterator[bytes]):
+    """Stream CSV blocks as the body of an INSERT over the HTTP interface"""
+    response = requests.post(
+        f"http://{CLICKHOUSE_HOST}:{CLICKHOUSE_HTTP_PORT}/",
+        params={'query': query},
+        data=blocks,
+        headers={'X-ClickHouse-User': CLICKHOUSE_USER, 'X-ClickHouse-Key': CLICKHOUSE_PASSWORD}
+    )
+    if response.status_code != 200:
+        raise RuntimeError(response.text.strip())
+
+
+def expected_rows(dataset: Dataset, data_dir: str) -> Optional[int]:
+    if dataset.expected_rows is not None:
+        return dataset.expected_rows
+    marker = os.path.join(data_dir, f"{dataset.name}.rows")
+    if os.path.exists(marker):
+        with open(marker) as f:
+            return int(f.read())
+    return None
+
+
+def setup_dataset(dataset: Dataset, data_dir: str, mirror: Optional[str] = None):
+    # clickhouse_driver clients are not thread-safe, so each dataset gets its own
+    client = Client(CLICKHOUSE_HOST, port=CLICKHOUSE_PORT, user=CLICKHOUSE_USER, password=CLICKHOUSE_PASSWORD)
+    client.execute(dataset.create)
+    rows = client.execute(f"SELECT count() FROM {dataset.name}")[0][0]
+    expected = expected_rows(dataset, data_dir)
+    if rows and rows == expected:
+        print(f"{dataset.name} already holds {rows} rows, skipping")
+        return
+    if rows and expected is None:
+        # Without a record of a complete load the table may be someone's data; leave it alone
+        print(f"{dataset.name} already holds {rows} rows and {data_dir} has no record of loading it, skipping; "
+              f"truncate the table to reload it")
+        return
+    source = find_source(dataset, data_dir, mirror)
+    if rows:
+        # A load interrupted half way; start the table over
+        print(f"{dataset.name} holds {rows} rows instead of the expected count, reloading")
+        client.execute(f"TRUNCATE TABLE {dataset.name}")
+
+    print(f"Loading {dataset.name}...")
+    insert_csv(dataset.insert, read_blocks(source))
+    rows = client.execute(f"SELECT count() FROM {dataset.name}")[0][0]
+    with open(os.path.join(data_dir, f"{dataset.name}.rows"), 'w') as f:
+        f.write(str(rows))
+    print(f"{dataset.name} loaded: {rows} rows")
+
+
+def setup_datasets(data_dir: str = 'datasets', mirror: Optional[str] = None, names: Optional[List[str]] = None):
+    os.makedirs(data_dir, exist_ok=True)
+    datasets = [dataset for dataset in DATASETS if not names or dataset.name in names]
+    # Datasets are fetched and loaded concurrently
+    with ThreadPoolExecutor(max_workers=len(datasets) or 1) as executor:
+        futures = [executor.submit(setup_dataset, dataset, data_dir, mirror) for dataset in datasets]
+        for future in futures:
+            future.result()
+
     print("Datasets setup completed successfully!")
 
 if __name__ == "__main__":
-    setup_datasets() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download and load the example datasets")
+    parser.add_argument('--data-dir', default='datasets', help="where downloads are kept")
+    parser.add_argument('--mirror', default=os.getenv("DATASET_MIRROR"),
+                        help="directory holding <name>.csv.gz or <name>.csv, used instead of downloading")
+    parser.add_argument('--dataset', action='append', dest='names', choices=[d.name for d in DATASETS])
+    args = parser.parse_args()
+    setup_datasets(args.data_dir, args.mirror, args.names)
@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# memory:// keeps state in the process; sqlite:///<path> shares it between the
+# worker processes of one host; redis://host:port/db shares it between hosts
+STATE_BACKEND = os.getenv(
+    "STATE_BACKEND", "sqlite:///" + os.path.join(tempfile.gettempdir(), "clickhouse_transfer_state.db")
+)
+
+# How often expired SQLite entries are swept, in seconds
+STATE_SWEEP_INTERVAL = 60.0
+
+
+@contextmanager
+def sqlite_connection(path: str) -> Iterator[sqlite3.Connection]:
+    """A connection to the SQLite file at path, committed on success and always closed"""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class StateBackend(ABC):
+    """Key-value store for job, progress and cache state.
+
+    Values must be JSON-serialisable. The methods mirror the Redis commands of
+    the same name so other stores can be adapted with little code.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ex: Optional[float] = None):
+        """Store value under key, expiring after ex seconds when given"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def keys(self, prefix: str = '') -> List[str]:
+        pass
+
+
+class MemoryState(StateBackend):
+    """Process-local state; only correct with a single worker"""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.time() >= expires_at:
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key: str, value: Any, ex: Optional[float] = None):
+        # Round-trip through JSON so values behave as they would in a shared store
+        value = json.loads(json.dumps(value))
+        with self._lock:
+            self._values[key] = (value, time.time() + ex if ex else None)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def keys(self, prefix: str = '') -> List[str]:
+        now = time.time()
+        with self._lock:
+            return [key for key, (_, expires_at) in self._values.items()
+                    if key.startswith(prefix) and (expires_at is None or expires_at > now)]
+
+
+class SQLiteState(StateBackend):
+    """State in a SQLite file shared by every worker process on the host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._last_sweep = 0.0
+        with sqlite_connection(self.path) as conn:
+            # WAL lets readers (progress polls) proceed while a worker writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+            """)
+
+    def get(self, key: str) -> Optional[Any]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ex: Optional[float] = None):
+        now = time.time()
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ex if ex else None)
+            )
+            if now - self._last_sweep > STATE_SWEEP_INTERVAL:
+                self._last_sweep = now
+                conn.execute("DELETE FROM state WHERE expires_at <= ?", (now,))
+
+    def delete(self, key: str):
+        with sqlite_connection(self.path) as conn:
+            conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def keys(self, prefix: str = '') -> List[str]:
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                "SELECT key FROM state WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (len(prefix), prefix, time.time())
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class RedisState(StateBackend):
+    """State in Redis, for workers spread over several hosts"""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis:// requires the redis package")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ex: Optional[float] = None):
+        self._client.set(key, json.dumps(value), px=int(ex * 1000) if ex else None)
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+    def keys(self, prefix: str = '') -> List[str]:
+        # Characters of the prefix must match literally, not as glob patterns
+        pattern = re.sub(r'([\\*?\[\]])', r'\\\1', prefix) + '*'
+        return [key.decode() for key in self._client.scan_iter(match=pattern)]
+
+
+def create_state(url: str) -> StateBackend:
+    if url.startswith('memory://'):
+        return MemoryState()
+    if url.startswith('sqlite:///'):
+        return SQLiteState(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisState(url)
+    raise ValueError(f"Unsupported STATE_BACKEND: {url}")
+
+
+_state: Optional[StateBackend] = None
+_state_lock = threading.Lock()
+
+
+def get_state() -> StateBackend:
+    """Return the process-wide state backend configured by STATE_BACKEND"""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = create_state(STATE_BACKEND)
+        return _state
@@ -1,9 +1,13 @@
 import pytest
 import os
+import sys
 from clickhouse_driver import Client
 import jwt
 from datetime import datetime, timedelta
 
+# Tests import the backend modules by name, however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # Test configuration
 TEST_CONFIG = {
     'CLICKHOUSE_HOST': os.getenv('CLICKHOUSE_HOST', 'clickhouse'),
@@ -47,9 +51,12 @@ def auth_headers(test_token):
     """Create authorization headers with test token"""
     return {'Authorization': f'Bearer {test_token}'}
 
-@pytest.fixture(autouse=True)
+@pytest.fixture
 def setup_test_environment(clickhouse_client):
-    """Setup test environment before each test"""
+    """Setup test environment before each test that needs a live ClickHouse.
+
+    Opt in with pytest.mark.usefixtures('setup_test_environment'); unit tests run without a server.
+    """
     # Create test database if it doesn't exist
     clickhouse_client.execute(f"CREATE DATABASE IF NOT EXISTS {TEST_CONFIG['CLICKHOUSE_DATABASE']}")
     
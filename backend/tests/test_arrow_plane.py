@@ -0,0 +1,102 @@
+import io
+import os
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from arrow_plane import ClickHouseHTTP, column_types, export_select, read_csv_chunk
+from csv_chunks import iter_csv_chunks
+from fake_clickhouse import FakeClient
+
+pa = pytest.importorskip('pyarrow')
+
+
+class ArrowHandler(BaseHTTPRequestHandler):
+    """Keeps the last inserted Arrow table and returns it to any query"""
+    table = None
+    params = None
+    query = None
+
+    def do_POST(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        type(self).params = params
+        if 'query' in params:
+            type(self).table = pa.ipc.open_stream(body).read_all()
+            self.send_response(200)
+            self.end_headers()
+            return
+        type(self).query = body.decode()
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, self.table.schema) as writer:
+            writer.write_table(self.table)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(sink.getvalue().to_pybytes())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def http():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ArrowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield ClickHouseHTTP('127.0.0.1', server.server_port)
+    server.shutdown()
+
+TYPES = {'id': 'UInt32', 'day': 'Date', 'town': 'LowCardinality(String)', 'price': 'Nullable(Decimal(10, 2))'}
+CSV = b'id,day,town,price\n1,2024-01-02,LONDON,1.50\n2,2024-01-03,LONDON,\n3,2024-01-04,"YORK, NORTH",2.25\n'
+
+def test_chunks_parse_into_typed_columns():
+    table = read_csv_chunk(next(iter_csv_chunks(io.BytesIO(CSV))), ',', column_types(TYPES))
+    assert table.schema.field('town').type == pa.dictionary(pa.int32(), pa.string())
+    assert table.column('day').to_pylist()[0] == date(2024, 1, 2)
+    assert table.column('price').null_count == 1
+    bad = CSV.replace(b'\n3,', b'\n-3,')
+    assert read_csv_chunk(next(iter_csv_chunks(io.BytesIO(bad))), ',', column_types(TYPES)) is None
+
+def test_composite_columns_stay_on_python_plane():
+    assert column_types({'id': 'UInt32', 'tags': 'Array(String)'}) is None
+
+def test_export_select_casts_to_text_friendly_types():
+    assert export_select([('day', 'Date'), ('kind', "Enum8('a' = 1)"), ('id', 'UInt32')]) == [
+        'toDate32(`day`) AS `day`', 'toString(`kind`) AS `kind`', '`id`'
+    ]
+
+def test_insert_and_export_round_trip(http):
+    table = read_csv_chunk(next(iter_csv_chunks(io.BytesIO(CSV))), ',', column_types(TYPES))
+    assert http.insert('sales', table, {'insert_deduplication_token': 't'}) == 3
+    assert ArrowHandler.params['query'] == 'INSERT INTO sales (`id`, `day`, `town`, `price`) FORMAT ArrowStream'
+    assert ArrowHandler.params['insert_deduplication_token'] == 't'
+    output = io.BytesIO()
+    assert http.export_csv('SELECT * FROM sales', output, ['id', 'day', 'town', 'price']) == 3
+    assert output.getvalue().decode().splitlines() == [
+        '"id","day","town","price"', '1,2024-01-02,"LONDON",1.50', '2,2024-01-03,"LONDON",',
+        '3,2024-01-04,"YORK, NORTH",2.25'
+    ]
+
+def test_import_falls_back_to_python_plane_for_bad_chunks(http, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'DEDUP_CHUNK_ROWS', 50)
+    client = FakeClient()
+    client.add_table('sales', list(TYPES.items()))
+    data = CSV + b''.join(b'%d,2024-02-01,LEEDS,1\n' % i for i in range(4, 100)) + b'x,2024-02-01,LEEDS,1\n'
+    result = main.import_csv(client, 'sales', io.BytesIO(data), http=http, dedup=True)
+    assert result['records_processed'] == 100 and result['typeWarnings'] == ['Cannot convert x to UInt32']
+    # Only the chunk holding the unparseable id goes through the driver
+    assert ArrowHandler.table.num_rows == 50 and client.inserted_rows['sales'] == 50
+
+def test_export_quotes_each_column_once(http, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'get_clickhouse_http', lambda config: http)
+    client = FakeClient()
+    client.add_table('sales', [('order id', 'UInt32'), ('day', 'Date')])
+    ArrowHandler.table = pa.table({'order id': pa.array([1, 2], pa.uint32()), 'day': pa.array([1, 2], pa.int32())})
+    path, rows, _ = main.export_arrow(client, None, 'sales', ['order id', 'day'])
+    assert ArrowHandler.query == "SELECT `order id`, toDate32(`day`) AS `day` FROM sales FORMAT ArrowStream"
+    with open(path) as f:
+        assert f.readline().strip() == '"order id","day"' and rows == 2
+    os.remove(path)
@@ -0,0 +1,41 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from auth import ALGORITHM, SECRET_KEY, TOKEN_CACHE_LOOKUPS, TokenCache, decode_token, token_cache
+
+
+def make_token(exp_offset, **claims):
+    return jwt.encode({'sub': 'test', 'exp': int(time.time() + exp_offset), **claims}, SECRET_KEY, algorithm=ALGORITHM)
+
+def lookups(result):
+    return dict(((labels['result'], value) for _, labels, value in TOKEN_CACHE_LOOKUPS.samples())).get(result, 0)
+
+def test_verified_claims_are_reused():
+    token_cache.clear()
+    token = make_token(60)
+    misses, hits = lookups('miss'), lookups('hit')
+    assert decode_token(token)['sub'] == 'test'
+    assert decode_token(token)['sub'] == 'test'
+    assert (lookups('miss') - misses, lookups('hit') - hits) == (1, 1)
+
+def test_invalid_and_expired_tokens_are_rejected_every_time():
+    token_cache.clear()
+    for _ in range(2):
+        with pytest.raises(HTTPException) as error:
+            decode_token('not-a-token')
+        assert error.value.detail == "Invalid token"
+    with pytest.raises(HTTPException) as error:
+        decode_token(make_token(-60))
+    assert error.value.detail == "Token has expired"
+
+def test_cache_entries_expire_with_the_token_and_are_bounded():
+    cache = TokenCache(max_size=2, ttl=300)
+    cache.put('a', {'exp': time.time() - 1})
+    assert cache.get('a') is None
+    for token in ('b', 'c', 'd'):
+        cache.put(token, {'exp': time.time() + 60})
+    assert cache.get('b') is None
+    assert cache.get('d') is not None
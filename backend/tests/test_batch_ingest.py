@@ -0,0 +1,43 @@
+import asyncio
+import io
+
+import pytest
+
+from batch_ingest import BatchJobStore, expand_glob
+from checkpoints import ImportIndex
+from fake_clickhouse import FakeClient
+from pool import ClickHousePool
+from state import MemoryState
+
+
+def shard(first: int, rows: int = 100) -> bytes:
+    return b'id,name\n' + b''.join(b'%d,n%d\n' % (i, i) for i in range(first, first + rows))
+
+def test_glob_stays_inside_root(tmp_path):
+    (tmp_path / 'day1').mkdir()
+    (tmp_path / 'day1' / 'a.csv').write_bytes(b'')
+    (tmp_path / 'b.csv').write_bytes(b'')
+    (tmp_path / 'day1' / 'escape.csv').symlink_to('/etc/hostname')
+    assert expand_glob(str(tmp_path), '**/*.csv') == [str(tmp_path / 'b.csv'), str(tmp_path / 'day1' / 'a.csv')]
+    for pattern in ('../*.csv', '/etc/*'):
+        with pytest.raises(ValueError):
+            expand_glob(str(tmp_path), pattern)
+    with pytest.raises(ValueError):
+        expand_glob('', '*.csv')
+
+def test_batch_shares_one_schema_lookup_and_reports_each_file(tmp_path, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'import_index', ImportIndex(str(tmp_path / 'index.db')))
+    monkeypatch.setattr(main, 'batch_jobs', BatchJobStore(MemoryState()))
+    client = FakeClient()
+    client.add_table('events', [('id', 'UInt32'), ('name', 'String')])
+    path = tmp_path / 'local.csv'
+    path.write_bytes(shard(200))
+    sources = [('a.csv', io.BytesIO(shard(0))), ('b.csv', str(path)), ('again.csv', io.BytesIO(shard(0))),
+               ('missing.csv', str(tmp_path / 'missing.csv'))]
+    results = asyncio.run(main.ingest_batch(ClickHousePool(lambda: client, 2), 'events', sources, 'job', parallelism=1))
+    assert [result['status'] for result in results] == ['imported', 'imported', 'skipped', 'failed']
+    assert client.inserted_rows['events'] == 200
+    assert sum(query.startswith('DESCRIBE') for query in client.queries) == 1
+    job = main.batch_jobs.get('job')
+    assert job['status'] == 'failed' and [entry['file'] for entry in job['files']][-1] == 'missing.csv'
@@ -0,0 +1,39 @@
+from batching import AdaptiveBatcher, batch_stats
+
+
+def make_batcher(**overrides):
+    options = dict(min_rows=1000, max_rows=100000, initial_rows=10000, target_seconds=1.0, max_bytes=10_000_000)
+    options.update(overrides)
+    return AdaptiveBatcher('test', **options)
+
+def test_fast_batches_grow_until_max_rows():
+    batcher = make_batcher()
+    for _ in range(10):
+        batcher.observe(batcher.rows, 0.01, 1000)
+    assert batcher.rows == 100000
+
+def test_slow_batches_shrink_towards_target_latency():
+    batcher = make_batcher()
+    assert batcher.observe(10000, 1.6) == 6250
+    # A single very slow batch shrinks by at most half
+    assert batcher.observe(6250, 60.0) == 3125
+
+def test_byte_ceiling_limits_growth():
+    batcher = make_batcher()
+    assert batcher.observe(10000, 0.01, 8_000_000) == 12500
+
+def test_size_stays_within_bounds():
+    batcher = make_batcher()
+    for _ in range(10):
+        batcher.observe(batcher.rows, 100.0)
+    assert batcher.rows == 1000
+
+def test_short_trailing_batch_does_not_shrink_size():
+    batcher = make_batcher()
+    assert batcher.observe(10, 0.001) == 20000
+
+def test_chosen_sizes_are_recorded():
+    batcher = AdaptiveBatcher('stats-test', initial_rows=5000)
+    batcher.observe(5000, 0.5, 100)
+    stats = batch_stats()['stats-test']
+    assert stats['batches'] == 1 and stats['last_rows'] == 5000 and stats['bytes'] == 100
@@ -0,0 +1,95 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from clickhouse_driver import Client
+
+from arrow_plane import ClickHouseHTTP
+from ch_transfer import copy_remote, copy_stream, create_target, remote_source
+from query_builder import join_select
+
+
+class RecordingClient:
+    """Records queries and reports written rows the way the native driver does"""
+
+    def __init__(self):
+        self.queries = []
+        self.last_query = SimpleNamespace(progress=SimpleNamespace(written_rows=3, written_bytes=48))
+
+    def execute(self, query, params=None, settings=None, query_id=None):
+        self.queries.append((query, params, settings))
+        if query.startswith('DESCRIBE'):
+            return [('trips.id', 'UInt32', '', '', '', '', ''), ('zones.name', 'LowCardinality(String)', '', '', '', '', '')]
+        return []
+
+
+class NativeHandler(BaseHTTPRequestHandler):
+    """Serves canned Native bytes to SELECTs and keeps the body of INSERTs"""
+    inserted = None
+
+    def do_POST(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if 'query' not in params:
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'\x02\x03native')
+            return
+        body = b''
+        while True:
+            size = int(self.rfile.readline(), 16)
+            body += self.rfile.read(size + 2)[:size]
+            if not size:
+                break
+        type(self).inserted = (params['query'], body)
+        self.send_response(200)
+        self.send_header('X-ClickHouse-Summary', json.dumps({'written_rows': '3', 'written_bytes': '48'}))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+JOINS = [('trips', 'zone_id', 'zones', 'id')]
+COLUMNS = ['trips.id', 'zones.name']
+
+
+def test_remote_copy_binds_connection_arguments():
+    params = {}
+    select = join_select(COLUMNS, 'trips', JOINS, source=remote_source('src:9000', 'nyc', 'reader', "p'w", params)).sql
+    assert select == (
+        "SELECT trips.id, zones.name FROM remote(%(source_address)s, %(source_database_0)s, %(source_table_0)s, "
+        "%(source_user)s, %(source_password)s) AS trips INNER JOIN remote(%(source_address)s, "
+        "%(source_database_1)s, %(source_table_1)s, %(source_user)s, %(source_password)s) AS zones "
+        "ON trips.zone_id = zones.id"
+    )
+    client = Client('localhost')
+    assert "'p\\'w'" in client.substitute_params(select, params, client.connection.context)
+    source, target = RecordingClient(), RecordingClient()
+    create_target(source, target, 'trips_copy', join_select(COLUMNS, 'trips', JOINS).sql, COLUMNS)
+    assert source.queries[0][0] == "DESCRIBE (SELECT trips.id, zones.name FROM trips INNER JOIN zones ON trips.zone_id = zones.id)"
+    assert '`id` UInt32, `name` LowCardinality(String)' in target.queries[0][0]
+    assert copy_remote(target, 'trips_copy', COLUMNS, select, params) == (3, 48)
+    assert target.queries[1][0] == f"INSERT INTO trips_copy (`id`, `name`) {select}"
+    for table in ('', 'nyc.'):
+        with pytest.raises(ValueError):
+            join_select(COLUMNS, table, [], source=remote_source('src:9000', 'nyc', 'reader', '', {}))
+    with pytest.raises(ValueError):
+        join_select(COLUMNS, 'trips', JOINS, 'INNER JOIN secrets ON 1 = 1 --')
+    with pytest.raises(ValueError):
+        create_target(source, target, 'copy', select, ['a.id', 'b.id'])
+    copy_remote(target, 'copy (id) SELECT 1 --', ['id'], 'SELECT 1', {})
+    assert target.queries[-1][0] == "INSERT INTO `copy (id) SELECT 1 --` (`id`) SELECT 1"
+
+def test_stream_copy_pipes_native_blocks():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), NativeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    http = ClickHouseHTTP('127.0.0.1', server.server_port)
+    try:
+        assert copy_stream(http, http, 'trips_copy', ['id'], 'SELECT id FROM trips') == (3, 48)
+    finally:
+        server.shutdown()
+    assert NativeHandler.inserted == ("INSERT INTO trips_copy (`id`) FORMAT Native", b'\x02\x03native')
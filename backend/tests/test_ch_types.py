@@ -0,0 +1,80 @@
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ch_types import categorical_dtypes, check_value, column_warnings, infer_type, invalid_values, pandas_dtype, parse_type, to_driver
+
+
+@pytest.mark.parametrize('expression', [
+    "Enum8('terraced' = 1, 'semi-detached' = 2, 'other' = 0)",
+    "LowCardinality(Nullable(FixedString(7)))",
+    "Map(String, Array(Nullable(Decimal(10, 2))))",
+    "Tuple(a String, b DateTime64(3, 'Europe/London'))"
+])
+
+def test_types_round_trip(expression):
+    assert str(parse_type(expression)) == expression
+
+def test_parse_tree():
+    parsed = parse_type("LowCardinality(Nullable(String))")
+    assert parsed.nullable and parsed.low_cardinality and parsed.inner.name == 'String'
+    assert parse_type("Enum('a', 'b')").args == (('a', 1), ('b', 2))
+    assert parse_type("Decimal64(4)").decimal_digits == (18, 4)
+    assert parse_type("DateTime('UTC')").timezone == 'UTC'
+    with pytest.raises(ValueError):
+        parse_type("Array(String")
+
+def test_pandas_dtypes():
+    assert pandas_dtype('Nullable(UInt16)') == 'UInt16' and pandas_dtype('Int8') == 'int8'
+    assert list(pandas_dtype("Enum8('A' = 1, 'B' = 2)").categories) == ['A', 'B']
+    assert pandas_dtype('LowCardinality(String)') == 'category'
+
+def test_invalid_values_per_type():
+    assert invalid_values(pd.Series(['1', '300', 'x', None]), 'UInt8').tolist() == [False, True, True, True]
+    assert invalid_values(pd.Series(['1', None]), 'Nullable(UInt8)').tolist() == [False, False]
+    assert invalid_values(pd.Series(['flat', 'castle']), "Enum8('flat' = 4)").tolist() == [False, True]
+    assert invalid_values(pd.Series(['UA', 'TOOLONG!']), 'FixedString(7)').tolist() == [False, True]
+    assert invalid_values(pd.Series(['12.34', '123456789']), 'Decimal(10, 2)').tolist() == [False, True]
+    assert invalid_values(pd.Series(['2020-02-01', '1960-01-01']), 'Date').tolist() == [False, True]
+    assert column_warnings(pd.Series(['7', 'x']), 'Int32') == ['Cannot convert x to Int32']
+
+def test_scalar_checks_match_columns():
+    assert check_value(300, 'UInt8') and check_value('semi', "Enum8('semi-detached' = 2)")
+    assert check_value([1, 2], 'Array(UInt8)') is None and check_value([1, 300], 'Array(UInt8)')
+    assert check_value({'a': 1}, 'Map(String, UInt8)') is None
+
+def test_values_are_converted_for_the_driver():
+    assert to_driver(pd.Series([1.0, np.nan]), 'Nullable(Int32)') == [1, None]
+    assert to_driver(pd.Series(['2020-01-02']), 'Date') == [date(2020, 1, 2)]
+    assert to_driver(pd.Series(['1.10']), 'Decimal(5, 2)') == [Decimal('1.10')]
+    assert to_driver(pd.Series(['a', np.nan]), 'String') == ['a', '']
+    assert to_driver(pd.Series(['a', np.nan]), 'Nullable(String)') == ['a', None]
+
+def test_values_that_do_not_fit_convert_to_none():
+    # Casting would wrap 300 to 44, -1 to 2**64 - 1 and truncate 1.5 to 1
+    assert to_driver(pd.Series([300, 7]), 'UInt8') == [None, 7]
+    assert to_driver(pd.Series([-1, 2 ** 63]), 'UInt64') == [None, 2 ** 63]
+    assert to_driver(pd.Series([1.5, 2.0]), 'Int64') == [None, 2]
+    assert to_driver(pd.Series(['1.10', 'abc', '123456789', 'NaN']), 'Decimal(10, 2)') == [
+        Decimal('1.10'), None, None, None
+    ]
+    assert invalid_values(pd.Series(['abc', '1.5']), 'Decimal(10, 2)').tolist() == [True, False]
+
+def test_categoricals_convert_once_per_category():
+    values = pd.Series(['flat', None, 'castle', 'flat'], dtype='category')
+    rows = to_driver(values, 'LowCardinality(Nullable(String))')
+    assert rows == ['flat', None, 'castle', 'flat'] and rows[0] is rows[3]
+    assert invalid_values(values, "Enum8('flat' = 1)").tolist() == [False, False, True, False]
+    assert categorical_dtypes({'town': 'LowCardinality(String)', 'kind': "Enum8('a' = 1)", 'id': 'UInt32'}) == \
+        {'town': 'category', 'kind': 'category'}
+
+def test_types_are_inferred_from_columns():
+    assert infer_type(pd.Series([1.0, np.nan])) == 'Nullable(Int64)'
+    assert infer_type(pd.Series(['2020-01-01', '2021-12-31'])) == 'Date'
+    assert infer_type(pd.Series(['2020-01-01 10:00:00'])) == 'DateTime'
+    assert infer_type(pd.Series([0.5, 2.0])) == 'Float64'
+    assert infer_type(pd.Series(['DL', 'AA', None] * 10)) == 'LowCardinality(Nullable(String))'
+    assert infer_type(pd.Series(['DL', 'AA'])) == 'String'
@@ -0,0 +1,107 @@
+import io
+from datetime import date, datetime
+
+import pytest
+
+from checkpoints import CheckpointStore, ImportIndex, WatermarkStore, dedup_token, decode_watermark, encode_watermark
+from checkpoints import CheckpointConflict, file_hash
+from csv_chunks import iter_csv_chunks, read_chunk
+
+CSV_WITH_QUOTED_NEWLINES = b'id,note\n1,"multi\nline"\n2,plain\n3,"say ""hi""\n"\n4,last'
+
+
+def test_chunks_align_to_records():
+    chunks = list(iter_csv_chunks(io.BytesIO(CSV_WITH_QUOTED_NEWLINES), max_rows=2))
+    frames = [read_chunk(chunk) for chunk in chunks]
+    assert sum(len(frame) for frame in frames) == 4
+    assert frames[0]['note'][0] == 'multi\nline'
+    # Consecutive chunks cover the file without gaps
+    assert all(a.end == b.start for a, b in zip(chunks, chunks[1:]))
+    assert chunks[-1].end == len(CSV_WITH_QUOTED_NEWLINES)
+
+def test_chunks_resume_from_offset():
+    chunks = list(iter_csv_chunks(io.BytesIO(CSV_WITH_QUOTED_NEWLINES), max_rows=2))
+    resumed = list(iter_csv_chunks(io.BytesIO(CSV_WITH_QUOTED_NEWLINES), max_rows=2, offset=chunks[1].start))
+    assert [chunk.start for chunk in resumed] == [chunk.start for chunk in chunks[1:]]
+    assert list(read_chunk(resumed[0]).columns) == ['id', 'note']
+
+def test_checkpoint_store_tracks_committed_chunks(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    store.start('t1', 'file-to-ch', 'uk_price_paid', {'delimiter': ','}, 100)
+    store.commit_chunk('t1', 40, 10)
+    store.commit_chunk('t1', 80, 10)
+    # Restarting the same transfer keeps its progress
+    checkpoint = store.start('t1', 'file-to-ch', 'uk_price_paid', {'delimiter': ','}, 100)
+    assert (checkpoint['byte_offset'], checkpoint['chunks'], checkpoint['rows']) == (80, 2, 20)
+    store.finish('t1')
+    assert store.get('t1')['status'] == 'completed'
+    for other in (('file-to-ch', 'uk_price_paid', {'delimiter': ';'}, 100),
+                  ('file-to-ch', 'uk_price_paid', {'delimiter': ','}, 120),
+                  ('transfer', 'uk_price_paid', {'delimiter': ','}, 100)):
+        with pytest.raises(CheckpointConflict):
+            store.start('t1', *other)
+
+def test_dedup_token_is_stable_per_chunk():
+    assert dedup_token('t1', 40) == dedup_token('t1', 40)
+    assert dedup_token('t1', 40) != dedup_token('t1', 80)
+
+def test_dedup_tokens_name_the_file_and_chunk(monkeypatch):
+    import main
+    from fake_clickhouse import FakeClient
+    monkeypatch.setattr(main, 'DEDUP_CHUNK_ROWS', 2)
+
+    def tokens(data):
+        client = FakeClient()
+        client.add_table('ids', [('id', 'UInt32')])
+        main.import_csv(client, 'ids', io.BytesIO(data), dedup=True)
+        return [settings['insert_deduplication_token'] for _, _, settings in client.insert_calls]
+
+    repeated = tokens(b'id\n1\n2\n1\n2\n')
+    # Equal chunks of one file, or of different files, are not taken for re-sends
+    assert len(set(repeated)) == 2
+    assert not set(tokens(b'id\n1\n2\n3\n')) & set(repeated)
+    assert tokens(b'id\n1\n2\n1\n2\n') == repeated
+
+def test_resumed_import_resends_the_same_chunks(tmp_path, monkeypatch):
+    import main
+    from fake_clickhouse import FakeClient
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    monkeypatch.setattr(main, 'checkpoint_store', store)
+    data = b'id\n' + b''.join(b'%d\n' % i for i in range(10))
+    client = FakeClient()
+    client.add_table('ids', [('id', 'UInt32')])
+    store.start('t1', 'file-to-ch', 'ids', {'chunk_rows': 3}, len(data))
+    main.import_csv(client, 'ids', io.BytesIO(data), transfer_id='t1', chunk_rows=3)
+    tokens = [settings['insert_deduplication_token'] for _, _, settings in client.insert_calls]
+    # However fast the first run went, a resume from its second chunk cuts the rest identically
+    resumed = FakeClient()
+    resumed.add_table('ids', [('id', 'UInt32')])
+    offset = len(b'id\n0\n1\n2\n')
+    main.import_csv(resumed, 'ids', io.BytesIO(data), transfer_id='t1', offset=offset, chunk_rows=3)
+    assert [settings['insert_deduplication_token'] for _, _, settings in resumed.insert_calls] == tokens[1:]
+    assert [count for _, count, _ in client.insert_calls] == [3, 3, 3, 1]
+
+def test_watermarks_keep_their_type():
+    for value in (datetime(2024, 5, 1, 12, 30), date(2024, 5, 1), 42, 'b-17'):
+        assert decode_watermark(encode_watermark(value)) == value
+
+def test_watermark_store_advances_per_target(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'checkpoints.db'))
+    store.advance('events', 'hourly', 'created_at', datetime(2024, 5, 1, 12), 100)
+    store.advance('events', 'hourly', 'created_at', datetime(2024, 5, 1, 13), 5)
+    store.advance('events', 'daily', 'created_at', datetime(2024, 5, 1), 105)
+    hourly = store.get('events', 'hourly')
+    assert (hourly['watermark'], hourly['exports'], hourly['rows']) == (datetime(2024, 5, 1, 13), 2, 105)
+    assert [w['target'] for w in store.list('events')] == ['daily', 'hourly']
+    assert store.reset('events', 'hourly') and store.get('events', 'hourly') is None
+
+def test_import_index_recognises_identical_files(tmp_path):
+    index = ImportIndex(str(tmp_path / 'checkpoints.db'))
+    source = io.BytesIO(CSV_WITH_QUOTED_NEWLINES)
+    digest = file_hash(source)
+    assert source.tell() == 0
+    index.add('notes', digest, len(CSV_WITH_QUOTED_NEWLINES), 4)
+    assert index.get('notes', file_hash(io.BytesIO(CSV_WITH_QUOTED_NEWLINES)))['rows'] == 4
+    assert index.get('notes', file_hash(io.BytesIO(CSV_WITH_QUOTED_NEWLINES + b'\n5,more'))) is None
+    assert index.get('other_table', digest) is None
+    assert index.remove('notes', digest) and index.get('notes', digest) is None
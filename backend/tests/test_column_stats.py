@@ -0,0 +1,65 @@
+import io
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from column_stats import HyperLogLog, StatsCache, profile_columns, table_column_stats, table_stats_query
+from csv_chunks import iter_csv_chunks
+from state import MemoryState
+
+
+class OneRowClient:
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+
+    def execute(self, query, params=None, settings=None):
+        self.queries.append(query)
+        return [self.row]
+
+def test_table_stats_use_one_query():
+    client = OneRowClient((10, 3, 2, date(2024, 1, 1), date(2024, 3, 1), [date(2024, 1, 1)], 4, 0, None, None, [['a']]))
+    stats = table_column_stats(client, 'events', [('day', 'Nullable(Date)'), ('tags', 'Array(String)')], 1, 0.1)
+    assert len(client.queries) == 1 and client.queries[0].endswith('FROM events SAMPLE 0.1')
+    day, tags = stats['columns']
+    assert (day['distinct'], day['null_fraction'], day['min'], day['top']) == (3, 0.2, '2024-01-01', ['2024-01-01'])
+    assert tags['min'] is None and tags['top'] == [['a']]
+
+def test_unordered_types_skip_min_max():
+    query = table_stats_query('t', [('m', "Map(String, UInt8)"), ('s', 'LowCardinality(String)')]).sql
+    assert 'min(`m`)' not in query and 'min(`s`)' in query and 'topK(5)(`s`)' in query
+    # The cache keys statistics by their query
+    columns = [('s', 'String')]
+    assert table_stats_query('t', columns).key == table_stats_query('t', columns).key
+    assert table_stats_query('t', columns).key != table_stats_query('t', columns, top_k=3).key
+
+def test_hyperloglog_estimates_distinct_values():
+    for n in (50, 200000):
+        hll = HyperLogLog()
+        for part in np.array_split(np.arange(n), 4):
+            hll.update(pd.util.hash_pandas_object(pd.Series(part), index=False).to_numpy())
+        assert abs(hll.estimate() - n) <= 0.03 * n
+
+def test_flat_file_profile_spans_chunks():
+    data = b'id,city\n' + b''.join(b'%d,%s\n' % (i, b'' if i % 4 == 0 else b'c%d' % (0 if i % 2 else 1 if i % 3 else 2)) for i in range(1000))
+    data += b'x,c0\n'
+    stats = profile_columns(iter_csv_chunks(io.BytesIO(data), max_rows=100), top_k=2)
+    ids, cities = stats['columns']
+    assert stats['rows'] == 1001
+    assert (ids['type'], ids['min'], ids['max']) == ('String', '0', 'x')
+    assert (cities['nulls'], cities['distinct'], cities['top']) == (250, 3, ['c0', 'c1'])
+
+def test_mixed_columns_do_not_depend_on_chunk_order():
+    numbers, text = b'9\n10\n', b'unknown\n'
+    results = [
+        profile_columns(iter_csv_chunks(io.BytesIO(b'v\n' + first + second), max_rows=2))['columns'][0]
+        for first, second in ((numbers, text), (text, numbers))
+    ]
+    assert [(column['type'], column['min'], column['max']) for column in results] == [('String', '10', 'unknown')] * 2
+
+def test_stats_cache_drops_entries_when_schema_changes():
+    cache = StatsCache(MemoryState(), ttl=60)
+    cache.put('table:t', [['id', 'UInt64']], 'p', {'rows': 1})
+    assert cache.get('table:t', [['id', 'UInt64']], 'p') == {'rows': 1}
+    assert cache.get('table:t', [['id', 'UInt64'], ['name', 'String']], 'p') is None
@@ -11,6 +11,9 @@ from datetime import datetime, timedelta
 import tempfile
 import csv
 
+# These tests run against a live ClickHouse
+pytestmark = pytest.mark.usefixtures('setup_test_environment')
+
 # Test client setup
 client = TestClient(app)
 
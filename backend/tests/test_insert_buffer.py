@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from insert_buffer import InsertBuffer
+
+
+def test_rows_from_several_producers_are_flushed_together():
+    flushed = []
+    buffer = InsertBuffer(flushed.append, max_rows=1000, max_bytes=10**9, max_wait=0.2)
+    futures = [buffer.add([(i, 'x')] * 10) for i in range(5)]
+    for future in futures:
+        future.result(timeout=5)
+    buffer.close()
+    assert [len(rows) for rows in flushed] == [50]
+
+def test_flushes_when_row_limit_is_reached():
+    flushed = []
+    buffer = InsertBuffer(flushed.append, max_rows=10, max_bytes=10**9, max_wait=60)
+    started = time.monotonic()
+    buffer.add([(1,)] * 10).result(timeout=5)
+    assert time.monotonic() - started < 5
+    buffer.close()
+    assert [len(rows) for rows in flushed] == [10]
+
+def test_flush_errors_reach_every_waiter():
+    def failing_insert(rows):
+        raise RuntimeError("too many parts")
+    buffer = InsertBuffer(failing_insert, max_rows=1000, max_bytes=10**9, max_wait=0.05)
+    futures = [buffer.add([(1,)]), buffer.add([(2,)])]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    buffer.close()
+
+def test_close_flushes_pending_rows():
+    flushed = []
+    buffer = InsertBuffer(flushed.append, max_rows=1000, max_bytes=10**9, max_wait=60)
+    future = buffer.add([(1,), (2,)])
+    buffer.close()
+    assert future.result(timeout=0) == 2
+    assert flushed == [[(1,), (2,)]]
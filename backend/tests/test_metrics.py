@@ -0,0 +1,33 @@
+import pytest
+
+import metrics
+from metrics import Counter, Histogram, render, register_collector
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Metrics and collectors registered by a test are dropped when it ends"""
+    monkeypatch.setattr(metrics, 'REGISTRY', list(metrics.REGISTRY))
+    monkeypatch.setattr(metrics, 'COLLECTORS', list(metrics.COLLECTORS))
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_latency_seconds', 'Test latency', ['stage'], buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage='parse')
+    histogram.observe(0.5, stage='parse')
+    histogram.observe(5.0, stage='parse')
+    samples = {(name, labels.get('le')): value for name, labels, value in histogram.samples()}
+    assert samples[('test_latency_seconds_bucket', '0.1')] == 1
+    assert samples[('test_latency_seconds_bucket', '1.0')] == 2
+    assert samples[('test_latency_seconds_bucket', '+Inf')] == 3
+    assert samples[('test_latency_seconds_count', None)] == 3
+    assert samples[('test_latency_seconds_sum', None)] == 5.55
+
+def test_render_includes_counters_and_collectors():
+    counter = Counter('test_rows_total', 'Test rows', ['table'])
+    counter.inc(10, table='uk_price_paid')
+    counter.inc(5, table='uk_price_paid')
+    register_collector(lambda: [('test_pool_idle', 'Idle connections', [({'pool': 'a"b'}, 2)])])
+    text = render()
+    assert '# TYPE test_rows_total counter' in text
+    assert 'test_rows_total{table="uk_price_paid"} 15' in text
+    assert 'test_pool_idle{pool="a\\"b"} 2' in text
@@ -0,0 +1,98 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import parallel_export
+from parallel_export import export_parallel, plan_ranges, partition_ranges, key_ranges
+from pool import ClickHousePool
+
+
+class StubClient:
+    """Answers the planning queries with canned results"""
+
+    def __init__(self, partitions=None, sorting_key='', sample=None):
+        self.partitions = partitions or []
+        self.sorting_key = sorting_key
+        self.sample = sample or []
+
+    def execute(self, query, params=None):
+        if 'system.parts' in query:
+            return self.partitions
+        if 'system.tables' in query:
+            return [(self.sorting_key,)]
+        if 'groupArraySample' in query:
+            return [(self.sample,)]
+        raise AssertionError(f"Unexpected query: {query}")
+
+
+class YearsClient:
+    """Serves (Year, Carrier) rows, filtered by the partition parameter"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        assert query.startswith('SELECT DISTINCT Year')
+        return [(year,) for year in sorted({year for year, _ in self.rows})]
+
+    def execute_iter(self, query, params=None, settings=None, query_id=None):
+        params = params or {}
+        return iter([row for row in self.rows if 'partition' not in params or row[0] == params['partition']])
+
+
+def test_partition_ranges_are_contiguous_and_balanced():
+    client = StubClient(partitions=[('2019', 100), ('2020', 100), ('2021', 100), ('2022', 100)])
+    ranges = partition_ranges(client, 'ontime', 2)
+    assert ranges[0][0] == '_partition_id IN (%(partition_0)s, %(partition_1)s)'
+    assert [tuple(params.values()) for _, params in ranges] == [('2019', '2020'), ('2021', '2022')]
+
+def test_single_partition_falls_back_to_sorting_key():
+    client = StubClient(partitions=[('all', 1000)], sorting_key='Year, Month', sample=list(range(100)))
+    ranges = plan_ranges(client, 'ontime', 4)
+    assert len(ranges) == 4
+    assert ranges[0] == ("(Year < %(upper)s OR isNull(Year))", {'upper': 25})
+    assert ranges[-1] == ("Year >= %(lower)s", {'lower': 75})
+
+def test_key_ranges_collapse_duplicate_boundaries():
+    client = StubClient(sample=[1] * 90 + [2] * 10)
+    ranges = key_ranges(client, 'ontime', 'Year', 4)
+    assert [params for _, params in ranges] == [{'upper': 1}, {'lower': 1}]
+
+def test_split_column_must_be_a_column_name():
+    client = StubClient(sample=list(range(100)))
+    with pytest.raises(ValueError):
+        plan_ranges(client, 'ontime', 4, split_by='Year) FROM system.users --')
+
+def test_unsplittable_table_uses_single_range():
+    client = StubClient(sorting_key='cityHash64(id)')
+    assert plan_ranges(client, 'events', 4) == [("1", {})]
+
+def test_partitions_roll_over_into_manifest_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_export, 'EXPORT_DIR', str(tmp_path))
+    rows = [(2020, 'DL')] * 5 + [(2021, 'AA')] * 2
+    pool = ClickHousePool(lambda: YearsClient(rows), 2)
+    path, total, count = export_parallel(pool, 'ontime', ['Year', 'Carrier'], 2, output='manifest',
+                                         partition_by='Year', max_rows_per_file=3)
+    manifest = json.load(open(path))
+    assert (total, count) == (7, 3)
+    assert [(f['name'], f['rows'], f['partition']) for f in manifest['files']] == [
+        ('ontime_Year=2020_0000.csv', 3, 2020), ('ontime_Year=2020_0001.csv', 2, 2020),
+        ('ontime_Year=2021_0000.csv', 2, 2021)
+    ]
+    with open(os.path.join(os.path.dirname(path), 'ontime_Year=2020_0001.csv')) as f:
+        assert f.read().splitlines() == ['Year,Carrier', '2020,DL', '2020,DL']
+
+def test_byte_limit_rolls_over_zipped_shards(monkeypatch):
+    monkeypatch.setattr(parallel_export, 'ROLLOVER_CHECK_ROWS', 10)
+    pool = ClickHousePool(lambda: YearsClient([(2020, 'DL')] * 100), 1)
+    path, total, count = export_parallel(pool, 'ontime', ['Year', 'Carrier'], 1, output='shards',
+                                         max_bytes_per_file=200)
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read('manifest.json'))
+        sizes = [len(archive.read(f['name'])) for f in manifest['files']]
+    assert total == 100 and count == len(sizes) > 1
+    assert all(size < 200 + 10 * len('2020,DL\r\n') for size in sizes)
+    with pytest.raises(ValueError):
+        export_parallel(pool, 'ontime', ['Year'], 1, max_rows_per_file=10)
@@ -0,0 +1,46 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import arrow_plane
+import parallel_parse
+from csv_chunks import iter_csv_chunks
+from parallel_parse import PARSE_SHM_DIR, close_parse_pool, iter_parsed
+
+CSV = b'id,town\n' + b''.join(b'%d,"TOWN %d, ""%s"""\n' % (i, i % 7, b'x' * (i % 3)) for i in range(5000))
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    monkeypatch.setattr(parallel_parse, 'PARSE_WORKERS', 2)
+    yield
+    close_parse_pool()
+
+def chunks(data=CSV):
+    return iter_csv_chunks(io.BytesIO(data), max_rows=300)
+
+def test_workers_yield_chunks_in_file_order():
+    serial = [frame for _, frame in iter_parsed(chunks(), dtype={'town': 'category'})]
+    parallel = list(iter_parsed(chunks(), dtype={'town': 'category'}, workers=2))
+    assert [chunk.start for chunk, _ in parallel] == [chunk.start for chunk in chunks()]
+    assert pd.concat([frame for _, frame in parallel]).equals(pd.concat(serial))
+
+def test_arrow_tables_come_back_through_shared_memory():
+    pa = pytest.importorskip('pyarrow')
+    types = arrow_plane.column_types({'id': 'UInt16', 'town': 'LowCardinality(String)'})
+    bad = CSV + b'x,TOWN\n'
+    tables = [parsed for _, parsed in iter_parsed(chunks(bad), arrow_types=types, workers=2)]
+    assert all(isinstance(table, pa.Table) for table in tables[:-1])
+    # The chunk that does not parse as UInt16 comes back as a DataFrame for the Python plane
+    assert isinstance(tables[-1], pd.DataFrame)
+    assert sum(table.num_rows for table in tables[:-1]) + len(tables[-1]) == 5001
+    assert not [name for name in os.listdir(PARSE_SHM_DIR) if name.startswith('chunk-')]
+
+def test_requests_share_one_pool():
+    list(iter_parsed(chunks(), workers=2))
+    pool = parallel_parse.get_parse_pool()
+    list(iter_parsed(chunks(), workers=2))
+    assert parallel_parse.get_parse_pool() is pool
+    assert pool._max_workers == 2
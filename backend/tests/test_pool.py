@@ -0,0 +1,49 @@
+import pytest
+
+import pool
+from metrics import render
+from pool import get_pool
+
+
+class Connection:
+    def __init__(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """An empty pool registry, restored after the test"""
+    monkeypatch.setattr(pool, '_pools', type(pool._pools)())
+    return pool._pools
+
+
+def test_connection_pools_are_not_shared_across_passwords(pools):
+    import main
+
+    def config(password):
+        return main.ClickHouseConfig(host='ch', port=9000, database='db', user='alice', password=password)
+
+    assert main.get_clickhouse_pool(config('secret')) is main.get_clickhouse_pool(config('secret'))
+    assert main.get_clickhouse_pool(config('secret')) is not main.get_clickhouse_pool(config('wrong'))
+    # Metrics name the server and user, never anything derived from the password
+    text = render()
+    assert 'pool="alice@ch:9000/db#' in text
+    assert not any(main.credential_key(password) in text for password in ('secret', 'wrong'))
+
+
+def test_least_recently_used_pool_is_closed_beyond_the_cap(pools, monkeypatch):
+    monkeypatch.setattr(pool, 'POOL_MAX_COUNT', 2)
+    a, b = get_pool('a', Connection), get_pool('b', Connection)
+    with b.connection() as idle:
+        pass
+    with a.connection() as borrowed:
+        get_pool('a', Connection)
+        get_pool('c', Connection)
+        assert list(pools) == ['a', 'c'] and not idle.connected
+        get_pool('d', Connection)
+        assert list(pools) == ['c', 'd'] and borrowed.connected
+    # Returned to its evicted pool, the connection is closed instead of kept
+    assert not borrowed.connected and a.stats()['open'] == 0
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from profiling import load_profile, list_profiles, profile_output_path, profile_request, run_in_thread, stage
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+def test_stage_spans_are_recorded_only_inside_a_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr('profiling.PROFILE_DIR', str(tmp_path))
+    with stage('file-to-ch', 'parse'):
+        pass
+    with profile_request('cprofile', 'POST /ingest/file-to-ch') as session:
+        with stage('file-to-ch', 'parse'):
+            busy(0.01)
+        with stage('file-to-ch', 'insert'):
+            busy(0.01)
+    summary = session.summary()
+    assert [span['stage'] for span in summary['spans']] == ['parse', 'insert']
+    assert summary['stages']['parse']['count'] == 1
+
+def test_sampled_profile_is_saved_as_collapsed_stacks(tmp_path, monkeypatch):
+    monkeypatch.setattr('profiling.PROFILE_DIR', str(tmp_path))
+
+    async def handle():
+        with profile_request('sample', 'POST /ingest/file-to-ch') as session:
+            await run_in_thread(busy, 0.1)
+        return session
+
+    session = asyncio.run(handle())
+    profile = load_profile(session.id)
+    with open(profile_output_path(profile)) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('busy' in line for line in lines)
+    # Only the worker thread is sampled, not the event loop shared with other requests
+    assert not any('base_events.py' in line for line in lines)
+    assert list_profiles()[0]['id'] == session.id
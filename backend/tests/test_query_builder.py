@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+import query_builder
+from fake_clickhouse import FakeClient
+
+
+def test_identifiers_are_validated_and_quoted():
+    assert query_builder.identifier('db.trips') == 'db.trips'
+    assert query_builder.identifier('price usd') == '`price usd`'
+    assert query_builder.identifier('x`; DROP TABLE t') == '`x\\`; DROP TABLE t`'
+    for name in ('', 'db.', '.trips'):
+        with pytest.raises(ValueError):
+            query_builder.identifier(name)
+    query = query_builder.join_select(['trips.id', 'zones.name'], 'trips', [('trips', 'zone_id', 'zones', 'id')], 'left')
+    assert query.sql == "SELECT trips.id, zones.name FROM trips LEFT JOIN zones ON trips.zone_id = zones.id"
+    with pytest.raises(ValueError):
+        query_builder.join_select(['id'], 'trips', [], 'INNER JOIN x ON 1 = 1 --')
+    with pytest.raises(ValueError):
+        query_builder.select('trips', ['id'], limit='10; DROP TABLE trips')
+
+def test_values_are_bound_on_the_server_with_stable_keys():
+    watermark = datetime(2024, 1, 2, 3, 4, 5)
+    where = ("created_at > %(watermark_from)s AND town = %(town)s", {'watermark_from': watermark, 'town': "O'Hare", 'unused': 1})
+    query = query_builder.select('trips', ['id', 'town'], where)
+    assert query.sql == ("SELECT id, town FROM trips "
+                         "WHERE created_at > {watermark_from:DateTime64(6)} AND town = {town:String}")
+    assert query.params == {'watermark_from': watermark, 'town': "O'Hare"}
+    assert query.settings == {'server_side_params': True}
+    assert query.http_settings() == {'param_watermark_from': '2024-01-02 03:04:05', 'param_town': "O'Hare"}
+    assert query.key == query_builder.select('trips', ['id', 'town'], where).key
+    assert query.key != query_builder.select('trips', ['id', 'town'], (where[0], {**where[1], 'town': 'York'})).key
+    client = FakeClient()
+    client.add_table('trips', [('id', 'UInt32')], [(1,), (2,)])
+    assert query_builder.select('trips', ['id'], limit=1).execute(client) == [(1,)]
+    assert query_builder.table_columns('db', 'trips').params == {'database': 'db', 'table': 'trips'}
@@ -0,0 +1,53 @@
+from clickhouse_driver.result import QueryInfo
+
+from fake_clickhouse import FakeClient
+from profiling import stage
+from reports import ReportStore, query_id, record_query, time_breakdown, transfer_report
+
+
+def test_report_collects_stages_and_query_stats():
+    client = FakeClient()
+    assert query_id() is None
+    with transfer_report('ch-to-file', 'trips') as report:
+        qid = query_id()
+        with stage('ch-to-file', 'fetch'):
+            pass
+        with stage('ch-to-file', 'export_serialize'):
+            pass
+        client.last_query = QueryInfo()
+        client.last_query.profile_info.rows = 10
+        record_query(client, qid)
+    report.finish(10, 100)
+    summary = report.to_dict()
+    assert qid.startswith(report.id)
+    assert set(summary['stages']) == {'fetch', 'export_serialize'}
+    assert summary['queries'][qid]['profile']['rows'] == 10
+    # Stages outside the report are not counted
+    with stage('ch-to-file', 'fetch'):
+        pass
+    assert report.to_dict()['stages']['fetch']['count'] == 1
+
+def test_breakdown_names_the_dominant_share():
+    stages = {'fetch': {'count': 1, 'seconds': 4.0}, 'export_serialize': {'count': 1, 'seconds': 1.0}}
+    assert time_breakdown(stages, {})['bound'] == 'network'
+    breakdown = time_breakdown(stages, {}, {'seconds': 3.5})
+    assert (breakdown['server_seconds'], breakdown['network_seconds']) == (3.5, 0.5)
+    assert breakdown['bound'] == 'server'
+    assert time_breakdown(stages, {}, {'error': 'ACCESS_DENIED'})['bound'] == 'network'
+
+def test_store_attaches_server_stats_later(tmp_path):
+    store = ReportStore(str(tmp_path / 'reports.db'), max_keep=2)
+    with transfer_report('file-to-ch', 'trips', 't1') as report:
+        with stage('file-to-ch', 'insert'):
+            pass
+    report.finish(5)
+    store.save(report)
+    updated = store.attach_server_stats(report.id, {'seconds': 0.0, 'queries': []})
+    assert updated['server'] == {'seconds': 0.0, 'queries': []}
+    assert store.get(report.id)['server'] is not None
+    assert store.list(transfer_id='t1')[0]['report_id'] == report.id
+    for _ in range(3):
+        with transfer_report('file-to-ch', 'trips') as other:
+            pass
+        store.save(other)
+    assert len(store.list()) == 2
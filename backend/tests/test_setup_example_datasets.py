@@ -0,0 +1,79 @@
+import dataclasses
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import setup_example_datasets
+from setup_example_datasets import DATASETS, download, find_source, read_blocks, setup_dataset
+
+DATA = gzip.compress(b''.join(b'%d,row %d\n' % (i, i) for i in range(20000)))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    ranges = []
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        self.ranges.append(header)
+        start = int(header[len('bytes='):-1]) if header else 0
+        self.send_response(206 if header else 200)
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+        self.wfile.write(DATA[start:])
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/data.csv.gz"
+    server.shutdown()
+
+def test_download_resumes_partial_file(url, tmp_path):
+    path = str(tmp_path / 'data.csv.gz')
+    with open(path + '.part', 'wb') as f:
+        f.write(DATA[:1000])
+    download(url, path)
+    assert RangeHandler.ranges[-1] == 'bytes=1000-'
+    assert open(path, 'rb').read() == DATA
+
+def test_blocks_are_decompressed_while_read(tmp_path):
+    path = tmp_path / 'data.csv.gz'
+    path.write_bytes(DATA)
+    assert b''.join(read_blocks(str(path))) == gzip.decompress(DATA)
+
+def test_mirror_is_used_instead_of_downloading(tmp_path):
+    mirror, data_dir = tmp_path / 'mirror', tmp_path / 'datasets'
+    mirror.mkdir()
+    data_dir.mkdir()
+    (mirror / 'ontime.csv').write_bytes(b'2020,1\n')
+    ontime, uk_price_paid = DATASETS[1], DATASETS[0]
+    assert find_source(ontime, str(data_dir), str(mirror)) == str(mirror / 'ontime.csv')
+    with pytest.raises(FileNotFoundError):
+        find_source(uk_price_paid, str(data_dir), str(mirror))
+
+def test_cached_error_pages_are_downloaded_again(url, tmp_path):
+    path = tmp_path / 'uk_price_paid.csv.gz'
+    path.write_bytes(b'<?xml version="1.0"?><Error><Code>NoSuchKey</Code></Error>')
+    (tmp_path / 'uk_price_paid.csv').write_bytes(b'')
+    dataset = dataclasses.replace(DATASETS[0], url=url)
+    assert find_source(dataset, str(tmp_path), None) == str(path) and path.read_bytes() == DATA
+
+def test_tables_loaded_elsewhere_are_not_truncated(tmp_path, monkeypatch):
+    queries = []
+
+    class Client:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def execute(self, query):
+            queries.append(query)
+            return [(10,)]
+
+    monkeypatch.setattr(setup_example_datasets, 'Client', Client)
+    setup_dataset(DATASETS[1], str(tmp_path))
+    assert not any(query.startswith('TRUNCATE') for query in queries)
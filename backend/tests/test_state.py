@@ -0,0 +1,58 @@
+import time
+from multiprocessing import get_context
+
+import pytest
+
+from state import MemoryState, RedisState, SQLiteState, StateBackend, create_state
+
+
+class ScanClient:
+    """Records the pattern a Redis SCAN was issued with"""
+
+    def scan_iter(self, match):
+        self.match = match
+        return iter([b'cache:[a]*?\\1'])
+
+
+def write_progress(path, worker):
+    SQLiteState(path).set(f"progress:t{worker}", worker * 10.0)
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def state(request, tmp_path):
+    return MemoryState() if request.param == 'memory' else SQLiteState(str(tmp_path / 'state.db'))
+
+def test_state_round_trips_json_values(state):
+    state.set('job:1', {'status': 'running', 'files': ['a.csv']})
+    assert state.get('job:1') == {'status': 'running', 'files': ['a.csv']}
+    assert state.keys('job:') == ['job:1']
+    state.delete('job:1')
+    assert state.get('job:1') is None
+
+def test_state_entries_expire(state):
+    state.set('progress:t1', 50.0, ex=0.05)
+    assert state.get('progress:t1') == 50.0
+    time.sleep(0.1)
+    assert state.get('progress:t1') is None
+    assert state.keys('progress:') == []
+
+def test_sqlite_state_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    context = get_context('spawn')
+    workers = [context.Process(target=write_progress, args=(path, i)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    state = create_state(f"sqlite:///{path}")
+    assert sorted(state.keys('progress:')) == ['progress:t0', 'progress:t1', 'progress:t2']
+    assert state.get('progress:t2') == 20.0
+
+def test_state_backends_implement_every_method():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_redis_keys_match_the_prefix_literally():
+    state = RedisState.__new__(RedisState)
+    state._client = ScanClient()
+    assert state.keys('cache:[a]*?\\') == ['cache:[a]*?\\1']
+    assert state._client.match == 'cache:\\[a\\]\\*\\?\\\\*'
@@ -0,0 +1,45 @@
+import asyncio
+import io
+
+import pandas as pd
+import pytest
+
+from csv_chunks import CsvStreamSplitter, read_chunk
+from fake_clickhouse import FakeClient
+
+CSV = b'id,note\n' + b''.join(b'%d,"line %d\nnext, ""quoted"""\n' % (i, i) for i in range(500)) + b'500,plain'
+
+
+def split(data, block_size, max_rows):
+    splitter = CsvStreamSplitter(max_rows=max_rows)
+    chunks = []
+    for start in range(0, len(data), block_size):
+        chunks.extend(splitter.feed(data[start:start + block_size]))
+    return chunks + splitter.close()
+
+@pytest.mark.parametrize('block_size', [1, 13, 4096, len(CSV)])
+def test_stream_splitter_matches_a_full_parse(block_size):
+    chunks = split(CSV, block_size, max_rows=64)
+    assert all(chunk.lines <= 64 for chunk in chunks)
+    assert all(a.end == b.start for a, b in zip(chunks, chunks[1:])) and chunks[-1].end == len(CSV)
+    frame = pd.concat([read_chunk(chunk) for chunk in chunks], ignore_index=True)
+    assert frame.equals(pd.read_csv(io.BytesIO(CSV)))
+
+def test_unquoted_blocks_respect_max_rows():
+    data = b'a,b\n' + b''.join(b'%d,%d\n' % (i, i) for i in range(10000))
+    chunks = split(data, 65536, max_rows=1000)
+    assert [chunk.lines for chunk in chunks] == [1000] * 10
+
+def test_stream_import_inserts_every_chunk():
+    import main
+    client = FakeClient()
+    client.add_table('notes', [('id', 'Int64'), ('note', 'String')])
+
+    async def body():
+        for start in range(0, len(CSV), 1000):
+            yield CSV[start:start + 1000]
+
+    result = asyncio.run(main.import_csv_stream(client, 'notes', body()))
+    assert result['records_processed'] == 501
+    assert result['bytes_received'] == len(CSV)
+    assert client.inserted_rows['notes'] == 501
@@ -0,0 +1,35 @@
+import gzip
+import io
+
+import pandas as pd
+
+from benchmarks.datasets import DATASETS, iter_blocks, make_block, make_csv_block, table_columns, write_csv
+
+
+def test_blocks_match_the_table_schema():
+    for name, (ddl, _) in DATASETS.items():
+        frame = make_block(name, 0, 1000)
+        assert list(frame.columns) == [column for column, _ in table_columns(ddl)]
+    uk_price_paid = make_block('uk_price_paid', 0, 1000)
+    assert set(uk_price_paid['type']) <= {'terraced', 'semi-detached', 'detached', 'flat', 'other'}
+    assert uk_price_paid.groupby('town')['county'].nunique().max() == 1
+    ontime = make_block('ontime', 0, 1000)
+    assert ontime['Carrier'].str.len().max() <= 2 and (ontime['Origin'] != ontime['Dest']).all()
+
+def test_csv_blocks_render_every_column():
+    frame = make_block('ontime', 3, 500)
+    parsed = pd.read_csv(io.BytesIO(make_csv_block('ontime', 3, 500)), header=None, dtype=str, keep_default_na=False)
+    expected = pd.read_csv(io.BytesIO(frame.to_csv(index=False, header=False).encode()), header=None, dtype=str,
+                           keep_default_na=False)
+    assert parsed.equals(expected)
+
+def test_output_does_not_depend_on_workers():
+    serial = b''.join(iter_blocks(make_csv_block, 'uk_price_paid', 2500, block_rows=1000))
+    parallel = b''.join(iter_blocks(make_csv_block, 'uk_price_paid', 2500, block_rows=1000, workers=2))
+    assert serial == parallel
+
+def test_write_csv_streams_blocks(tmp_path):
+    path = str(tmp_path / 'uk_price_paid.csv.gz')
+    write_csv('uk_price_paid', path, 2500, block_rows=1000)
+    frame = pd.read_csv(gzip.open(path))
+    assert len(frame) == 2500 and frame.columns[0] == 'price'
@@ -1,14 +1,30 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Security
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+import asyncio
 import clickhouse_driver # type: ignore
-import pandas as pd # type: ignore
 import os
+import sys
 import time
-import jwt # type: ignore
-from datetime import datetime, timedelta
+from datetime import date, datetime
+from decimal import Decimal
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+
+# Modules shared with the backend service live in backend/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from csv_chunks import iter_csv_chunks, read_chunk # noqa: E402
+from checkpoints import CHECKPOINT_CHUNK_ROWS, CheckpointConflict, CheckpointStore, dedup_token # noqa: E402
+import metrics # noqa: E402
+from metrics import STAGE_SECONDS, ROWS_TOTAL, BYTES_TOTAL # noqa: E402
+from auth import verify_token # noqa: E402
+from state import get_state # noqa: E402
+from ch_types import categorical_dtypes, infer_type, python_type, to_driver # noqa: E402
+import arrow_plane # noqa: E402
+from arrow_plane import CLICKHOUSE_HTTP_PORT, DATA_PLANE, DATA_PLANES, ClickHouseHTTP # noqa: E402
+import query_builder # noqa: E402
+from query_builder import Query # noqa: E402
+from ch_transfer import TRANSFER_MODE, TRANSFER_MODES, copy_remote, copy_stream, create_target, remote_source # noqa: E402
 
 app = FastAPI()
 
@@ -21,41 +37,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# JWT Configuration
-SECRET_KEY = "your-secret-key"  # In production, use environment variable
-ALGORITHM = "HS256"
-security = HTTPBearer()
-
-# ClickHouse to Python type mapping
-CLICKHOUSE_TO_PYTHON = {
-    'UInt8': 'int',
-    'UInt16': 'int',
-    'UInt32': 'int',
-    'UInt64': 'int',
-    'Int8': 'int',
-    'Int16': 'int',
-    'Int32': 'int',
-    'Int64': 'int',
-    'Float32': 'float',
-    'Float64': 'float',
-    'String': 'str',
-    'Date': 'date',
-    'DateTime': 'datetime',
-    'Bool': 'bool'
-}
-
-# Python to ClickHouse type mapping
-PYTHON_TO_CLICKHOUSE = {
-    'int': 'Int64',
-    'float': 'Float64',
-    'str': 'String',
-    'bool': 'Bool',
-    'date': 'Date',
-    'datetime': 'DateTime'
-}
+# Progress of each transfer, shared between worker processes
+progress_state = get_state()
+PROGRESS_TTL = 24 * 3600
 
-# Store progress for each transfer
-transfer_progress: Dict[str, float] = {}
+# Per-chunk checkpoints of file loads, used to resume failed transfers
+checkpoint_store = CheckpointStore()
 
 CLICKHOUSE_CONFIG = {
     'host': 'localhost',
@@ -86,23 +73,8 @@ class TransferRequest(BaseModel):
     transfer_id: str
     type_mappings: Optional[Dict[str, str]] = None
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
 def get_clickhouse_schema(client: clickhouse_driver.Client, database: str, table: str) -> Dict[str, str]:
-    query = f"""
-    SELECT name, type
-    FROM system.columns
-    WHERE database = '{database}' AND table = '{table}'
-    """
-    result = client.execute(query)
+    result = query_builder.table_columns(database, table).execute(client)
     return {row[0]: row[1] for row in result}
 
 def infer_python_type(value: Any) -> str:
@@ -137,13 +109,33 @@ def convert_value(value: Any, target_type: str) -> Any:
         elif target_type == 'bool':
             return bool(value)
         elif target_type == 'date':
-            return datetime.strptime(value, '%Y-%m-%d').date()
+            return value if isinstance(value, date) else datetime.strptime(value, '%Y-%m-%d').date()
         elif target_type == 'datetime':
-            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+            return value if isinstance(value, datetime) else datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        elif target_type == 'decimal':
+            return value if isinstance(value, Decimal) else Decimal(str(value))
+        elif target_type in ('list', 'dict', 'tuple'):
+            # Composite values come from the driver already converted
+            return value
         return str(value)
     except (ValueError, TypeError):
         return str(value)
 
+def convert_rows(result: List[tuple], columns_list: List[str], schema: Dict[str, str]) -> List[Dict[str, Any]]:
+    converted_data = []
+    for row in result:
+        converted_row = {}
+        for col, val in zip(columns_list, row):
+            clickhouse_type = schema.get(col, 'String')
+            converted_row[col] = convert_value(val, python_type(clickhouse_type))
+        converted_data.append(converted_row)
+    return converted_data
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/preview")
 async def preview_data(
     source: str,
@@ -164,23 +156,19 @@ async def preview_data(
             schema = get_clickhouse_schema(client, 'test_data', table)
             
             # Get total count for progress calculation
-            count_query = f"SELECT count() FROM {table}"
-            total_count = client.execute(count_query)[0][0]
+            total_count = query_builder.count(table).execute(client)[0][0]
             
             # Get sample data
-            query = f"SELECT {columns} FROM {table} LIMIT 100"
-            result = client.execute(query)
-            columns_list = columns.split(',')
+            columns_list = [column.strip() for column in columns.split(',')]
+            query = query_builder.select(table, columns_list, limit=100)
+            route = 'preview'
+            with STAGE_SECONDS.time(route=route, stage='query'):
+                result = query.execute(client)
             
             # Convert data types
-            converted_data = []
-            for row in result:
-                converted_row = {}
-                for col, val in zip(columns_list, row):
-                    clickhouse_type = schema.get(col, 'String')
-                    python_type = CLICKHOUSE_TO_PYTHON.get(clickhouse_type, 'str')
-                    converted_row[col] = convert_value(val, python_type)
-                converted_data.append(converted_row)
+            with STAGE_SECONDS.time(route=route, stage='convert'):
+                converted_data = convert_rows(result, columns_list, schema)
+            ROWS_TOTAL.inc(len(converted_data), route=route, table=table)
             
             return {
                 "data": converted_data,
@@ -195,10 +183,148 @@ async def preview_data(
 
 @app.get("/progress/{transfer_id}")
 async def get_progress(transfer_id: str):
-    return {"progress": transfer_progress.get(transfer_id, 0)}
+    return {"progress": progress_state.get(f"progress:{transfer_id}") or 0}
 
 async def update_progress(transfer_id: str, progress: float):
-    transfer_progress[transfer_id] = progress
+    progress_state.set(f"progress:{transfer_id}", progress, ex=PROGRESS_TTL)
+
+def connect_from_config(config: Dict[str, Any], token) -> clickhouse_driver.Client:
+    return clickhouse_driver.Client(
+        host=config.get('host', CLICKHOUSE_CONFIG['host']),
+        port=int(config.get('port', CLICKHOUSE_CONFIG['port'])),
+        database=config.get('database', CLICKHOUSE_CONFIG['database']),
+        user=config.get('username', CLICKHOUSE_CONFIG['user']),
+        password=config.get('password', CLICKHOUSE_CONFIG['password']),
+        jwt_token=token
+    )
+
+def http_from_config(config: Dict[str, Any], token) -> ClickHouseHTTP:
+    return ClickHouseHTTP(
+        host=config.get('host', CLICKHOUSE_CONFIG['host']),
+        port=int(config.get('http_port', CLICKHOUSE_HTTP_PORT)),
+        user=config.get('username', CLICKHOUSE_CONFIG['user']),
+        password=config.get('password', CLICKHOUSE_CONFIG['password']),
+        database=config.get('database', CLICKHOUSE_CONFIG['database']),
+        jwt_token=token
+    )
+
+async def load_file_to_clickhouse(
+    client: clickhouse_driver.Client,
+    table: str,
+    columns: List[str],
+    transfer_id: str,
+    http: Optional[ClickHouseHTTP] = None
+) -> int:
+    """Load the checkpointed transfer's file from its last committed byte offset.
+
+    Chunks have the row count stored with the checkpoint, so a resumed load
+    cuts the chunks the interrupted one did and their tokens match.
+    With http, chunks after the one the table is created from take the Arrow data plane.
+    """
+    checkpoint = checkpoint_store.get(transfer_id)
+    params = checkpoint['params']
+    file_size = checkpoint['source_size'] or 1
+    rows_loaded = 0
+    
+    try:
+        with open(params['filePath'], 'rb') as source:
+            for chunk in iter_csv_chunks(source, max_rows=params.get('chunk_rows', CHECKPOINT_CHUNK_ROWS),
+                                         offset=checkpoint['byte_offset']):
+                # Once the table exists, chunks parse against its types: into Arrow
+                # tables on the Arrow plane, with LowCardinality columns as Categoricals otherwise
+                type_mappings = params.get('type_mappings')
+                arrow_types = arrow_plane.column_types(type_mappings) if http and type_mappings else None
+                batch = None
+                if arrow_types:
+                    with STAGE_SECONDS.time(route='transfer', stage='parse'):
+                        batch = arrow_plane.read_csv_chunk(chunk, params['delimiter'], arrow_types)
+                if batch is not None:
+                    with STAGE_SECONDS.time(route='transfer', stage='insert'):
+                        rows = http.insert(table, batch.select(columns), dedup_token(transfer_id, chunk.start))
+                else:
+                    with STAGE_SECONDS.time(route='transfer', stage='parse'):
+                        frame = read_chunk(chunk, params['delimiter'], categorical_dtypes(type_mappings or {}))
+                
+                    # Infer types from the first chunk and create the table once
+                    if type_mappings is None:
+                        type_mappings = {col: infer_type(frame[col]) for col in columns}
+                    
+                        create_table_query = f"""
+                        CREATE TABLE IF NOT EXISTS {query_builder.identifier(table)} (
+                            {', '.join([f'{query_builder.identifier(col)} {type_mappings[col]}' for col in columns])}
+                        ) ENGINE = MergeTree()
+                        ORDER BY tuple()
+                        """
+                        client.execute(create_table_query)
+                        params['type_mappings'] = type_mappings
+                        checkpoint_store.update_params(transfer_id, params)
+                
+                    # Convert data types
+                    with STAGE_SECONDS.time(route='transfer', stage='convert'):
+                        converted_data = list(zip(*(to_driver(frame[col], type_mappings[col]) for col in columns)))
+                
+                    # The chunk's byte offset doubles as its deduplication token,
+                    # so a chunk re-sent after a crash is dropped by the server
+                    with STAGE_SECONDS.time(route='transfer', stage='insert'):
+                        client.execute(
+                            query_builder.insert(table, columns),
+                            converted_data,
+                            settings=dedup_token(transfer_id, chunk.start)
+                        )
+                    rows = len(converted_data)
+                ROWS_TOTAL.inc(rows, route='transfer', table=table)
+                BYTES_TOTAL.inc(len(chunk.data), route='transfer', table=table)
+                checkpoint_store.commit_chunk(transfer_id, chunk.end, rows)
+                rows_loaded += rows
+                
+                progress = (chunk.end / file_size) * 100
+                await update_progress(transfer_id, progress)
+    except Exception:
+        checkpoint_store.finish(transfer_id, 'failed')
+        raise
+    
+    checkpoint_store.finish(transfer_id)
+    return checkpoint['rows'] + rows_loaded
+
+def copy_clickhouse_tables(
+    table: str,
+    columns: List[str],
+    config: Dict[str, Any],
+    join_conditions: Optional[List[Dict[str, str]]],
+    token
+) -> int:
+    """Copy between the config's 'source' and 'target' servers without decoding rows here"""
+    mode = config.get('mode', TRANSFER_MODE)
+    if mode not in TRANSFER_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(TRANSFER_MODES)}")
+    source_config, target_config = config.get('source', {}), config.get('target', {})
+    target_table = config.get('target_table', table)
+    joins = [(cond['left_table'], cond['left_key'], cond['right_table'], cond['right_key'])
+             for cond in join_conditions or []]
+    select = query_builder.join_select(columns, table, joins).sql
+    target_client = connect_from_config(target_config, token)
+    if config.get('create_table', True):
+        create_target(connect_from_config(source_config, token), target_client, target_table, select, columns)
+    if mode == 'stream':
+        rows, size = copy_stream(http_from_config(source_config, token), http_from_config(target_config, token),
+                                 target_table, columns, select)
+    else:
+        params: Dict[str, Any] = {}
+        address = config.get('source_address') or (
+            f"{source_config.get('host', CLICKHOUSE_CONFIG['host'])}:{source_config.get('port', CLICKHOUSE_CONFIG['port'])}"
+        )
+        remote_select = query_builder.join_select(columns, table, joins, source=remote_source(
+            address,
+            source_config.get('database', CLICKHOUSE_CONFIG['database']),
+            source_config.get('username', CLICKHOUSE_CONFIG['user']),
+            source_config.get('password', CLICKHOUSE_CONFIG['password']),
+            params,
+            config.get('secure', False)
+        )).sql
+        rows, size = copy_remote(target_client, target_table, columns, remote_select, params)
+    ROWS_TOTAL.inc(rows, route='transfer', table=target_table)
+    BYTES_TOTAL.inc(size, route='transfer', table=target_table)
+    return rows
 
 @app.post("/transfer")
 async def transfer_data(
@@ -212,17 +338,25 @@ async def transfer_data(
     token: str = Depends(verify_token)
 ):
     try:
-        if source == "clickhouse":
+        if source == "clickhouse" and target == "clickhouse":
+            # The copy blocks until the servers are done; keep it off the event loop
+            with STAGE_SECONDS.time(route='transfer', stage='copy'):
+                total_rows = await asyncio.to_thread(
+                    copy_clickhouse_tables, table, columns, config, join_conditions, token
+                )
+            await update_progress(transfer_id, 100)
+            return {"status": "success", "records_processed": total_rows}
+            
+        elif source == "clickhouse":
             # Handle JOIN query if join_conditions are provided
             if join_conditions and len(join_conditions) > 0:
                 # Construct JOIN query
-                join_clause = " ".join([
-                    f"JOIN {cond['right_table']} ON {cond['left_table']}.{cond['left_key']} = {cond['right_table']}.{cond['right_key']}"
+                query = query_builder.join_select(columns, table, [
+                    (cond['left_table'], cond['left_key'], cond['right_table'], cond['right_key'])
                     for cond in join_conditions
                 ])
-                query = f"SELECT {', '.join(columns)} FROM {table} {join_clause}"
             else:
-                query = f"SELECT {', '.join(columns)} FROM {table}"
+                query = query_builder.select(table, columns)
             
             client = clickhouse_driver.Client(
                 host='localhost',
@@ -235,22 +369,18 @@ async def transfer_data(
             schema = get_clickhouse_schema(client, 'test_data', table)
             
             # Get total count for progress calculation
-            count_query = f"SELECT count() FROM {table}"
-            total_count = client.execute(count_query)[0][0]
+            total_count = query_builder.count(table).execute(client)[0][0]
             
             # Get sample data
-            result = client.execute(query)
+            route = 'transfer'
+            with STAGE_SECONDS.time(route=route, stage='query'):
+                result = query.execute(client)
             columns_list = columns
             
             # Convert data types
-            converted_data = []
-            for row in result:
-                converted_row = {}
-                for col, val in zip(columns_list, row):
-                    clickhouse_type = schema.get(col, 'String')
-                    python_type = CLICKHOUSE_TO_PYTHON.get(clickhouse_type, 'str')
-                    converted_row[col] = convert_value(val, python_type)
-                converted_data.append(converted_row)
+            with STAGE_SECONDS.time(route=route, stage='convert'):
+                converted_data = convert_rows(result, columns_list, schema)
+            ROWS_TOTAL.inc(len(converted_data), route=route, table=table)
             
             return {
                 "data": converted_data,
@@ -260,72 +390,73 @@ async def transfer_data(
             }
             
         elif source == "flatfile" and target == "clickhouse":
-            if not os.path.exists(config.filePath):
+            file_path = config.get('filePath')
+            if not file_path or not os.path.exists(file_path):
                 raise HTTPException(status_code=400, detail="File not found")
-                
-            df = pd.read_csv(config.filePath, sep=config.delimiter)
-            total_rows = len(df)
             
-            client = clickhouse_driver.Client(
-                host=config.host,
-                port=config.port,
-                database=config.database,
-                user=config.username,
-                password=config.password,
-                jwt_token=token
-            )
-            
-            # Infer types from data
-            type_mappings = {}
-            for col in columns:
-                sample = df[col].dropna().iloc[0] if not df[col].empty else None
-                if sample is not None:
-                    python_type = infer_python_type(sample)
-                    clickhouse_type = PYTHON_TO_CLICKHOUSE.get(python_type, 'String')
-                    type_mappings[col] = clickhouse_type
-                else:
-                    type_mappings[col] = 'String'
-            
-            # Create table with inferred types
-            create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS {table} (
-                {', '.join([f'{col} {type_mappings[col]}' for col in columns])}
-            ) ENGINE = MergeTree()
-            ORDER BY tuple()
-            """
-            client.execute(create_table_query)
+            data_plane = config.get('data_plane', DATA_PLANE)
+            if data_plane not in DATA_PLANES:
+                raise HTTPException(status_code=400, detail=f"data_plane must be one of {', '.join(DATA_PLANES)}")
             
-            # Insert data in chunks
-            chunk_size = 1000
-            for i in range(0, total_rows, chunk_size):
-                chunk = df.iloc[i:i+chunk_size]
-                # Convert data types
-                converted_data = []
-                for _, row in chunk.iterrows():
-                    converted_row = []
-                    for col in columns:
-                        clickhouse_type = type_mappings[col]
-                        python_type = CLICKHOUSE_TO_PYTHON.get(clickhouse_type, 'str')
-                        converted_row.append(convert_value(row[col], python_type))
-                    converted_data.append(tuple(converted_row))
-                
-                client.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES", converted_data)
-                
-                progress = ((i + len(chunk)) / total_rows) * 100
-                await update_progress(transfer_id, progress)
+            client = connect_from_config(config, token)
+            checkpoint_store.start(
+                transfer_id, 'transfer', table,
+                {"filePath": file_path, "delimiter": config.get('delimiter', ','), "columns": columns,
+                 "data_plane": data_plane, "chunk_rows": CHECKPOINT_CHUNK_ROWS},
+                os.path.getsize(file_path)
+            )
+            http = http_from_config(config, token) if data_plane == 'arrow' else None
+            total_rows = await load_file_to_clickhouse(client, table, columns, transfer_id, http)
             
             return {"status": "success", "records_processed": total_rows}
             
         else:
             raise HTTPException(status_code=400, detail="Unsupported source/target combination")
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CheckpointConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if transfer_id in transfer_progress:
-            del transfer_progress[transfer_id] 
+        progress_state.delete(f"progress:{transfer_id}") 
 
-def build_join_query(joinConfig: Dict, columns: List[str]) -> str:
+@app.post("/transfer/resume/{transfer_id}")
+async def resume_transfer(
+    transfer_id: str,
+    config: Dict[str, Any],
+    token: str = Depends(verify_token)
+):
+    checkpoint = checkpoint_store.get(transfer_id)
+    if checkpoint is None or checkpoint['kind'] != 'transfer':
+        raise HTTPException(status_code=404, detail=f"No checkpoint for transfer {transfer_id}")
+    if checkpoint['status'] == 'completed':
+        return {"status": "success", "records_processed": checkpoint['rows']}
+    
+    file_path = checkpoint['params']['filePath']
+    if not os.path.exists(file_path) or os.path.getsize(file_path) != checkpoint['source_size']:
+        raise HTTPException(status_code=409, detail="Source file changed since the transfer started")
+    
+    try:
+        client = connect_from_config(config, token)
+        http = http_from_config(config, token) if checkpoint['params'].get('data_plane') == 'arrow' else None
+        total_rows = await load_file_to_clickhouse(
+            client, checkpoint['target_table'], checkpoint['params']['columns'], transfer_id, http
+        )
+        return {
+            "status": "success",
+            "resumed_from_byte": checkpoint['byte_offset'],
+            "records_processed": total_rows
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        progress_state.delete(f"progress:{transfer_id}")
+
+def build_join_query(joinConfig: Dict, columns: List[str]) -> Query:
     """Build SQL query for joining multiple tables"""
     join_type = joinConfig.get('joinType', 'INNER')
     tables = joinConfig.get('tables', [])
@@ -333,18 +464,10 @@ def build_join_query(joinConfig: Dict, columns: List[str]) -> str:
     if len(tables) < 2:
         raise HTTPException(status_code=400, detail="At least two tables required for join")
     
-    # Start with the first table
-    query = f"SELECT {', '.join(columns)} FROM {tables[0].get('table')}"
-    
-    # Add joins
-    for i in range(1, len(tables)):
-        prev_table = tables[i-1]
-        curr_table = tables[i]
-        query += f" {join_type} JOIN {curr_table.get('table')} ON "
-        query += f"{prev_table.get('table')}.{prev_table.get('key')} = "
-        query += f"{curr_table.get('table')}.{curr_table.get('key')}"
-    
-    return query 
+    # Each table joins the one before it
+    joins = [(prev_table.get('table'), prev_table.get('key'), curr_table.get('table'), curr_table.get('key'))
+             for prev_table, curr_table in zip(tables, tables[1:])]
+    return query_builder.join_select(columns, tables[0].get('table'), joins, join_type)
 
 @app.post("/api/connect/clickhouse")
 async def connect_clickhouse(config: ClickhouseConfig):